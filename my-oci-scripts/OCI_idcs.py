@@ -9,24 +9,47 @@
 # Prerequisites: 
 # - Python 3 installed
 # - IDCS OAuth2 application created with Client ID and Client secret available
+# - OCI_idcs_async.py and OCI_idcs_mirror.py in the same directory
 #
 # Versions
 #    2020-01-08: Initial Version
+#    2020-05-21: get all users/groups with SCIM pagination (startIndex/totalResults), pages fetched concurrently
+#    2020-05-22: find user/group ids from names with a SCIM filter (no more download of all users/groups)
+#    2020-05-23: reuse HTTPS connections (requests.Session) and cache the OAuth2 token until it expires
+#    2020-05-24: add bulk_add_users, bulk_add_groups and bulk_add_users_to_groups operations (SCIM Bulk requests)
+#    2020-05-25: add membership_report operation (concurrent requests with OCI_idcs_async.py)
+#    2020-05-26: add mirror_sync operation and --mirror option (read-only operations served by a local mirror)
+#    2020-05-27: stream the lists of users/groups (--output table|csv|jsonl), external merge sort of large lists
+#    2020-05-28: request only the attributes displayed by list operations (attributes=), add benchmark_attributes operation
+#    2020-05-29: add --endpoint option (ex: local stand-in OCI_idcs_standin_server.py), retry requests refused with status 429
+#    2020-05-30: add reconcile_group_members operation
+#    2020-05-31: user and group names not case sensitive in bulk_add_users_to_groups and reconcile_group_members
 # --------------------------------------------------------------------------------------------------------------------------
 
 # -- import
 import sys
+import os
+import csv
+import time
+import threading
 import base64
+import hashlib
 import json
+import heapq
+import itertools
+import tempfile
 import requests
+import urllib.parse
+import OCI_idcs_async
+import OCI_idcs_mirror
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
-from columnar import columnar
 from operator import itemgetter, attrgetter
 
 # -- Usage
 def usage():
-    print ("Usage: python3 {} operation [parameters]".format(sys.argv[0]))
+    print ("Usage: python3 {} [--endpoint url] [--mirror] [--output table|csv|jsonl] operation [parameters]".format(sys.argv[0]))
     print ("")
     print ("Supported operations:")
     print ("- set_credentials idcs_instance client_ID client_secret        (prerequisite to all operations)")
@@ -45,9 +68,30 @@ def usage():
     print ("- activate_user username")
     print ("- delete_user username [--confirm]")
     print ("- delete_group groupname [--confirm]")
+    print ("- bulk_add_users file [--fail-on-errors n]")
+    print ("- bulk_add_groups file [--fail-on-errors n]")
+    print ("- bulk_add_users_to_groups file [--fail-on-errors n]")
+    print ("- reconcile_group_members file [--dry-run]                    (set the members of groups to the members in the file)")
+    print ("- membership_report [file.csv]                                (matrix of all users and groups, default: standard output)")
+    print ("- mirror_sync [--full]                                        (create or update the local mirror)")
+    print ("- benchmark_attributes                                        (bytes received by list operations with/without attributes=)")
     print ("")
     print ("Notes:")
     print ("  If --confirm is provided in delete_user or delete_group operation, then deletion is done without asking for confirmation")
+    print ("  Files of bulk operations are CSV files with a header line, or JSONL files (.jsonl) with one JSON object per line:")
+    print ("  - bulk_add_users          : username,first_name,last_name,email")
+    print ("  - bulk_add_groups         : groupname,description")
+    print ("  - bulk_add_users_to_groups: username,groupname[,action]   (action: add (default) or remove)")
+    print ("  - reconcile_group_members : username,groupname                (empty username: group without members)")
+    print ("                              or JSONL {\"groupname\": \"group1\", \"members\": [\"user1\", \"user2\"]}")
+    print ("  Bulk requests contain up to {} operations. With --fail-on-errors n, the requests are sent one after the other".format(BULK_SIZE))
+    print ("  and the processing stops after n errors, otherwise the requests are sent concurrently and all operations are tried.")
+    print ("  With --mirror, the following operations are served by the local mirror (no IDCS request) created or updated by")
+    print ("  mirror_sync (only the changes since the previous synchronization are requested, --full to get everything again):")
+    print ("  {}".format(", ".join(MIRROR_OPERATIONS)))
+    print ("  --endpoint replaces the IDCS endpoint of the credentials file (ex: http://127.0.0.1:8000 for OCI_idcs_standin_server.py)")
+    print ("  --output selects the format of list_users, list_users_long and list_groups (default: table). The lines are")
+    print ("  displayed as the objects are received, except for sorted lists (sorted in temporary files if more than {} lines)".format(SORT_BUFFER))
     print ("")
     print ("Examples:")
     print ("  python3 {} set_credentials idcs-f0f03632a0e346fdaccfaf527xxxxxx xxxxxxxxx xxxxxxxxxxx".format(sys.argv[0]))
@@ -56,9 +100,31 @@ def usage():
 
 # -------- variables
 CREDENTIALS_FILE=str(Path.home())+"/.oci/idcs_credentials.python3"
-MAX_OBJECTS="200"
+MAX_OBJECTS="200"           # number of objects per page in SCIM list requests
+MAX_WORKERS=8               # max number of pages (or bulk requests) requested concurrently
+BULK_SIZE=50                # max number of operations per SCIM Bulk request
+MAX_RETRIES=5               # max number of retries of a request refused with status 429 (too many requests)
+FILTER_SIZE=50              # max number of names per SCIM filter (name eq "a" or name eq "b" ...)
+TOKEN_CACHE_FILE=str(Path.home())+"/.oci/idcs_token_cache.python3"
+TOKEN_REFRESH_MARGIN=300    # get a new token when the cached one expires in less than this number of seconds
 IDCS_END_POINT="xx"
+END_POINT_OVERRIDE=None     # --endpoint option
 TOKEN="xx"
+TOKEN_FROM_CACHE=False
+TOKEN_LOCK=threading.Lock()  # one token refresh at a time
+SESSION=None                # keep-alive HTTPS connections to IDCS_END_POINT
+ASYNC_SESSION=None          # same connections for OCI_idcs_async.py (no retry of status 429, done by the async client)
+USE_MIRROR=False            # --mirror option: read-only operations served by the local mirror
+MIRROR=None                 # local mirror (OCI_idcs_mirror.Mirror) if USE_MIRROR
+OUTPUT_FORMAT="table"       # --output option
+SORT_BUFFER=100000          # max number of lines sorted in memory, longer lists are sorted with temporary files (merge sort)
+TABLE_SAMPLE=1000           # number of first lines used to compute the widths of the table columns
+# columns of list operations: (name in CSV/JSONL output, table header, SCIM attribute requested and displayed)
+USERS_COLUMNS=[ ('user_name','====== USER NAME ======','userName'), ('active','ACTIVE','active'), ('id','====== USER ID ======','id') ]
+USERS_LONG_COLUMNS=USERS_COLUMNS + [ ('title','==== TITLE ====','title'), ('created','==== CREATION DATE ====','meta.created'),
+                                     ('created_by','==== CREATED BY ====','idcsCreatedBy.display') ]
+GROUPS_COLUMNS=[ ('id','==== GROUP ID ====','id'), ('display_name','==== GROUP NAME ====','displayName') ]
+MIRROR_OPERATIONS=[ "list_users", "list_users_long", "list_groups", "list_users_in_group", "list_groups_of_user", "show_user", "show_group" ]
 
 # -------- functions
 def fatal_error(error_number):
@@ -68,6 +134,12 @@ def fatal_error(error_number):
   elif (error_number == 5):    print ("ERROR 5: user name not found !")
   elif (error_number == 6):    print ("ERROR 6: group name not found !")
   elif (error_number == 7):    print ("ERROR 7: API request error !")
+  elif (error_number == 8):    print ("ERROR 8: cannot read input file !")
+  elif (error_number == 9):    print ("ERROR 9: syntax error in input file !")
+  elif (error_number == 10):   print ("ERROR 10: some operations failed !")
+  elif (error_number == 11):   print ("ERROR 11: cannot create output file !")
+  elif (error_number == 12):   print ("ERROR 12: local mirror {} not found ! Run mirror_sync operation.".format(mirror_file()))
+  elif (error_number == 13):   print ("ERROR 13: some user or group names not found, no group updated !")
   sys.exit (error_number)
 
 # ---- create credentials file
@@ -87,21 +159,101 @@ def set_credentials(argv):
     f.writelines (str(base64.b64encode(data.encode("utf-8")),"utf-8")+"\n")
     f.close ()
 
-# ---- get auth_token
-def get_auth_token(b64code):
-    global TOKEN
+# ---- key of the token cache for an IDCS endpoint and client (the credentials are not stored in the cache)
+def token_cache_key(b64code):
+    return hashlib.sha256((IDCS_END_POINT+" "+b64code).encode("utf-8")).hexdigest()
+
+# ---- read the token cache file: dictionary key -> { "access_token", "expires_at" }
+def read_token_cache():
+    try:
+        with open(TOKEN_CACHE_FILE,"r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# ---- save a token in the token cache file (readable only by the owner), errors are ignored (the cache is optional)
+def save_token(b64code, token, expires_in):
+    cache = { key: entry for key, entry in read_token_cache().items() if entry.get("expires_at", 0) > time.time() }
+    cache[token_cache_key(b64code)] = { "access_token": token, "expires_at": time.time() + expires_in }
+    try:
+        fd = os.open(TOKEN_CACHE_FILE+".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f)
+        os.replace(TOKEN_CACHE_FILE+".tmp", TOKEN_CACHE_FILE)
+    except OSError:
+        pass
+
+# ---- get auth_token (from the token cache if it is still valid for more than TOKEN_REFRESH_MARGIN seconds)
+def get_auth_token(b64code, use_cache=True):
+    global TOKEN, TOKEN_FROM_CACHE
+
+    if use_cache:
+        entry = read_token_cache().get(token_cache_key(b64code))
+        if entry != None and entry.get("expires_at", 0) - TOKEN_REFRESH_MARGIN > time.time():
+            TOKEN = entry["access_token"]
+            TOKEN_FROM_CACHE = True
+            return
 
     api_url=IDCS_END_POINT+"/oauth2/v1/token"
     headers = { 'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8',
                 'Authorization': 'Basic '+b64code }
     payload = "grant_type=client_credentials&scope=urn:opc:idm:__myscopes__"
 
-    r = requests.post(api_url, headers=headers, data=payload)
-    TOKEN = json.loads(r.text)['access_token']
+    r = SESSION.post(api_url, headers=headers, data=payload)
+    response = json.loads(r.text)
+    TOKEN = response['access_token']
+    TOKEN_FROM_CACHE = False
+    save_token(b64code, TOKEN, int(response.get('expires_in', 3600)))
+
+# ---- create the HTTPS session: connections kept alive and reused by all requests (pool sized for concurrent pages)
+# ---- if a cached token is refused (revoked), a new token is requested once and the request is sent again
+# ---- if a request is refused with status 429 (too many requests), it is sent again after the Retry-After delay
+# ---- (except for ASYNC_SESSION: the async client retries with a delay shared by all its requests)
+def create_session(b64code):
+    global SESSION, ASYNC_SESSION
+
+    SESSION = requests.Session()
+    ASYNC_SESSION = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS)
+    for session in [ SESSION, ASYNC_SESSION ]:
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    def retry_with_new_token(r, *args, **kwargs):
+        used = r.request.headers.get('Authorization','')
+        if r.status_code != 401 or not used.startswith('Bearer ') or getattr(r.request, 'new_token', False):
+            return r
+        # concurrent requests refused with the same token: only the first one gets a new token, the others reuse it
+        with TOKEN_LOCK:
+            if used == 'Bearer '+TOKEN:
+                if not TOKEN_FROM_CACHE: return r
+                get_auth_token(b64code, use_cache=False)
+        request = r.request.copy()
+        request.headers['Authorization'] = 'Bearer '+TOKEN
+        request.new_token = True
+        return SESSION.send(request, **kwargs)         # hooks of the request (SESSION or ASYNC_SESSION) used again
+
+    def retry_when_too_many_requests(r, *args, **kwargs):
+        retries = getattr(r.request, 'retries', 0)
+        if r.status_code != 429 or retries >= MAX_RETRIES:
+            return r
+        delay = r.headers.get('Retry-After', '')
+        time.sleep(int(delay) if delay.isdigit() else 2 ** retries)
+        r.request.retries = retries + 1
+        return SESSION.send(r.request, **kwargs)
+
+    SESSION.hooks['response'].append(retry_with_new_token)
+    SESSION.hooks['response'].append(retry_when_too_many_requests)
+    ASYNC_SESSION.hooks['response'].append(retry_with_new_token)
+
+# ---- local mirror file of the IDCS instance
+def mirror_file():
+    netloc=urllib.parse.urlparse(IDCS_END_POINT).netloc.replace(".identity.oraclecloud.com","")
+    return str(Path.home())+"/.oci/idcs_mirror_"+netloc.replace(":","_")+".sqlite3"
 
 # ---- initialize script
 def init():
-    global IDCS_END_POINT
+    global IDCS_END_POINT, MIRROR
 
     try:
         f = open(CREDENTIALS_FILE,"r")
@@ -113,89 +265,180 @@ def init():
     f.close()
 
     IDCS_END_POINT="https://"+IDCS_INSTANCE+".identity.oraclecloud.com"
+    if END_POINT_OVERRIDE != None: IDCS_END_POINT=END_POINT_OVERRIDE.rstrip("/")
 
-    # get a new Authentication token  
+    # read-only operation served by the local mirror: no IDCS request
+    if USE_MIRROR:
+        if not os.path.exists(mirror_file()): fatal_error(12)
+        MIRROR=OCI_idcs_mirror.Mirror(mirror_file())
+        if MIRROR.last_sync() == None: fatal_error(12)
+        return
+
+    # get an Authentication token (cached or new)
+    create_session(base64code)
     get_auth_token(base64code)
 
+# ---- get one page of a SCIM list (startIndex starts at 1), optionally only some attributes
+def get_scim_page(resource, start_index, attributes=None):
+    api_url=IDCS_END_POINT+"/admin/v1/"+resource+"?count="+MAX_OBJECTS+"&startIndex="+str(start_index)
+    if attributes != None: api_url+="&attributes="+attributes
+    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
+    r = SESSION.get(api_url, headers=headers)
+    if (r.status_code != 200): fatal_error(7)
+    return r.json()
+
+# ---- get all the objects of a SCIM list (Users or Groups), page after page
+# ---- the first page gives totalResults and the page size used by the server, then the other pages
+# ---- are requested concurrently and the objects are returned in page order (same order for each run)
+# ---- attributes: comma separated list of the attributes to get (default: all attributes returned by default)
+def scim_list(resource, attributes=None):
+    if MIRROR != None:
+        yield from MIRROR.list(resource)
+        return
+
+    dict=get_scim_page(resource, 1, attributes)
+    list=dict.get('Resources', [])
+    for item in list: yield item
+    page_size=len(list)
+    total=dict.get('totalResults', 0)
+    if (page_size == 0) or (total <= page_size): return
+
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    futures = [ executor.submit(get_scim_page, resource, start, attributes) for start in range(1+page_size, total+1, page_size) ]
+    try:
+        for future in futures:
+            for item in future.result().get('Resources', []): yield item
+    finally:
+        # stop requesting pages if the caller does not need more objects
+        for future in futures: future.cancel()
+        executor.shutdown(wait=False)
+
+# ---- find the id of a SCIM object (Users or Groups) with a filter on an attribute (only the id is returned)
+def scim_find_id(resource, attribute, value):
+    if MIRROR != None: return MIRROR.find_id(resource, value)
+    filter=attribute+' eq "'+value.replace('\\','\\\\').replace('"','\\"')+'"'
+    api_url=IDCS_END_POINT+"/admin/v1/"+resource+"?filter="+urllib.parse.quote(filter)+"&attributes=id&count=1"
+    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
+    r = SESSION.get(api_url, headers=headers)
+    if (r.status_code != 200): fatal_error(7)
+    list=r.json().get('Resources', [])
+    if len(list) == 0: return None
+    return list[0]['id']
+
+# ---- find the ids of many SCIM objects (Users or Groups) from the values of an attribute
+# ---- (filters with up to FILTER_SIZE values sent concurrently), returns a dictionary value -> id (values not found are missing)
+# ---- user and group names are not case sensitive in IDCS: the values are lower case in the dictionary
+def scim_find_ids(resource, attribute, values):
+    def find_batch(batch):
+        filter=" or ".join(attribute+' eq "'+value.replace('\\','\\\\').replace('"','\\"')+'"' for value in batch)
+        api_url=IDCS_END_POINT+"/admin/v1/"+resource+"?filter="+urllib.parse.quote(filter)+"&attributes=id,"+attribute+"&count="+str(len(batch))
+        headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
+        r = SESSION.get(api_url, headers=headers)
+        if (r.status_code != 200): fatal_error(7)
+        return r.json().get('Resources', [])
+
+    values=sorted(set(values))
+    batches=[ values[i:i+FILTER_SIZE] for i in range(0, len(values), FILTER_SIZE) ]
+    ids={}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for list in executor.map(find_batch, batches):
+            for item in list: ids[item[attribute].lower()]=item['id']
+    return ids
+
+# ---- get a SCIM object (Users or Groups) from its id, optionally only some attributes
+def get_scim_object(resource, id, attributes=None):
+    if MIRROR != None: return MIRROR.get(resource, id)
+    api_url=IDCS_END_POINT+"/admin/v1/"+resource+"/"+id
+    if attributes != None: api_url+="?attributes="+attributes
+    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
+    r = SESSION.get(api_url, headers=headers)
+    return r.json()
+
+# ---- display when the local mirror was last synchronized (on standard error, not to be mixed with the results)
+def print_mirror_freshness():
+    last_sync=MIRROR.last_sync()
+    print ("Served from local mirror {} synchronized on {} UTC ({} minutes ago)".format(
+        MIRROR.filename, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(last_sync)), int((time.time()-last_sync)/60)), file=sys.stderr)
+
 # ---- get user id from user name
 def get_user_id_from_name(name):
-    api_url=IDCS_END_POINT+"/admin/v1/Users?count="+MAX_OBJECTS
-    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.get(api_url, headers=headers)
-    dict=r.json()
-    list=dict['Resources']
-    for i in range(len(list)):
-        if (list[i]['userName'] == name):
-            return(list[i]['id'])
-    fatal_error(5)
+    user_id=scim_find_id("Users", "userName", name)
+    if user_id == None: fatal_error(5)
+    return user_id
 
 # ---- get group id from group name
 def get_group_id_from_name(name):
-    api_url=IDCS_END_POINT+"/admin/v1/Groups?count="+MAX_OBJECTS
-    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.get(api_url, headers=headers)
-    dict=r.json()
-    list=dict['Resources']
-    for i in range(len(list)):
-        if (list[i]['displayName'] == name):
-            return(list[i]['id'])
-    fatal_error(6)
+    group_id=scim_find_id("Groups", "displayName", name)
+    if group_id == None: fatal_error(6)
+    return group_id
+
+# ---- sort lines (lists of JSON values) with a limited memory: chunks of SORT_BUFFER lines sorted in memory
+# ---- and written to temporary files, then merged
+def sorted_lines(lines, key):
+    files=[]
+    try:
+        while True:
+            chunk=sorted(itertools.islice(lines, SORT_BUFFER), key=key)
+            if (len(files) == 0) and (len(chunk) < SORT_BUFFER):
+                yield from chunk
+                return
+            if len(chunk) == 0: break
+            f=tempfile.TemporaryFile("w+")
+            for line in chunk: f.write(json.dumps(line)+"\n")
+            f.seek(0)
+            files.append(f)
+        yield from heapq.merge(*[ (json.loads(line) for line in f) for f in files ], key=key)
+    finally:
+        for f in files: f.close()
+
+# ---- value of an attribute (or sub-attribute: meta.created) of a SCIM object, empty if not present
+def scim_value(object, attribute):
+    for name in attribute.split("."):
+        if not isinstance(object, dict) or name not in object: return ""
+        object=object[name]
+    return object
+
+# ---- lines of a SCIM list for the columns of a list operation (only the attributes of the columns are requested)
+def scim_lines(resource, columns):
+    attributes=",".join(attribute for name, header, attribute in columns)
+    return ( [ scim_value(object, attribute) for name, header, attribute in columns ] for object in scim_list(resource, attributes) )
+
+# ---- display lines as they arrive: columns is a list of (name, table header, attribute), lines is an iterable of lists of values
+# ---- in table format, the widths of the columns are computed with the TABLE_SAMPLE first lines only
+def display_lines(columns, lines):
+    lines=iter(lines)
+    if OUTPUT_FORMAT == "jsonl":
+        for line in lines: print (json.dumps(dict(zip([ name for name, header, attribute in columns ], line))))
+    elif OUTPUT_FORMAT == "csv":
+        writer=csv.writer(sys.stdout)
+        writer.writerow([ name for name, header, attribute in columns ])
+        for line in lines: writer.writerow(line)
+    else:
+        sample=list(itertools.islice(lines, TABLE_SAMPLE))
+        widths=[ max([ len(header) ] + [ len(str(line[i])) for line in sample ]) for i, (name, header, attribute) in enumerate(columns) ]
+        format="  ".join("{:<"+str(width)+"}" for width in widths)
+        print (format.format(*[ header for name, header, attribute in columns ]).rstrip())
+        for line in itertools.chain(sample, lines): print (format.format(*[ str(value) for value in line ]).rstrip())
 
 # ---- list users
 def list_users():
-    api_url=IDCS_END_POINT+"/admin/v1/Users?count="+MAX_OBJECTS
-    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.get(api_url, headers=headers)
-    dict=r.json()
-    list=dict['Resources']
-    table_headers=['====== USER NAME ======','ACTIVE','====== USER ID ======']
-    table_list=[]
-    for i in range(len(list)): table_list.append([ list[i]['userName'], list[i]['active'], list[i]['id'] ])
     # sort by user name
-    table = columnar(sorted(table_list, key=itemgetter(0)), table_headers, no_borders=True)
-    print(table)
+    display_lines(USERS_COLUMNS, sorted_lines(scim_lines("Users", USERS_COLUMNS), itemgetter(0)))
 
 def list_users_long():
-    api_url=IDCS_END_POINT+"/admin/v1/Users?count="+MAX_OBJECTS
-    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.get(api_url, headers=headers)
-    dict=r.json()
-    list=dict['Resources']
-    table_headers=['====== USER NAME ======','ACTIVE','====== USER ID ======','==== TITLE ====','==== CREATION DATE ====','==== CREATED BY ====']
-    table_list=[]
-    for i in range(len(list)): 
-        print(list[i]['userName'])
-        # sometimes, no title assigned, so no title key
-        try:
-            table_list.append([ list[i]['userName'], list[i]['active'], list[i]['id'], list[i]['title'], list[i]['meta']['created'], list[i]['idcsCreatedBy']['display'] ])
-        except:
-            table_list.append([ list[i]['userName'], list[i]['active'], list[i]['id'], " ", list[i]['meta']['created'], list[i]['idcsCreatedBy']['display'] ])
     # sort by creation date (oldest first)
-    table = columnar(sorted(table_list, key=itemgetter(4)), table_headers, no_borders=True)
-    print(table)
+    display_lines(USERS_LONG_COLUMNS, sorted_lines(scim_lines("Users", USERS_LONG_COLUMNS), itemgetter(4)))
 
 # ---- list groups
 def list_groups():
-    api_url=IDCS_END_POINT+"/admin/v1/Groups?count="+MAX_OBJECTS
-    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.get(api_url, headers=headers)
-    dict=r.json()
-    list=dict['Resources']
-    table_headers=['==== GROUP ID ====','==== GROUP NAME ====']
-    table_list=[]
-    for i in range(len(list)): table_list.append([ list[i]['id'], list[i]['displayName'] ])
-    table = columnar(table_list, table_headers, no_borders=True)
-    print(table)
+    display_lines(GROUPS_COLUMNS, scim_lines("Groups", GROUPS_COLUMNS))
     
 # ---- list users in a group
 def list_users_in_group(argv):
     if len(argv) != 3: usage()
     group_name=argv[2]
     group_id=get_group_id_from_name(group_name)
-    api_url=IDCS_END_POINT+"/admin/v1/Groups/"+group_id+"?attributes=members"
-    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.get(api_url, headers=headers)
-    dict=r.json()
+    dict=get_scim_object("Groups", group_id, "members")
     try:
         list=dict['members']
         for i in range(len(list)):
@@ -209,10 +452,7 @@ def list_groups_of_user(argv):
     if len(argv) != 3: usage()
     user_name=argv[2]
     user_id=get_user_id_from_name(user_name)
-    api_url=IDCS_END_POINT+"/admin/v1/Users/"+user_id+"?attributes=groups"
-    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.get(api_url, headers=headers)
-    dict=r.json()
+    dict=get_scim_object("Users", user_id, "groups")
     try:
         list=dict['groups']
         for i in range(len(list)):
@@ -226,10 +466,7 @@ def show_user(argv):
     if len(argv) != 3: usage()
     user_name=argv[2]
     user_id=get_user_id_from_name(user_name)
-    api_url=IDCS_END_POINT+"/admin/v1/Users/"+user_id
-    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.get(api_url, headers=headers)
-    dict=r.json()
+    dict=get_scim_object("Users", user_id)
     pprint(dict)
 
 # ---- show group details
@@ -237,10 +474,7 @@ def show_group(argv):
     if len(argv) != 3: usage()
     group_name=argv[2]
     group_id=get_group_id_from_name(group_name)
-    api_url=IDCS_END_POINT+"/admin/v1/Groups/"+group_id
-    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.get(api_url, headers=headers)
-    dict=r.json()
+    dict=get_scim_object("Groups", group_id)
     pprint(dict)
 
 # ---- add a new user
@@ -266,7 +500,7 @@ def add_user(argv):
   }]
 }"""
 
-    r = requests.post(api_url, headers=headers, data=payload)
+    r = SESSION.post(api_url, headers=headers, data=payload)
     pprint(r.json())
 
 # ---- add a new group
@@ -288,7 +522,7 @@ def add_group(argv):
     ]
 }"""
 
-    r = requests.post(api_url, headers=headers, data=payload)
+    r = SESSION.post(api_url, headers=headers, data=payload)
     pprint(r.json())
 
 # ---- add a user to a group
@@ -312,7 +546,7 @@ def add_user_to_group(argv):
         }
       ] } ] }"""
 
-    r = requests.patch(api_url, headers=headers, data=payload)
+    r = SESSION.patch(api_url, headers=headers, data=payload)
     pprint(r.json())
 
 # ---- remove a user from a group
@@ -330,7 +564,7 @@ def remove_user_from_group(argv):
       "op": "remove",
       "path": "members[value eq \\\""""+user_id+"""\\\"]"
     } ] }"""
-    r = requests.patch(api_url, headers=headers, data=payload)
+    r = SESSION.patch(api_url, headers=headers, data=payload)
     pprint(r.json())
 
 # ---- deactivate a user
@@ -342,7 +576,7 @@ def deactivate_user(argv):
     headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
     payload = """{ "active": false, "schemas": [ "urn:ietf:params:scim:schemas:oracle:idcs:UserStatusChanger" ] }"""
 
-    r = requests.put(api_url, headers=headers, data=payload)
+    r = SESSION.put(api_url, headers=headers, data=payload)
     pprint(r.json())
 
 # ---- activate a user
@@ -354,7 +588,7 @@ def activate_user(argv):
     headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
     payload = """{ "active": true, "schemas": [ "urn:ietf:params:scim:schemas:oracle:idcs:UserStatusChanger" ] }"""
 
-    r = requests.put(api_url, headers=headers, data=payload)
+    r = SESSION.put(api_url, headers=headers, data=payload)
     pprint(r.json())
 
 # ---- delete a user
@@ -373,7 +607,7 @@ def delete_user(argv):
 
     api_url=IDCS_END_POINT+"/admin/v1/Users/"+user_id+"?forceDelete=True"
     headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.delete(api_url, headers=headers)
+    r = SESSION.delete(api_url, headers=headers)
     if (r.status_code == 204):
         print ("User {} (Id {}) deleted !".format(user_name,user_id))
     else:
@@ -395,17 +629,299 @@ def delete_group(argv):
 
     api_url=IDCS_END_POINT+"/admin/v1/Groups/"+group_id+"?forceDelete=True"
     headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
-    r = requests.delete(api_url, headers=headers)
+    r = SESSION.delete(api_url, headers=headers)
     if (r.status_code == 204):
         print ("Group {} (Id {}) deleted !".format(group_name,group_id))
     else:
         fatal_error (7)
 
+# ---- read the records of an input file (CSV with header line, or JSONL): list of dictionaries with the columns
+def read_records(filename, columns):
+    try:
+        with open(filename, "r", newline="") as f:
+            if filename.lower().endswith((".jsonl", ".json")):
+                records=[ json.loads(line) for line in f if line.strip() != "" ]
+            else:
+                records=[ { key: (value or "").strip() for key, value in row.items() if key != None } for row in csv.DictReader(f) ]
+    except OSError:
+        fatal_error(8)
+    except ValueError:
+        fatal_error(9)
+    for record in records:
+        if not isinstance(record, dict) or any((record.get(column) or "") == "" for column in columns): fatal_error(9)
+    return records
+
+# ---- send SCIM Bulk requests with the operations (chunks of BULK_SIZE operations)
+# ---- each operation is (description, method, path, data), returns the list of the indexes of the failed operations
+def bulk(operations, fail_on_errors=None):
+    api_url=IDCS_END_POINT+"/admin/v1/Bulk"
+    headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+TOKEN }
+
+    # send the operations[start:start+BULK_SIZE], returns the failures (index, status, detail)
+    def send_chunk(start, max_errors=None):
+        chunk=operations[start:start+BULK_SIZE]
+        request={ "schemas": [ "urn:ietf:params:scim:api:messages:2.0:BulkRequest" ], "Operations": [] }
+        if max_errors != None: request["failOnErrors"]=max_errors
+        for i, (description, method, path, data) in enumerate(chunk):
+            request["Operations"].append({ "method": method, "path": path, "bulkId": str(i), "data": data })
+        r = SESSION.post(api_url, headers=headers, data=json.dumps(request))
+        if (r.status_code != 200):
+            return [ (start+i, r.status_code, r.text) for i in range(len(chunk)) ]
+        errors=[]
+        done=set()
+        for op in r.json().get('Operations', []):
+            status=op.get('status')
+            if isinstance(status, dict): status=status.get('code')
+            done.add(op.get('bulkId'))
+            if not str(status).startswith("2"):
+                detail=op.get('response', {}).get('detail', "") if isinstance(op.get('response'), dict) else ""
+                errors.append((start+int(op.get('bulkId')), status, detail))
+        # operations not processed (failOnErrors reached)
+        for i in range(len(chunk)):
+            if str(i) not in done: errors.append((start+i, "-", "not processed"))
+        return errors
+
+    starts=range(0, len(operations), BULK_SIZE)
+    failures=[]
+    if fail_on_errors == None:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for errors in executor.map(send_chunk, starts): failures.extend(errors)
+    else:
+        # each request gets the number of errors still allowed
+        for start in starts:
+            nb_errors=sum(1 for index, status, detail in failures if status != "-")
+            if nb_errors >= fail_on_errors:
+                failures.extend((index, "-", "not processed") for index in range(start, min(start+BULK_SIZE, len(operations))))
+            else:
+                failures.extend(send_chunk(start, fail_on_errors - nb_errors))
+    for index, status, detail in failures:
+        print ("FAILED: {} : status {} {}".format(operations[index][0], status, detail))
+    return sorted(index for index, status, detail in failures)
+
+# ---- parse the arguments of bulk operations: returns file name and failOnErrors value
+def bulk_arguments(argv):
+    if len(argv) == 3: return argv[2], None
+    if len(argv) == 5 and argv[3] == "--fail-on-errors" and argv[4].isdigit() and int(argv[4]) > 0: return argv[2], int(argv[4])
+    usage()
+
+# ---- display the summary of bulk operations and exit with an error if some operations failed
+def bulk_summary(nb_operations, nb_failures, start):
+    print ("{} operations, {} OK, {} failed in {:.1f} seconds".format(nb_operations, nb_operations-nb_failures, nb_failures, time.time()-start))
+    if nb_failures > 0: fatal_error(10)
+
+# ---- add many users with SCIM Bulk requests
+def bulk_add_users(argv):
+    filename, fail_on_errors = bulk_arguments(argv)
+    start=time.time()
+    operations=[]
+    for record in read_records(filename, [ "username", "first_name", "last_name", "email" ]):
+        data={ "schemas": [ "urn:ietf:params:scim:schemas:core:2.0:User" ],
+               "userName": record['username'],
+               "name": { "familyName": record['last_name'], "givenName": record['first_name'] },
+               "emails": [ { "value": record['email'], "type": "work", "primary": True } ] }
+        operations.append(("add user "+record['username'], "POST", "/Users", data))
+    bulk_summary(len(operations), len(bulk(operations, fail_on_errors)), start)
+
+# ---- add many groups with SCIM Bulk requests
+def bulk_add_groups(argv):
+    filename, fail_on_errors = bulk_arguments(argv)
+    start=time.time()
+    operations=[]
+    for record in read_records(filename, [ "groupname" ]):
+        data={ "displayName": record['groupname'],
+               "urn:ietf:params:scim:schemas:oracle:idcs:extension:group:Group": {
+                   "creationMechanism": "api",
+                   "description": record.get('description') or "" },
+               "schemas": [ "urn:ietf:params:scim:schemas:core:2.0:Group",
+                            "urn:ietf:params:scim:schemas:oracle:idcs:extension:group:Group" ] }
+        operations.append(("add group "+record['groupname'], "POST", "/Groups", data))
+    bulk_summary(len(operations), len(bulk(operations, fail_on_errors)), start)
+
+# ---- add (or remove) users to groups with SCIM Bulk requests: one PATCH operation per group with all its members changes
+def bulk_add_users_to_groups(argv):
+    filename, fail_on_errors = bulk_arguments(argv)
+    start=time.time()
+    records=read_records(filename, [ "username", "groupname" ])
+    for record in records:
+        if (record.get('action') or "add") not in [ "add", "remove" ]: fatal_error(9)
+
+    # ids of all the users and groups with a few filtered requests
+    user_ids=scim_find_ids("Users", "userName", [ record['username'] for record in records ])
+    group_ids=scim_find_ids("Groups", "displayName", [ record['groupname'] for record in records ])
+
+    # members to add/remove per group
+    changes={}
+    nb_failures=0
+    for record in records:
+        if record['username'].lower() not in user_ids:
+            print ("FAILED: {} {} : user name not found".format(record['username'], record['groupname'])); nb_failures+=1
+        elif record['groupname'].lower() not in group_ids:
+            print ("FAILED: {} {} : group name not found".format(record['username'], record['groupname'])); nb_failures+=1
+        else:
+            group=changes.setdefault(record['groupname'].lower(), { "add": set(), "remove": set(), "records": 0 })
+            group[record.get('action') or "add"].add(user_ids[record['username'].lower()])
+            group["records"]+=1
+
+    operations=[]
+    nb_records=[]               # number of records of each operation
+    for group_name, group in changes.items():
+        ops=[]
+        if len(group["add"]) > 0:
+            ops.append({ "op": "add", "path": "members", "value": [ { "value": user_id, "type": "User" } for user_id in sorted(group["add"]) ] })
+        for user_id in sorted(group["remove"] - group["add"]):
+            ops.append({ "op": "remove", "path": 'members[value eq "'+user_id+'"]' })
+        data={ "schemas": [ "urn:ietf:params:scim:api:messages:2.0:PatchOp" ], "Operations": ops }
+        operations.append(("update members of group "+group_name, "PATCH", "/Groups/"+group_ids[group_name], data))
+        nb_records.append(group["records"])
+    # a failed PATCH operation fails all the records of its group
+    nb_failures+=sum(nb_records[index] for index in bulk(operations, fail_on_errors))
+    bulk_summary(len(records), nb_failures, start)
+
+# ---- set the members of the groups in a file to the members in the file (users not in the file are removed from the groups)
+# ---- the current members of the groups are requested concurrently, then one PATCH operation per group to change
+# ---- (all the additions and removals of the group) is sent in SCIM Bulk requests
+def reconcile_group_members(argv):
+    if (len(argv) != 3) and not ((len(argv) == 4) and (argv[3] == "--dry-run")): usage()
+    dry_run=(len(argv) == 4)
+    start=time.time()
+
+    # desired members of each group (user names, lower case as user and group names are not case sensitive in IDCS)
+    desired={}
+    for record in read_records(argv[2], [ "groupname" ]):
+        members=record.get('members', [ record.get('username') or "" ])
+        if not isinstance(members, list): fatal_error(9)
+        desired.setdefault(record['groupname'].lower(), set()).update(name.lower() for name in members if name != "")
+
+    # ids of users and groups, then current members of the groups
+    # a name not found would remove a member of a group: nothing is updated if a name is not found
+    user_ids=scim_find_ids("Users", "userName", set().union(*desired.values()))
+    group_ids=scim_find_ids("Groups", "displayName", list(desired))
+    nb_not_found=0
+    for group_name in sorted(desired):
+        if group_name not in group_ids:
+            print ("FAILED: group {} : group name not found".format(group_name)); nb_not_found+=1
+        for user_name in sorted(desired[group_name] - set(user_ids)):
+            print ("FAILED: {} {} : user name not found".format(user_name, group_name)); nb_not_found+=1
+    if (nb_not_found > 0) and not dry_run: fatal_error(13)
+    nb_failures=nb_not_found
+    groups=sorted(name for name in desired if name in group_ids)
+    try:
+        current=OCI_idcs_async.run(IDCS_END_POINT, lambda: TOKEN, ASYNC_SESSION, MAX_WORKERS, OCI_idcs_async.IdcsClient.members_of_groups,
+                                   [ group_ids[name] for name in groups ])
+    except OCI_idcs_async.IdcsError as e:
+        print (e)
+        fatal_error(7)
+
+    # differences computed with sets of user ids, one PATCH operation per group with differences
+    operations=[]
+    nb_adds=0
+    nb_removes=0
+    user_names_from_ids={ id: name for name, id in user_ids.items() }
+    for group_name in groups:
+        members=current[group_ids[group_name]]
+        wanted=set(user_ids[name] for name in desired[group_name] if name in user_ids)
+        adds=sorted(wanted - set(members))
+        # dry run with user names not found: no removal displayed for the group (members not found are not known)
+        removes=sorted(set(members) - wanted) if desired[group_name] <= set(user_ids) else []
+        if (len(adds) == 0) and (len(removes) == 0): continue
+        user_names=dict(user_names_from_ids, **members)
+        print ("{}: {}".format(group_name, " ".join([ "+"+user_names[id] for id in adds ] + [ "-"+user_names[id] for id in removes ])))
+        ops=[]
+        if len(adds) > 0:
+            ops.append({ "op": "add", "path": "members", "value": [ { "value": id, "type": "User" } for id in adds ] })
+        for id in removes:
+            ops.append({ "op": "remove", "path": 'members[value eq "'+id+'"]' })
+        data={ "schemas": [ "urn:ietf:params:scim:api:messages:2.0:PatchOp" ], "Operations": ops }
+        operations.append(("update members of group "+group_name, "PATCH", "/Groups/"+group_ids[group_name], data))
+        nb_adds+=len(adds)
+        nb_removes+=len(removes)
+    if not dry_run: nb_failures+=len(bulk(operations))
+
+    print ("{} groups, {} to update ({} additions, {} removals){}, {} failures in {:.1f} seconds".format(
+        len(desired), len(operations), nb_adds, nb_removes, " (dry run: not updated)" if dry_run else "", nb_failures, time.time()-start))
+    if nb_failures > 0: fatal_error(10)
+
+# ---- CSV report of the groups of all users: one line per user, one column per group, X if the user is in the group
+def membership_report(argv):
+    if (len(argv) != 2) and (len(argv) != 3): usage()
+    start=time.time()
+    try:
+        users, groups, members = OCI_idcs_async.membership_matrix(IDCS_END_POINT, lambda: TOKEN, ASYNC_SESSION, MAX_WORKERS)
+    except OCI_idcs_async.IdcsError as e:
+        print (e)
+        fatal_error(7)
+
+    groups=sorted(groups, key=itemgetter('displayName'))
+    try:
+        f = open(argv[2], "w", newline="") if len(argv) == 3 else sys.stdout
+    except OSError:
+        fatal_error(11)
+    writer = csv.writer(f)
+    writer.writerow([ "username" ] + [ group['displayName'] for group in groups ])
+    for user in sorted(users, key=itemgetter('userName')):
+        writer.writerow([ user['userName'] ] + [ "X" if user['id'] in members[group['id']] else "" for group in groups ])
+    if len(argv) == 3:
+        f.close()
+        print ("{} users, {} groups, {} memberships in {:.1f} seconds".format(len(users), len(groups), sum(len(ids) for ids in members.values()), time.time()-start))
+
+# ---- create or update the local mirror
+def mirror_sync(argv):
+    if (len(argv) != 2) and not ((len(argv) == 3) and (argv[2] == "--full")): usage()
+    start=time.time()
+    mirror=OCI_idcs_mirror.Mirror(mirror_file())
+    try:
+        nb_users, nb_groups, nb_deleted = OCI_idcs_async.run(IDCS_END_POINT, lambda: TOKEN, ASYNC_SESSION, MAX_WORKERS, mirror.sync, len(argv) == 3)
+    except OCI_idcs_async.IdcsError as e:
+        print (e)
+        fatal_error(7)
+    mirror.close()
+    print ("Local mirror {} synchronized: {} users and {} groups updated, {} deleted in {:.1f} seconds".format(
+        mirror.filename, nb_users, nb_groups, nb_deleted, time.time()-start))
+
+# ---- compare the bytes received by the list operations with all the attributes and with only the displayed attributes
+# ---- (bytes of the response bodies as received, before gzip decompression)
+def benchmark_attributes():
+    sizes=[]
+    def count_bytes(r, *args, **kwargs):
+        if r.status_code != 200: return
+        r.content                           # read the whole body
+        sizes.append(r.raw.tell())
+    # first hook: called once for each response (the response of a retried request is also returned to the next hooks)
+    SESSION.hooks['response'].insert(0, count_bytes)
+    print ("{:<16} {:>10} {:>14} {:>9} {:>14} {:>9} {:>10}".format("operation", "objects", "bytes (all)", "seconds", "bytes (proj)", "seconds", "reduction"))
+    for operation, resource, columns in [ ("list_users", "Users", USERS_COLUMNS), ("list_users_long", "Users", USERS_LONG_COLUMNS),
+                                          ("list_groups", "Groups", GROUPS_COLUMNS) ]:
+        results=[]
+        for attributes in [ None, ",".join(attribute for name, header, attribute in columns) ]:
+            del sizes[:]
+            start=time.time()
+            nb_objects=sum(1 for object in scim_list(resource, attributes))
+            results.append((sum(sizes), time.time()-start))
+        (full, full_time), (projected, projected_time) = results
+        print ("{:<16} {:>10} {:>14} {:>9.2f} {:>14} {:>9.2f} {:>9.0f}%".format(operation, nb_objects, full, full_time, projected, projected_time,
+                                                                          100.0*(full-projected)/full if full > 0 else 0))
+
 # -------- main
 
+while (len(sys.argv) > 1) and (sys.argv[1] in [ "--endpoint", "--mirror", "--output" ]):
+    if sys.argv[1] == "--mirror":
+        USE_MIRROR=True
+        del sys.argv[1]
+    elif (sys.argv[1] == "--endpoint") and (len(sys.argv) > 2) and sys.argv[2].startswith(("http://", "https://")):
+        END_POINT_OVERRIDE=sys.argv[2]
+        del sys.argv[1:3]
+    elif sys.argv[1] == "--endpoint":
+        usage()
+    elif (len(sys.argv) > 2) and (sys.argv[2] in [ "table", "csv", "jsonl" ]):
+        OUTPUT_FORMAT=sys.argv[2]
+        del sys.argv[1:3]
+    else:
+        usage()
+
 if len(sys.argv) < 2: usage()
 
 operation=sys.argv[1]
+if USE_MIRROR and (operation not in MIRROR_OPERATIONS): usage()
 
 if   (operation == "set_credentials"):        set_credentials(sys.argv)
 elif (operation == "list_users"):             init();  list_users()
@@ -423,7 +939,16 @@ elif (operation == "deactivate_user"):        init();  deactivate_user(sys.argv)
 elif (operation == "activate_user"):          init();  activate_user(sys.argv)
 elif (operation == "delete_user"):            init();  delete_user(sys.argv)
 elif (operation == "delete_group"):           init();  delete_group(sys.argv)
+elif (operation == "bulk_add_users"):           init();  bulk_add_users(sys.argv)
+elif (operation == "bulk_add_groups"):          init();  bulk_add_groups(sys.argv)
+elif (operation == "bulk_add_users_to_groups"): init();  bulk_add_users_to_groups(sys.argv)
+elif (operation == "membership_report"):        init();  membership_report(sys.argv)
+elif (operation == "reconcile_group_members"):  init();  reconcile_group_members(sys.argv)
+elif (operation == "mirror_sync"):              init();  mirror_sync(sys.argv)
+elif (operation == "benchmark_attributes"):     init();  benchmark_attributes()
 else: usage()
 
+if USE_MIRROR: print_mirror_freshness()
+
 exit (0)
 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# --------------------------------------------------------------------------------------------------------------------------
+# This Python 3 module is an asyncio IDCS client used by OCI_idcs.py for operations needing many REST API requests
+#
+# - the number of requests in progress is limited by a semaphore (max_concurrency)
+# - a request refused with status 429 (too many requests) is sent again after the delay given by the Retry-After header
+#   (or an exponential backoff), and all the other requests wait for the same delay before being sent
+# - the HTTP requests are sent by a requests.Session of OCI_idcs.py in threads (keep-alive connections and token
+#   refresh of the session are reused, no other Python module needed); this session must not retry the requests refused
+#   with status 429 itself (OCI_idcs.ASYNC_SESSION)
+#
+# Author        : Christophe Pauliat
+# Platforms     : MacOS / Linux
+#
+# Prerequisites:
+# - Python 3.7 or later installed
+# - OCI_idcs.py in the same directory
+#
+# Versions
+#    2020-05-25: Initial Version
+#    2020-05-26: add filter to list_all() and run() for other coroutines (mirror synchronization)
+#    2020-05-30: add members_of_groups() (group members reconciliation)
+# --------------------------------------------------------------------------------------------------------------------------
+
+# -- import
+import time
+import asyncio
+import functools
+import email.utils
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# -------- variables
+MAX_RETRIES=6               # max number of retries of a request refused with status 429
+MAX_BACKOFF=60              # max delay in seconds between 2 retries if no Retry-After header
+
+# -------- classes
+
+# ---- error of an IDCS request
+class IdcsError(Exception):
+    def __init__(self, status_code, url, text):
+        Exception.__init__(self, "status {} for {}: {}".format(status_code, url, text))
+        self.status_code = status_code
+
+# ---- asyncio IDCS client (must be created in a coroutine)
+# ---- get_token is a function returning the current OAuth2 token (it can be refreshed by the session)
+class IdcsClient:
+    def __init__(self, endpoint, get_token, session, max_concurrency=8):
+        self.endpoint  = endpoint
+        self.get_token = get_token
+        self.session   = session
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.executor  = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.retry_at  = 0          # no request sent before this time (time.monotonic()) after a status 429
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    # ---- delay before the next retry of a request refused with status 429
+    def retry_delay(self, r, attempt):
+        value = r.headers.get('Retry-After')
+        if value != None:
+            if value.strip().isdigit(): return int(value)
+            try:
+                return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+        return min(MAX_BACKOFF, 2 ** attempt)
+
+    # ---- GET request, returns the JSON response
+    async def get(self, path, params=None):
+        url = self.endpoint + path + ("?" + urllib.parse.urlencode(params) if params else "")
+        loop = asyncio.get_running_loop()
+        for attempt in range(MAX_RETRIES + 1):
+            delay = self.retry_at - time.monotonic()
+            if delay > 0: await asyncio.sleep(delay)
+            async with self.semaphore:
+                headers = { 'Content-Type': 'application/scim+json', 'Authorization': 'Bearer '+self.get_token() }
+                r = await loop.run_in_executor(self.executor, functools.partial(self.session.get, url, headers=headers))
+            if r.status_code == 429 and attempt < MAX_RETRIES:
+                self.retry_at = max(self.retry_at, time.monotonic() + self.retry_delay(r, attempt))
+                continue
+            if r.status_code != 200: raise IdcsError(r.status_code, url, r.text)
+            return r.json()
+
+    # ---- all the objects of a SCIM list (Users or Groups), optionally only some attributes (or all but excluded attributes)
+    # ---- and objects matching a filter: first page, then other pages concurrently
+    async def list_all(self, resource, attributes=None, filter=None, page_size=200, excluded_attributes=None):
+        params = { 'count': page_size }
+        if attributes != None: params['attributes'] = attributes
+        if excluded_attributes != None: params['excludedAttributes'] = excluded_attributes
+        if filter != None: params['filter'] = filter
+        first = await self.get("/admin/v1/"+resource, dict(params, startIndex=1))
+        items = first.get('Resources', [])
+        page_size = len(items)
+        total = first.get('totalResults', 0)
+        if (page_size == 0) or (total <= page_size): return items
+        pages = await asyncio.gather(*(self.get("/admin/v1/"+resource, dict(params, startIndex=start))
+                                       for start in range(1+page_size, total+1, page_size)))
+        for page in pages: items.extend(page.get('Resources', []))
+        return items
+
+    # ---- ids of the users in a group
+    async def get_group_members(self, group_id):
+        group = await self.get("/admin/v1/Groups/"+group_id, { 'attributes': 'members' })
+        return [ member['value'] for member in group.get('members', []) if member.get('type', 'User') == 'User' ]
+
+    # ---- members of several groups (one request per group, requests sent concurrently)
+    # ---- returns dictionary group id -> { user id -> user name }
+    async def members_of_groups(self, group_ids):
+        groups = await asyncio.gather(*(self.get("/admin/v1/Groups/"+group_id, { 'attributes': 'members' }) for group_id in group_ids))
+        return { group_id: { member['value']: member.get('name', member['value']) for member in group.get('members', [])
+                             if member.get('type', 'User') == 'User' }
+                 for group_id, group in zip(group_ids, groups) }
+
+    # ---- all users, all groups and the members of every group (one request per group, requests sent concurrently)
+    # ---- returns users (id, userName), groups (id, displayName) and dictionary group id -> set of user ids
+    async def membership_matrix(self):
+        users, groups = await asyncio.gather(self.list_all("Users", "id,userName"), self.list_all("Groups", "id,displayName"))
+        members = await asyncio.gather(*(self.get_group_members(group['id']) for group in groups))
+        return users, groups, { group['id']: set(ids) for group, ids in zip(groups, members) }
+
+# -------- functions
+
+# ---- run a coroutine function with an IdcsClient as first argument (to be called outside of a coroutine)
+def run(endpoint, get_token, session, max_concurrency, function, *args):
+    async def main():
+        client = IdcsClient(endpoint, get_token, session, max_concurrency)
+        try:
+            return await function(client, *args)
+        finally:
+            client.close()
+    return asyncio.run(main())
+
+# ---- membership matrix of all users and groups (to be called outside of a coroutine)
+def membership_matrix(endpoint, get_token, session, max_concurrency=8):
+    return run(endpoint, get_token, session, max_concurrency, IdcsClient.membership_matrix)
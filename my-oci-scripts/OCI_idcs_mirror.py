@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# --------------------------------------------------------------------------------------------------------------------------
+# This Python 3 module is a local SQLite mirror of the IDCS users, groups and group memberships used by OCI_idcs.py
+#
+# - the first synchronization gets all users and groups, and the members of every group (requests sent concurrently)
+# - the next synchronizations only get the users and groups modified since the previous one (filter on
+#   meta.lastModified), the members of the modified groups (a membership change modifies the group), and the ids of
+#   all users and groups (small pages) to remove the deleted ones from the mirror
+# - the objects are returned in the same format as the IDCS REST APIs (groups of a user and members of a group are
+#   computed from the mirrored memberships)
+#
+# Author        : Christophe Pauliat
+# Platforms     : MacOS / Linux
+#
+# Prerequisites:
+# - Python 3.7 or later installed (sqlite3 module)
+# - OCI_idcs_async.py in the same directory
+#
+# Versions
+#    2020-05-26: Initial Version
+#    2020-05-31: mirror full group objects (same output as show_group without --mirror)
+#    2020-05-31: user and group names not case sensitive (as in IDCS), indexed
+# --------------------------------------------------------------------------------------------------------------------------
+
+# -- import
+import json
+import time
+import sqlite3
+import asyncio
+
+# -------- variables
+SYNC_MARGIN=60              # seconds subtracted from the start time of a synchronization for the next delta (clock skew)
+
+# name of the column and of the SCIM attribute used as name for each resource
+NAMES = { "Users": ("users", "user_name", "userName"), "Groups": ("groups", "display_name", "displayName") }
+
+# -------- classes
+
+# ---- local mirror in a SQLite database file
+class Mirror:
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS users   (id TEXT PRIMARY KEY, user_name TEXT, data TEXT);
+            CREATE TABLE IF NOT EXISTS groups  (id TEXT PRIMARY KEY, display_name TEXT, data TEXT);
+            CREATE TABLE IF NOT EXISTS members (group_id TEXT, user_id TEXT, PRIMARY KEY (group_id, user_id));
+            CREATE TABLE IF NOT EXISTS sync    (key TEXT PRIMARY KEY, value TEXT);
+            CREATE INDEX IF NOT EXISTS users_by_name   ON users (user_name);
+            CREATE INDEX IF NOT EXISTS groups_by_name  ON groups (display_name);
+            CREATE INDEX IF NOT EXISTS users_by_nocase_name  ON users (user_name COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS groups_by_nocase_name ON groups (display_name COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS members_by_user ON members (user_id);
+        """)
+
+    def close(self):
+        self.db.close()
+
+    # ---- time (seconds since epoch) of the last synchronization, None if never synchronized
+    def last_sync(self):
+        row = self.db.execute("SELECT value FROM sync WHERE key = 'last_sync'").fetchone()
+        return None if row == None else float(row[0])
+
+    # ---- all the objects of a resource (Users or Groups)
+    def list(self, resource):
+        table, column, attribute = NAMES[resource]
+        return [ json.loads(row[0]) for row in self.db.execute("SELECT data FROM {} ORDER BY {}".format(table, column)) ]
+
+    # ---- id of an object (Users or Groups) from its name (not case sensitive, as in IDCS), None if not found
+    def find_id(self, resource, value):
+        table, column, attribute = NAMES[resource]
+        row = self.db.execute("SELECT id FROM {} WHERE {} = ? COLLATE NOCASE".format(table, column), (value,)).fetchone()
+        return None if row == None else row[0]
+
+    # ---- an object (Users or Groups) with its groups or members, None if not found
+    def get(self, resource, id):
+        table, column, attribute = NAMES[resource]
+        row = self.db.execute("SELECT data FROM {} WHERE id = ?".format(table), (id,)).fetchone()
+        if row == None: return None
+        data = json.loads(row[0])
+        # $ref of the groups or members built from the location of the object (.../admin/v1/Users/<id>)
+        base = data.get('meta', {}).get('location', "/admin/v1/{}/{}".format(resource, id)).rsplit("/", 2)[0]
+        if resource == "Users":
+            rows = self.db.execute("SELECT g.id, g.display_name FROM members m JOIN groups g ON g.id = m.group_id "
+                                   "WHERE m.user_id = ? ORDER BY g.display_name", (id,))
+            data['groups'] = [ { 'value': group_id, 'display': name, '$ref': base+"/Groups/"+group_id } for group_id, name in rows ]
+        else:
+            rows = self.db.execute("SELECT u.id, u.user_name FROM members m JOIN users u ON u.id = m.user_id "
+                                   "WHERE m.group_id = ? ORDER BY u.user_name", (id,))
+            data['members'] = [ { 'value': user_id, 'type': 'User', 'name': name, '$ref': base+"/Users/"+user_id }
+                                for user_id, name in rows ]
+        return data
+
+    # ---- save objects (Users or Groups) received from IDCS
+    def save(self, resource, items):
+        table, column, attribute = NAMES[resource]
+        # members of groups and groups of users are saved in the members table only
+        items = [ { key: value for key, value in item.items() if key not in ("members", "groups") } for item in items ]
+        self.db.executemany("INSERT OR REPLACE INTO {} (id, {}, data) VALUES (?, ?, ?)".format(table, column),
+                            [ (item['id'], item.get(attribute), json.dumps(item)) for item in items ])
+
+    # ---- remove the objects (Users or Groups) which are not in the list of ids (deleted in IDCS)
+    def keep_only(self, resource, ids):
+        table, column, attribute = NAMES[resource]
+        deleted = set(row[0] for row in self.db.execute("SELECT id FROM {}".format(table))) - set(ids)
+        self.db.executemany("DELETE FROM {} WHERE id = ?".format(table), [ (id,) for id in deleted ])
+        key = "group_id" if resource == "Groups" else "user_id"
+        self.db.executemany("DELETE FROM members WHERE {} = ?".format(key), [ (id,) for id in deleted ])
+        return len(deleted)
+
+    # ---- replace the members of a group
+    def set_members(self, group_id, user_ids):
+        self.db.execute("DELETE FROM members WHERE group_id = ?", (group_id,))
+        self.db.executemany("INSERT INTO members (group_id, user_id) VALUES (?, ?)", [ (group_id, user_id) for user_id in user_ids ])
+
+    # ---- synchronize the mirror with IDCS (coroutine, client is an OCI_idcs_async.IdcsClient)
+    # ---- full synchronization if never synchronized or if full is True, returns the numbers of users, groups and deleted objects
+    async def sync(self, client, full=False):
+        start = time.time()
+        last_sync = None if full else self.last_sync()
+        if last_sync == None:
+            users, groups = await asyncio.gather(client.list_all("Users"), client.list_all("Groups", excluded_attributes="members"))
+        else:
+            filter = 'meta.lastModified gt "{}"'.format(time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(last_sync - SYNC_MARGIN)))
+            users, groups, user_ids, group_ids = await asyncio.gather(
+                client.list_all("Users", filter=filter), client.list_all("Groups", filter=filter, excluded_attributes="members"),
+                client.list_all("Users", "id"), client.list_all("Groups", "id"))
+        members = await asyncio.gather(*(client.get_group_members(group['id']) for group in groups))
+
+        # all the changes in one transaction (a failed synchronization leaves the mirror unchanged)
+        with self.db:
+            if last_sync == None:
+                self.db.execute("DELETE FROM users")
+                self.db.execute("DELETE FROM groups")
+                self.db.execute("DELETE FROM members")
+            self.save("Users", users)
+            self.save("Groups", groups)
+            for group, ids in zip(groups, members): self.set_members(group['id'], ids)
+            deleted = 0
+            if last_sync != None:
+                deleted += self.keep_only("Users", [ user['id'] for user in user_ids ])
+                deleted += self.keep_only("Groups", [ group['id'] for group in group_ids ])
+            self.db.execute("INSERT OR REPLACE INTO sync (key, value) VALUES ('last_sync', ?)", (str(start),))
+        return len(users), len(groups), deleted
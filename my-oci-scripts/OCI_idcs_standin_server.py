@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+
+# --------------------------------------------------------------------------------------------------------------------------
+# This Python 3 script runs a local stand-in of the IDCS REST APIs (SCIM 2.0 and OAuth2 client credentials) with a
+# synthetic directory of users and groups, to test and benchmark OCI_idcs.py without an IDCS tenant
+#
+# Supported requests:
+# - POST   /oauth2/v1/token                           (any client ID and secret, tokens expire after --token-ttl seconds)
+# - GET    /admin/v1/Users and /admin/v1/Groups       (startIndex, count, attributes, excludedAttributes, filter with
+#                                                      "eq" joined by "or", or meta.lastModified "gt")
+# - GET    /admin/v1/Users/id and /admin/v1/Groups/id (attributes, excludedAttributes)
+# - POST   /admin/v1/Users and /admin/v1/Groups
+# - PATCH  /admin/v1/Users/id and /admin/v1/Groups/id (add/replace/remove, members[value eq "id"])
+# - PUT    /admin/v1/UserStatusChanger/id
+# - DELETE /admin/v1/Users/id and /admin/v1/Groups/id
+# - POST   /admin/v1/Bulk                             (failOnErrors)
+# The members of a group are not returned in lists, only if requested (attributes=members) or in GET of the group.
+# A membership change modifies the group (meta.lastModified).
+#
+# Examples:
+#   python3 OCI_idcs_standin_server.py --users 20000 --groups 200 --latency 50 --page-limit 500 --rate-limit 100
+#   python3 OCI_idcs.py set_credentials standin any_id any_secret     (not needed if a credentials file exists: any values accepted)
+#   python3 OCI_idcs.py --endpoint http://127.0.0.1:8000 list_groups
+#
+# Author        : Christophe Pauliat
+# Platforms     : MacOS / Linux
+#
+# Prerequisites:
+# - Python 3.7 or later installed (no other module needed)
+#
+# Versions
+#    2020-05-29: Initial Version
+#    2020-05-31: "eq" filters not case sensitive (as IDCS for user and group names)
+# --------------------------------------------------------------------------------------------------------------------------
+
+# -- import
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -------- variables
+PORT=8000
+NB_USERS=1000               # synthetic directory size
+NB_GROUPS=50
+GROUPS_PER_USER=3           # number of groups of each synthetic user
+LATENCY=0                   # delay in milliseconds added to each request
+PAGE_LIMIT=1000             # max number of objects per page (count parameter above this limit is ignored)
+DEFAULT_COUNT=50            # number of objects per page if no count parameter
+RATE_LIMIT=0                # max number of requests per second (status 429 above this limit), 0 for no limit
+TOKEN_TTL=3600              # lifetime of the OAuth2 tokens in seconds
+VERBOSE=False
+
+USER_SCHEMA="urn:ietf:params:scim:schemas:core:2.0:User"
+GROUP_SCHEMA="urn:ietf:params:scim:schemas:core:2.0:Group"
+LIST_SCHEMA="urn:ietf:params:scim:api:messages:2.0:ListResponse"
+ERROR_SCHEMA="urn:ietf:params:scim:api:messages:2.0:Error"
+
+# directory: id -> object, group id -> set of user ids, tokens -> expiration time
+USERS={}
+GROUPS={}
+MEMBERS={}
+TOKENS={}
+LOCK=threading.RLock()
+
+# statistics and rate limiting
+STATS={ "requests": 0, "bytes": 0, "status_429": 0 }
+RATE={ "second": 0, "count": 0 }
+
+# -------- functions
+
+# ---- usage syntax
+def usage():
+    print ("Usage: python3 {} [--port n] [--users n] [--groups n] [--groups-per-user n] [--latency ms]".format(sys.argv[0]))
+    print ("           [--page-limit n] [--rate-limit n] [--token-ttl seconds] [-v]")
+    print ("")
+    print ("    --port           : TCP port on 127.0.0.1 (default: {})".format(PORT))
+    print ("    --users/--groups : number of synthetic users/groups (default: {}/{})".format(NB_USERS, NB_GROUPS))
+    print ("    --groups-per-user: number of groups of each synthetic user (default: {})".format(GROUPS_PER_USER))
+    print ("    --latency        : delay in milliseconds added to each request (default: {})".format(LATENCY))
+    print ("    --page-limit     : max number of objects per page (default: {})".format(PAGE_LIMIT))
+    print ("    --rate-limit     : max number of requests per second, status 429 above (default: no limit)")
+    print ("    --token-ttl      : lifetime of OAuth2 tokens in seconds (default: {})".format(TOKEN_TTL))
+    print ("    -v               : display each request")
+    exit (1)
+
+# ---- current time in SCIM format
+def now():
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) + ".{:03d}Z".format(int(time.time() * 1000) % 1000)
+
+# ---- SCIM meta attribute of a new object
+def new_meta(resource_type, id):
+    timestamp = now()
+    return { "resourceType": resource_type, "created": timestamp, "lastModified": timestamp,
+             "location": "/admin/v1/{}s/{}".format(resource_type, id) }
+
+# ---- create a user or a group from a SCIM object, returns the object created
+def create_user(data):
+    id = uuid.uuid4().hex
+    user = dict(data, id=id, active=data.get("active", True), meta=new_meta("User", id),
+                idcsCreatedBy={ "type": "App", "display": "standin", "value": "standin" })
+    user["schemas"] = data.get("schemas", [ USER_SCHEMA ])
+    USERS[id] = user
+    return user
+
+def create_group(data):
+    id = uuid.uuid4().hex
+    group = { key: value for key, value in data.items() if key != "members" }
+    group.update(id=id, meta=new_meta("Group", id))
+    group["schemas"] = data.get("schemas", [ GROUP_SCHEMA ])
+    GROUPS[id] = group
+    MEMBERS[id] = set(member["value"] for member in data.get("members", []) if member.get("value") in USERS)
+    return group
+
+# ---- synthetic directory (same directory for the same sizes)
+def create_directory():
+    generator = random.Random(0)
+    groups = [ create_group({ "displayName": "group{:05d}".format(i),
+                              "urn:ietf:params:scim:schemas:oracle:idcs:extension:group:Group": {
+                                  "creationMechanism": "api", "description": "Synthetic group {}".format(i) } }) for i in range(NB_GROUPS) ]
+    for i in range(NB_USERS):
+        user = create_user({ "userName": "user{:06d}".format(i),
+                             "name": { "givenName": "First{}".format(i), "familyName": "Last{}".format(i), "formatted": "First{} Last{}".format(i, i) },
+                             "displayName": "First{} Last{}".format(i, i),
+                             "emails": [ { "value": "user{:06d}@example.com".format(i), "type": "work", "primary": True } ],
+                             "urn:ietf:params:scim:schemas:oracle:idcs:extension:user:User": {
+                                 "isFederatedUser": False, "creationMechanism": "api" } })
+        if i % 3 == 0: user["title"] = "Engineer"
+        for group in generator.sample(groups, min(GROUPS_PER_USER, len(groups))):
+            MEMBERS[group["id"]].add(user["id"])
+
+# ---- members of a group and groups of a user in SCIM format
+def members_of(group_id):
+    return [ { "value": id, "type": "User", "name": USERS[id]["userName"], "$ref": "/admin/v1/Users/"+id }
+             for id in sorted(MEMBERS[group_id], key=lambda id: USERS[id]["userName"]) ]
+
+def groups_of(user_id):
+    return [ { "value": id, "display": group["displayName"], "$ref": "/admin/v1/Groups/"+id }
+             for id, group in GROUPS.items() if user_id in MEMBERS[id] ]
+
+# ---- keep only some attributes of an object (sub-attributes like meta.created supported), id and schemas always returned
+def project(object, attributes, excluded):
+    if attributes:
+        result = { "id": object["id"], "schemas": object["schemas"] }
+        for attribute in attributes:
+            name, _, sub = attribute.partition(".")
+            if name not in object: continue
+            if sub and isinstance(object[name], dict):
+                if sub in object[name]: result.setdefault(name, {})[sub] = object[name][sub]
+            else:
+                result[name] = object[name]
+        object = result
+    for attribute in excluded:
+        if attribute not in ("id", "schemas"): object.pop(attribute, None)
+    return object
+
+# ---- object in SCIM format: with members (groups) or groups (users) if requested or if with_links
+def render(resource, object, attributes, excluded, with_links=False):
+    object = dict(object)
+    if resource == "Groups" and (with_links or "members" in attributes) and not "members" in excluded:
+        object["members"] = members_of(object["id"])
+    if resource == "Users" and (with_links or "groups" in attributes) and not "groups" in excluded:
+        object["groups"] = groups_of(object["id"])
+    return project(object, attributes, excluded)
+
+# ---- value of an attribute or sub-attribute of an object (None if not present)
+def value_of(object, attribute):
+    for name in attribute.split("."):
+        if not isinstance(object, dict) or name not in object: return None
+        object = object[name]
+    return object
+
+# ---- objects matching a SCIM filter: "attr eq "v" or attr eq "w" ..." or "attr gt "v"", raises ValueError if not supported
+def apply_filter(objects, filter):
+    terms = []
+    for term in filter.split(" or "):
+        attribute, operator, value = term.strip().split(" ", 2)
+        if operator not in ("eq", "gt") or not (value.startswith('"') and value.endswith('"')): raise ValueError(term)
+        terms.append((attribute, operator, json.loads(value)))
+    result = []
+    for object in objects:
+        for attribute, operator, value in terms:
+            current = value_of(object, attribute)
+            if current == None: continue
+            # eq not case sensitive (as userName and displayName in IDCS)
+            if (operator == "eq" and str(current).lower() == value.lower()) or (operator == "gt" and str(current) > value):
+                result.append(object)
+                break
+    return result
+
+# ---- SCIM error
+def error(status, detail):
+    return status, { "schemas": [ ERROR_SCHEMA ], "status": str(status), "detail": detail }
+
+# ---- PATCH operations on an object (members of groups: add, remove with members[value eq "id"])
+def patch(resource, id, data):
+    objects = USERS if resource == "Users" else GROUPS
+    for operation in data.get("Operations", []):
+        op, path, value = operation.get("op", "").lower(), operation.get("path", ""), operation.get("value")
+        if resource == "Groups" and path == "members" and op in ("add", "replace"):
+            if op == "replace": MEMBERS[id] = set()
+            for member in value or []:
+                if member.get("value") not in USERS: return error(400, "user {} not found".format(member.get("value")))
+                MEMBERS[id].add(member["value"])
+        elif resource == "Groups" and path.startswith("members[value eq ") and op == "remove":
+            MEMBERS[id].discard(json.loads(path[len("members[value eq "):-1]))
+        elif resource == "Groups" and path == "members" and op == "remove":
+            MEMBERS[id] = set()
+        elif op in ("add", "replace") and path:
+            objects[id][path] = value
+        elif op in ("add", "replace") and isinstance(value, dict):
+            objects[id].update(value)
+        elif op == "remove" and path:
+            objects[id].pop(path, None)
+        else:
+            return error(400, "unsupported PATCH operation {}".format(json.dumps(operation)))
+    objects[id]["meta"]["lastModified"] = now()
+    return 200, render(resource, objects[id], [], [], True)
+
+# ---- execute a SCIM request: returns status and response object (None for no content)
+def execute(method, path, query, data):
+    parts = [ part for part in path.split("/") if part != "" ]
+    if len(parts) < 3 or parts[:2] != [ "admin", "v1" ]: return error(404, "resource not found")
+    resource = parts[2]
+    id = parts[3] if len(parts) > 3 else None
+    attributes = [ a.strip() for a in query.get("attributes", "").split(",") if a.strip() != "" ]
+    excluded = [ a.strip() for a in query.get("excludedAttributes", "").split(",") if a.strip() != "" ]
+
+    with LOCK:
+        if resource == "Bulk" and method == "POST":
+            return bulk(data)
+        if resource == "UserStatusChanger" and method == "PUT" and id != None:
+            if id not in USERS: return error(404, "user {} not found".format(id))
+            USERS[id]["active"] = bool(data.get("active"))
+            USERS[id]["meta"]["lastModified"] = now()
+            return 200, { "schemas": data.get("schemas", []), "id": id, "active": USERS[id]["active"] }
+        if resource not in ("Users", "Groups"): return error(404, "resource {} not found".format(resource))
+        objects = USERS if resource == "Users" else GROUPS
+
+        if method == "GET" and id == None:
+            selected = list(objects.values())
+            if "filter" in query:
+                try:
+                    selected = apply_filter(selected, query["filter"])
+                except ValueError as e:
+                    return error(400, "unsupported filter {}".format(str(e)))
+            try:
+                start = max(1, int(query.get("startIndex", 1)))
+                count = min(PAGE_LIMIT, max(0, int(query.get("count", DEFAULT_COUNT))))
+            except ValueError:
+                return error(400, "invalid startIndex or count")
+            page = [ render(resource, object, attributes, excluded) for object in selected[start-1:start-1+count] ]
+            return 200, { "schemas": [ LIST_SCHEMA ], "totalResults": len(selected), "startIndex": start,
+                          "itemsPerPage": len(page), "Resources": page }
+        if method == "POST" and id == None:
+            name = "userName" if resource == "Users" else "displayName"
+            if not data.get(name): return error(400, "{} missing".format(name))
+            if any(object.get(name) == data[name] for object in objects.values()):
+                return error(409, "{} {} already exists".format(name, data[name]))
+            object = create_user(data) if resource == "Users" else create_group(data)
+            return 201, render(resource, object, [], [], True)
+        if id == None or id not in objects: return error(404, "{} {} not found".format(resource, id))
+        if method == "GET":
+            return 200, render(resource, objects[id], attributes, excluded, not attributes)
+        if method == "PATCH":
+            return patch(resource, id, data)
+        if method == "DELETE":
+            del objects[id]
+            if resource == "Groups":
+                del MEMBERS[id]
+            else:
+                for group_id, members in MEMBERS.items():
+                    if id in members:
+                        members.discard(id)
+                        GROUPS[group_id]["meta"]["lastModified"] = now()
+            return 204, None
+    return error(405, "method {} not supported".format(method))
+
+# ---- SCIM Bulk request: operations executed in order, stop after failOnErrors errors
+def bulk(data):
+    fail_on_errors = data.get("failOnErrors")
+    results = []
+    nb_errors = 0
+    for operation in data.get("Operations", []):
+        if fail_on_errors and nb_errors >= fail_on_errors: break
+        path = urllib.parse.urlparse(operation.get("path", ""))
+        status, response = execute(operation.get("method", ""), "/admin/v1"+path.path,
+                                   dict(urllib.parse.parse_qsl(path.query)), operation.get("data") or {})
+        result = { "method": operation.get("method"), "bulkId": operation.get("bulkId"), "status": str(status) }
+        if status >= 400:
+            nb_errors += 1
+            result["response"] = response
+        elif response != None and "id" in response:
+            result["location"] = "/admin/v1/{}/{}".format(path.path.strip("/").split("/")[0], response["id"])
+        results.append(result)
+    return 200, { "schemas": [ "urn:ietf:params:scim:api:messages:2.0:BulkResponse" ], "Operations": results }
+
+# ---- OAuth2 client credentials token
+def get_token(headers, body):
+    if not headers.get("Authorization", "").startswith("Basic "): return error(401, "client authentication failed")
+    if urllib.parse.parse_qs(body).get("grant_type") != [ "client_credentials" ]: return error(400, "unsupported grant_type")
+    token = uuid.uuid4().hex
+    with LOCK:
+        TOKENS[token] = time.time() + TOKEN_TTL
+    return 200, { "access_token": token, "token_type": "Bearer", "expires_in": TOKEN_TTL }
+
+# ---- True if the request exceeds the rate limit
+def rate_limited():
+    if RATE_LIMIT == 0: return False
+    second = int(time.time())
+    with LOCK:
+        if RATE["second"] != second:
+            RATE["second"], RATE["count"] = second, 0
+        RATE["count"] += 1
+        return RATE["count"] > RATE_LIMIT
+
+# -------- classes
+
+# ---- HTTP requests handler (HTTP/1.1 keep-alive connections)
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if VERBOSE: BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send(self, status, response, headers={}):
+        body = b"" if response == None else json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json" if self.path.startswith("/oauth2") else "application/scim+json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items(): self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with LOCK:
+            STATS["requests"] += 1
+            STATS["bytes"] += len(body)
+
+    def handle_request(self, method):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8") if length > 0 else ""
+        if LATENCY > 0: time.sleep(LATENCY / 1000.0)
+        if rate_limited():
+            with LOCK: STATS["status_429"] += 1
+            return self.send(*error(429, "too many requests"), headers={ "Retry-After": "1" })
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/oauth2/v1/token" and method == "POST":
+            return self.send(*get_token(self.headers, body))
+
+        # bearer token needed for all the other requests
+        token = self.headers.get("Authorization", "")[len("Bearer "):]
+        with LOCK:
+            valid = TOKENS.get(token, 0) > time.time()
+        if not valid: return self.send(*error(401, "invalid or expired token"))
+        try:
+            data = json.loads(body) if body != "" else {}
+        except ValueError:
+            return self.send(*error(400, "invalid JSON"))
+        self.send(*execute(method, url.path, dict(urllib.parse.parse_qsl(url.query)), data))
+
+    def do_GET(self):    self.handle_request("GET")
+    def do_POST(self):   self.handle_request("POST")
+    def do_PUT(self):    self.handle_request("PUT")
+    def do_PATCH(self):  self.handle_request("PATCH")
+    def do_DELETE(self): self.handle_request("DELETE")
+
+# ---- threaded HTTP server (connections closed by clients without a request are not errors)
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+# ------------ main
+
+# -- parse arguments
+options = { "--port": "PORT", "--users": "NB_USERS", "--groups": "NB_GROUPS", "--groups-per-user": "GROUPS_PER_USER",
+            "--latency": "LATENCY", "--page-limit": "PAGE_LIMIT", "--rate-limit": "RATE_LIMIT", "--token-ttl": "TOKEN_TTL" }
+args = sys.argv[1:]
+while len(args) > 0:
+    arg = args.pop(0)
+    if arg == "-v":
+        VERBOSE = True
+    elif arg in options and len(args) > 0 and args[0].isdigit():
+        globals()[options[arg]] = int(args.pop(0))
+    else:
+        usage()
+if PAGE_LIMIT == 0: usage()
+
+# -- create the synthetic directory and serve requests until Ctrl-C
+create_directory()
+server = Server(("127.0.0.1", PORT), Handler)
+print ("IDCS stand-in listening on http://127.0.0.1:{} with {} users and {} groups (Ctrl-C to stop)".format(PORT, len(USERS), len(GROUPS)))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+server.server_close()
+print ("")
+print ("{} requests, {} bytes sent, {} requests refused with status 429".format(STATS["requests"], STATS["bytes"], STATS["status_429"]))
+
+# -- the end
+exit (0)
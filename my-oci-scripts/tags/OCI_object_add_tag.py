@@ -3,18 +3,36 @@
 # --------------------------------------------------------------------------------------------
 # This script adds a defined tag key and value (using tag namespace) to an OCI resource/object
 #
-# Supported resource types:
-# - COMPUTE: instance
-# - DATABASE: dbsystem, autonomous database
+# Supported resource types: see REGISTRY in OCI_tag_engine.py
+# - COMPUTE            : instance, custom image, boot volume
+# - BLOCK STORAGE      : block volume, block volume backup
+# - OBJECT STORAGE     : bucket
+# - DATABASE           : dbsystem, autonomous database
+# - NETWORKING         : vcn, subnet, route table, Internet gateway, DRG, network security group
+#                        security list, DHCP options, LPG, NAT gateway, service gateway
 # 
-# Note: OCI tenant and region given by an OCI CLI PROFILE
+# Bulk mode: the tag is added to many resources in one execution (OCIDs read from a file or stdin,
+#     or resources found by an OCI search query). Resources are grouped by compartment and resource type:
+#     resource types supported by the Identity bulk-edit-tags API are tagged with one work request
+#     per compartment (100 resources max per request), other resources with concurrent get/update calls.
+#
+# Note: OCI tenant given by an OCI CLI PROFILE, region given by the OCID of each resource
+#       (search queries in --search mode are executed in the region of the profile)
 # Author        : Christophe Pauliat
 # Platforms     : MacOS / Linux
 #
 # prerequisites : - Python 3 with OCI Python SDK installed
 #                 - OCI config file configured with profiles
+#                 - OCI_tag_engine.py in the same directory
 # Versions
 #    2020-04-27: Initial Version
+#    2020-05-11: add bulk mode (--file / --search)
+#    2020-05-12: use resource types registry and pooled clients from OCI_tag_engine.py
+#    2020-05-13: use the region given by the OCID instead of the region of the profile (mixed regions in bulk mode)
+#    2020-05-14: tag updates use ETags and are retried on conflict (safe with concurrent taggers)
+#    2020-05-16: add buckets (bulk-edit-tags with namespace metadata in bulk mode)
+#    2020-05-18: tag namespace, key and value validated before any call on the resources
+#    2020-05-31: only the resources named by the work request errors are failed (PARTIALLY_SUCCEEDED work requests)
 #
 # TO DO: add support for more resource types
 # --------------------------------------------------------------------------------------------
@@ -22,16 +40,26 @@
 # -- import
 import oci
 import sys
+import OCI_tag_engine
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # ---------- Functions
 
 # ---- variables
-configfile = "~/.oci/config"    # Define config file to be used.
+configfile      = "~/.oci/config"    # Define config file to be used.
+max_workers     = 16                 # Max number of concurrent API calls in bulk mode
+bulk_edit_max   = 100                # Max number of resources in a bulk-edit-tags request
 
 # ---- usage syntax
 def usage():
     print ("Usage: {} OCI_PROFILE object_ocid tag_namespace tag_key tag_value".format(sys.argv[0]))
+    print ("    or {} OCI_PROFILE --file OCIDS_FILE tag_namespace tag_key tag_value".format(sys.argv[0]))
+    print ("    or {} OCI_PROFILE --search QUERY tag_namespace tag_key tag_value".format(sys.argv[0]))
     print ("")
+    print ("    --file   : add the tag to all the resources listed in OCIDS_FILE (one OCID per line, - for stdin)")
+    print ("    --search : add the tag to all the resources found by the search query")
+    print ("               example: \"query instance resources where displayName =~ 'test'\"")
     print ("")
     print ("note: OCI_PROFILE must exist in {} file (see example below)".format(configfile))
     print ("")
@@ -43,85 +71,124 @@ def usage():
     print ("region      = eu-frankfurt-1")
     exit (1)
 
-# ---- specific functions to add tag to objects
-
-def add_tag_compute_instance(inst_id, ltag_ns, ltag_key, ltag_value):
-    global config
-
-    # Get Defined-tags for the compute instance
-    ComputeClient = oci.core.ComputeClient(config)
-    try:
-        response = ComputeClient.get_instance(inst_id)
-        instance = response.data
-    except:
-        print ("ERROR 03: instance with OCID '{}' not found !".format(inst_id))
-        exit (3)
-
-    # Add tag key to tag namespace and update compute instance
-    tags = instance.defined_tags
-    try:
-        tags[ltag_ns][ltag_key] = ltag_value
-        ComputeClient.update_instance(inst_id, oci.core.models.UpdateInstanceDetails(defined_tags=tags))
-    except:
-        print ("ERROR 05: cannot add this tag key with this tag value !")
-        print (sys.exc_info()[1].message)
-        exit (5)
-
-def add_tag_db_system(dbs_id, ltag_ns, ltag_key, ltag_value):
-    global config
-
-    # Get Defined-tags for the db system
-    DatabaseClient = oci.database.DatabaseClient(config)
+# ---------- Bulk mode
 
+# ---- read OCIDs from a file (- for stdin), one per line
+def read_ocids(filename):
     try:
-        response = DatabaseClient.get_db_system(dbs_id)
-        dbs = response.data
-    except:
-        print ("ERROR 03: db system with OCID '{}' not found !".format(dbs_id))
-        exit (3)
-
-    # Add tag key to tag namespace and update compute instance
-    tags = dbs.defined_tags
+        f = sys.stdin if filename == "-" else open(filename, "r")
+    except OSError:
+        print ("ERROR 06: cannot read file {} !".format(filename))
+        exit (6)
+    ocids = [ line.strip() for line in f if line.strip() != "" and not line.startswith("#") ]
+    if f != sys.stdin: f.close()
+    return list(dict.fromkeys(ocids))
+
+# ---- resource types supported by the bulk-edit-tags API (only the ones not needing metadata, or only the namespace for buckets)
+def get_bulk_edit_types():
+    IdentityClient = OCI_tag_engine.get_client(oci.identity.IdentityClient)
+    response = oci.pagination.list_call_get_all_results(IdentityClient.list_bulk_edit_tags_resource_types)
+    return { rt.resource_type.lower(): rt.resource_type for rt in response.data if not rt.metadata_keys or rt.metadata_keys == [ "namespaceName" ] }
+
+# ---- bulk-edit-tags resource for a resource found by search
+def bulk_edit_resource(region, item):
+    metadata = { "namespaceName": OCI_tag_engine.get_namespace(region) } if item.resource_type == "Bucket" else None
+    return oci.identity.models.BulkEditResource(id=item.identifier, resource_type=bulk_edit_types[item.resource_type.lower()], metadata=metadata)
+
+# ---- add the tag to up to bulk_edit_max resources of a compartment in a region with a bulk-edit-tags work request, and wait for it
+# ---- returns the list of (ocid, error) for failed resources
+def bulk_edit(region, compartment_id, items, ltag_ns, ltag_key, ltag_value):
+    IdentityClient = OCI_tag_engine.get_client(oci.identity.IdentityClient, region)
+    details = oci.identity.models.BulkEditTagsDetails(compartment_id=compartment_id,
+                  resources=[ bulk_edit_resource(region, item) for item in items ],
+                  bulk_edit_operations=[ oci.identity.models.BulkEditOperationDetails(operation_type="ADD_OR_SET", defined_tags={ ltag_ns: { ltag_key: ltag_value } }) ])
     try:
-        tags[ltag_ns][ltag_key] = ltag_value
-        DatabaseClient.update_db_system(dbs_id, oci.database.models.UpdateDbSystemDetails(defined_tags=tags))
-    except:
-        print ("ERROR 05: cannot add this tag key with this tag value !")
-        print (sys.exc_info()[1].message)
-        exit (5)
-
-def add_tag_autonomous_db(adb_id, ltag_ns, ltag_key, ltag_value):
-    global config
-
-    # Get Defined-tags for the autonomous DB
-    DatabaseClient = oci.database.DatabaseClient(config)
-
+        wr_id = IdentityClient.bulk_edit_tags(bulk_edit_tags_details=details).headers["opc-work-request-id"]
+        while True:
+            wr = IdentityClient.get_tagging_work_request(wr_id).data
+            if wr.status in ("SUCCEEDED", "FAILED", "PARTIALLY_SUCCEEDED", "CANCELED"): break
+            time.sleep(5)
+    except oci.exceptions.ServiceError as e:
+        return [ (item.identifier, e.message) for item in items ]
+    if wr.status == "SUCCEEDED": return []
+    failures = bulk_edit_failures(IdentityClient, wr_id, items) if wr.status in ("FAILED", "PARTIALLY_SUCCEEDED") else None
+    if failures != None: return failures
+    return [ (item.identifier, "bulk-edit-tags work request {:s} {:s}".format(wr_id, wr.status)) for item in items ]
+
+# ---- failed resources of a bulk-edit-tags work request: list of (ocid, error) from the errors of the work request
+# ---- (the errors give no resource field, the OCID is found in the message), None if an error names no resource of the request
+def bulk_edit_failures(IdentityClient, wr_id, items):
     try:
-        response = DatabaseClient.get_autonomous_database(adb_id)
-        adb = response.data
-    except:
-        print ("ERROR 03: Autonomous DB with OCID '{}' not found !".format(adb_id))
-        exit (3)
-
-    # Add tag key to tag namespace and update autonomous DB
-    tags = adb.defined_tags
+        errors = oci.pagination.list_call_get_all_results(IdentityClient.list_tagging_work_request_errors, wr_id).data
+    except oci.exceptions.ServiceError:
+        return None
+    failures = {}
+    for error in errors:
+        ocids = [ item.identifier for item in items if item.identifier in (error.message or "") ]
+        if len(ocids) == 0: return None
+        for ocid in ocids:
+            failures.setdefault(ocid, "bulk-edit-tags work request {:s}: {:s}".format(wr_id, error.message))
+    if len(failures) == 0: return None
+    return [ (item.identifier, failures[item.identifier]) for item in items if item.identifier in failures ]
+
+# ---- add the tag to one resource with get and update calls
+# ---- returns the list of (ocid, error) for failed resources (empty or one element)
+def get_update(obj_id, ltag_ns, ltag_key, ltag_value):
     try:
-        tags[ltag_ns][ltag_key] = ltag_value
-        DatabaseClient.update_autonomous_database(adb_id, oci.database.models.UpdateAutonomousDatabaseDetails(defined_tags=tags))
-    except:
-        print ("ERROR 05: cannot add this tag key with this tag value !")
-        print (sys.exc_info()[1].message)
-        exit (5)
+        OCI_tag_engine.add_tag(obj_id, ltag_ns, ltag_key, ltag_value)
+    except OCI_tag_engine.TagError as e:
+        return [ (obj_id, e.message) ]
+    return []
+
+# ---- add the tag to many resources (OCIDs list), and report throughput and failures
+def bulk_add_tag(ocids, items, ltag_ns, ltag_key, ltag_value):
+    global bulk_edit_types
+
+    start = time.time()
+    bulk_edit_types = get_bulk_edit_types()
+
+    # group the resources supported by bulk-edit-tags by region and compartment, get/update for the others
+    # (get/update calls are routed to the region of each OCID)
+    groups  = {}
+    singles = []
+    for ocid in ocids:
+        item = items.get(ocid)
+        if item != None and item.resource_type.lower() in bulk_edit_types:
+            groups.setdefault((OCI_tag_engine.get_region(ocid), item.compartment_id), []).append(item)
+        else:
+            singles.append(ocid)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures  = [ executor.submit(bulk_edit, region, cpt_id, group[i:i+bulk_edit_max], ltag_ns, ltag_key, ltag_value)
+                     for (region, cpt_id), group in groups.items() for i in range(0, len(group), bulk_edit_max) ]
+        futures += [ executor.submit(get_update, ocid, ltag_ns, ltag_key, ltag_value) for ocid in singles ]
+        failures = [ failure for future in futures for failure in future.result() ]
+
+    elapsed = time.time() - start
+    for ocid, error in failures:
+        print ("FAILED: {:s}: {:s}".format(ocid, error))
+    print ("{:d} resources tagged ({:d} with bulk-edit-tags, {:d} with get/update), {:d} failures in {:.1f} seconds ({:.1f} resources/second)".format(
+        len(ocids) - len(failures), len(ocids) - len(singles), len(singles), len(failures), elapsed, len(ocids) / elapsed if elapsed > 0 else 0))
+    print ("{:d} update conflicts (resource modified between get and update) retried".format(OCI_tag_engine.conflicts))
+    return len(failures)
 
 # ------------ main
 
 # -- parse arguments
+bulk_mode = None
 if len(sys.argv) == 6:
     profile  = sys.argv[1]
     obj_id   = sys.argv[2] 
     tag_ns   = sys.argv[3]
     tag_key  = sys.argv[4]
     tag_value= sys.argv[5]
+elif len(sys.argv) == 7 and sys.argv[2] in [ "--file", "--search" ]:
+    profile  = sys.argv[1]
+    bulk_mode= sys.argv[2]
+    bulk_arg = sys.argv[3]
+    tag_ns   = sys.argv[4]
+    tag_key  = sys.argv[5]
+    tag_value= sys.argv[6]
 else:
     usage()
 
@@ -133,17 +200,38 @@ except:
     print ("ERROR 02: profile '{}' not found in config file {} !".format(profile,configfile))
     exit (2)
 
-IdentityClient = oci.identity.IdentityClient(config)
-user = IdentityClient.get_user(config["user"]).data
-RootCompartmentID = user.compartment_id
+OCI_tag_engine.init(config)
 
-# -- Get the resource type from OCID
-obj_type = obj_id.split(".")[1].lower()
-
-if   obj_type == "instance":           add_tag_compute_instance(obj_id, tag_ns, tag_key, tag_value)
-elif obj_type == "dbsystem":           add_tag_db_system(obj_id, tag_ns, tag_key, tag_value)
-elif obj_type == "autonomousdatabase": add_tag_autonomous_db(obj_id, tag_ns, tag_key, tag_value)
-else: print ("SORRY: resource type {:s} is not yet supported by this script !".format(obj_type)) 
+# -- Check the tag namespace, key and value (cached tag definitions) before any call on the resources
+try:
+    OCI_tag_engine.validate_tag(tag_ns, tag_key, tag_value)
+except OCI_tag_engine.TagError as e:
+    print ("ERROR {:02d}: {:s} !".format(e.code, e.message))
+    exit (e.code)
+
+# -- Bulk mode
+if bulk_mode != None:
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if bulk_mode == "--file":
+            ocids = read_ocids(bulk_arg)
+            items = OCI_tag_engine.search_ocids(ocids, executor)
+        else:
+            found = OCI_tag_engine.search(bulk_arg)
+            ocids = [ item.identifier for item in found ]
+            items = { item.identifier: item for item in found }
+        OCI_tag_engine.index_buckets(items.values())
+    nb_failures = bulk_add_tag(ocids, items, tag_ns, tag_key, tag_value)
+    exit (0 if nb_failures == 0 else 5)
+
+# -- Add the tag (the resource type is given by the OCID)
+try:
+    OCI_tag_engine.add_tag(obj_id, tag_ns, tag_key, tag_value)
+except OCI_tag_engine.TagError as e:
+    if e.code == 4:
+        print ("SORRY: {:s} by this script !".format(e.message))
+    else:
+        print ("ERROR {:02d}: {:s} !".format(e.code, e.message))
+        exit (e.code)
 
 # -- the end
 exit (0)
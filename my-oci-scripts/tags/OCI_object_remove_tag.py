@@ -3,21 +3,34 @@
 # --------------------------------------------------------------------------------------------
 # This script removes a defined tag key (using tag namespace) from an OCI resource/object
 #
-# Supported resource types:
+# Supported resource types: see REGISTRY in OCI_tag_engine.py
 # - COMPUTE            : instance, custom image, boot volume
-# - BLOCK STORAGE      : block volume
-# - DATABASE           : dbsystem, autonomous database
+# - BLOCK STORAGE      : block volume, block volume backup
 # - OBJECT STORAGE     : bucket
-# - NETWORKING         : vcn, subnet, security list
+# - DATABASE           : dbsystem, autonomous database
+# - NETWORKING         : vcn, subnet, route table, Internet gateway, DRG, network security group
+#                        security list, DHCP options, LPG, NAT gateway, service gateway
 # 
-# Note: OCI tenant and region given by an OCI CLI PROFILE
+# Sweep mode: the tag key is removed from all the resources having it, in all subscribed regions (resources found
+#     by search queries, one per region, then tag removed with concurrent get/update calls).
+#     Progress is saved in a checkpoint file (append only: resources found per region, then one line per resource done)
+#     so an interrupted sweep started again with the same arguments does not search again and only processes
+#     the remaining resources. The checkpoint file is deleted when the sweep completes without failure.
+#
+# Note: OCI tenant given by an OCI CLI PROFILE, region given by the OCID of the resource
 # Author        : Christophe Pauliat
 # Platforms     : MacOS / Linux
 #
 # prerequisites : - Python 3 with OCI Python SDK installed
 #                 - OCI config file configured with profiles
+#                 - OCI_tag_engine.py in the same directory
 # Versions
 #    2020-04-27: Initial Version
+#    2020-05-12: use resource types registry and pooled clients from OCI_tag_engine.py
+#    2020-05-13: use the region given by the OCID instead of the region of the profile
+#    2020-05-16: add buckets
+#    2020-05-17: add sweep mode (--sweep) with checkpoint file
+#    2020-05-18: tag namespace and key validated before any call on the resources
 #
 # TO DO: add support for more resource types
 # --------------------------------------------------------------------------------------------
@@ -25,16 +38,28 @@
 # -- import
 import oci
 import sys
+import os
+import json
+import time
+import OCI_tag_engine
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # ---------- Functions
 
 # ---- variables
 configfile = "~/.oci/config"    # Define config file to be used.
+max_workers     = 16            # Max number of concurrent API calls in sweep mode
+checkpoint_dir  = "~/.oci"      # Directory for the checkpoint files of sweep mode
+progress_every  = 1000          # Print progress every N resources in sweep mode
 
 # ---- usage syntax
 def usage():
     print ("Usage: {} OCI_PROFILE object_ocid tag_namespace tag_key".format(sys.argv[0]))
+    print ("    or {} OCI_PROFILE --sweep tag_namespace tag_key".format(sys.argv[0]))
     print ("")
+    print ("    --sweep : remove the tag key from all the resources having it in all subscribed regions")
+    print ("              progress is saved in {}/remove_tag_sweep_OCI_PROFILE_NAMESPACE.KEY.checkpoint".format(checkpoint_dir))
+    print ("              and an interrupted sweep is resumed by executing the same command again")
     print ("")
     print ("note: OCI_PROFILE must exist in {} file (see example below)".format(configfile))
     print ("")
@@ -46,342 +71,121 @@ def usage():
     print ("region      = eu-frankfurt-1")
     exit (1)
 
-# ---- specific functions to remove tag keys from objects
-
-# -- compute
-def remove_tag_from_compute_instance(inst_id, ltag_ns, ltag_key):
-    global config
-
-    ComputeClient = oci.core.ComputeClient(config)
-
-    # Get Defined-tags for the compute instance
-    try:
-        response = ComputeClient.get_instance(inst_id)
-        instance = response.data
-    except:
-        print ("ERROR 03: instance with OCID '{}' not found !".format(inst_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = instance.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this compute instance !")
-        exit (5)
-
-    # Update compute instance
-    try:
-        ComputeClient.update_instance(inst_id, oci.core.models.UpdateInstanceDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this compute instance !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-def remove_tag_from_custom_image(image_id, ltag_ns, ltag_key):
-    global config
-
-    ComputeClient = oci.core.ComputeClient(config)
-
-    # Get Defined-tags for the custom image
-    try:
-        response = ComputeClient.get_image(image_id)
-        image = response.data
-    except:
-        print ("ERROR 03: custom image with OCID '{}' not found !".format(image_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = image.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this custom image !")
-        exit (5)
-
-    # Update custom image
-    try:
-        ComputeClient.update_image(image_id, oci.core.models.UpdateImageDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this custom image !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-def remove_tag_from_boot_volume(bootvol_id, ltag_ns, ltag_key):
-    global config
-
-    BlockstorageClient = oci.core.BlockstorageClient(config)
-
-    # Get Defined-tags for the boot volume
-    try:
-        response = BlockstorageClient.get_boot_volume(bootvol_id)
-        bootvol = response.data
-    except:
-        print ("ERROR 03: boot volume with OCID '{}' not found !".format(bootvol_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = bootvol.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this boot volume !")
-        exit (5)
-
-    # Update boot volume
-    try:
-        BlockstorageClient.update_boot_volume(bootvol_id, oci.core.models.UpdateBootVolumeDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this boot volume !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-# -- block storage
-def remove_tag_from_block_volume(bkvol_id, ltag_ns, ltag_key):
-    global config
-
-    BlockstorageClient = oci.core.BlockstorageClient(config)
-
-    # Get Defined-tags for the boot volume
-    try:
-        response = BlockstorageClient.get_volume(bkvol_id)
-        bkvol = response.data
-    except:
-        print ("ERROR 03: block volume with OCID '{}' not found !".format(bkvol_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = bkvol.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this block volume !")
-        exit (5)
-
-    # Update boot volume
-    try:
-        BlockstorageClient.update_volume(bkvol_id, oci.core.models.UpdateVolumeDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this block volume !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-# -- database
-def remove_tag_from_db_system(dbs_id, ltag_ns, ltag_key):
-    global config
-
-    DatabaseClient = oci.database.DatabaseClient(config)
-
-    # Get Defined-tags for the db system
-    try:
-        response = DatabaseClient.get_db_system(dbs_id)
-        dbs = response.data
-    except:
-        print ("ERROR 03: db system with OCID '{}' not found !".format(dbs_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = dbs.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this db system !")
-        exit (5)
-
-    # Update db system
-    try:
-        DatabaseClient.update_db_system(dbs_id, oci.database.models.UpdateDbSystemDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this db system !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-def remove_tag_from_autonomous_db(adb_id, ltag_ns, ltag_key):
-    global config
-
-    DatabaseClient = oci.database.DatabaseClient(config)
-
-    # Get Defined-tags for the autonomous DB
-    try:
-        response = DatabaseClient.get_autonomous_database(adb_id)
-        adb = response.data
-    except:
-        print ("ERROR 03: Autonomous DB with OCID '{}' not found !".format(adb_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = adb.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this autonomous database !")
-        exit (5)
-
-    # Update autonomous DB
-    try:
-        DatabaseClient.update_autonomous_database(adb_id, oci.database.models.UpdateAutonomousDatabaseDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this autonomous DB !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-# -- object storage
-def remove_tag_from_bucket(bucket_id, ltag_ns, ltag_key):
-    global config
-    bucket_name = "HOW-TO-GET-IT-FROM-BUCKET-ID-?"
-
-    ObjectStorageClient = oci.object_storage.ObjectStorageClient(config)
-
-    # Get namespace
-    response = ObjectStorageClient.get_namespace()
-    namespace = response.data
-
-    # Get Defined-tags for the bucket
-    try:
-        response = ObjectStorageClient.get_bucket(namespace, bucket_name)
-        bucket = response.data
-    except:
-        print ("ERROR 03: Bucket with OCID '{}' not found !".format(bucket_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = bucket.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this bucket !")
-        exit (5)
-
-    # Update bucket
-    try:
-        ObjectStorageClient.update_bucket(namespace, bucket_id, oci.object_storage.models.UpdateBucketDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this bucket !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-# -- networking
-def remove_tag_from_vcn(vcn_id, ltag_ns, ltag_key):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    # Get Defined-tags for the VCN
-    try:
-        response = VirtualNetworkClient.get_vcn(vcn_id)
-        vcn = response.data
-    except:
-        print ("ERROR 03: VCN with OCID '{}' not found !".format(vcn_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = vcn.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this VCN !")
-        exit (5)
-
-    # Update VCN
-    try:
-        VirtualNetworkClient.update_vcn(vcn_id, oci.core.models.UpdateVcnDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this VCN !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-def remove_tag_from_subnet(subnet_id, ltag_ns, ltag_key):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    # Get Defined-tags for the subnet
-    try:
-        response = VirtualNetworkClient.get_subnet(subnet_id)
-        subnet = response.data
-    except:
-        print ("ERROR 03: Subnet with OCID '{}' not found !".format(subnet_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = subnet.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this subnet !")
-        exit (5)
-
-    # Update subnet
-    try:
-        VirtualNetworkClient.update_subnet(subnet_id, oci.core.models.UpdateSubnetDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this subnet !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-def remove_tag_from_security_list(seclist_id, ltag_ns, ltag_key):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    # Get Defined-tags for the security list
-    try:
-        response = VirtualNetworkClient.get_security_list(seclist_id)
-        seclist = response.data
-    except:
-        print ("ERROR 03: Security list with OCID '{}' not found !".format(seclist_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = seclist.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this security list !")
-        exit (5)
-
-    # Update security list
-    try:
-        VirtualNetworkClient.update_security_list(seclist_id, oci.core.models.UpdateSecurityListDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this security list !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
-def remove_tag_from_route_table(rt_id, ltag_ns, ltag_key):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    # Get Defined-tags for the route table
-    try:
-        response = VirtualNetworkClient.get_route_table(rt_id)
-        rt = response.data
-    except:
-        print ("ERROR 03: Route table with OCID '{}' not found !".format(rt_id))
-        exit (3)
-
-    # Remove tag key from tag namespace
-    tags = rt.defined_tags
-    try:
-        del tags[ltag_ns][ltag_key]
-    except:
-        print ("ERROR 05: this tag key does not exist for this route table !")
-        exit (5)
-
-    # Update route table
-    try:
-        VirtualNetworkClient.update_route_table(rt_id, oci.core.models.UpdateRouteTableDetails(defined_tags=tags))
-    except:
-        print ("ERROR 06: cannot remove this tag from this route table !")
-        print (sys.exc_info()[1].message)
-        exit (6)
-
+# ---- read the checkpoint file of an interrupted sweep
+# ---- returns the regions already searched, the OCIDs found (in order) and the OCIDs already processed
+def read_checkpoint(filename):
+    regions, ocids, done = set(), {}, set()
+    try:
+        with open(filename, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue                # last line truncated by an interruption
+                if "region" in record:
+                    regions.add(record["region"])
+                    ocids.update(dict.fromkeys(record["ocids"]))
+                elif "done" in record:
+                    done.add(record["done"])
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print ("ERROR 07: cannot read checkpoint file {:s}: {:s} !".format(filename, str(e)))
+        exit (7)
+    return regions, list(ocids), done
+
+# ---- append a record to the checkpoint file (written immediately)
+def checkpoint(f, record):
+    f.write(json.dumps(record)+"\n")
+    f.flush()
+
+# ---- search the resources having the tag key in a region
+def search_region(region, ltag_ns, ltag_key):
+    query = "query all resources where (definedTags.namespace = '{:s}' && definedTags.key = '{:s}')".format(ltag_ns, ltag_key)
+    items = OCI_tag_engine.search(query, region)
+    OCI_tag_engine.index_buckets(items, region)
+    return items
+
+# ---- remove the tag key from one resource. Returns None if OK, or the error message
+def remove_one(obj_id, ltag_ns, ltag_key):
+    try:
+        OCI_tag_engine.remove_tag(obj_id, ltag_ns, ltag_key)
+    except OCI_tag_engine.TagError as e:
+        if e.code != 5:             # code 5: tag key already removed
+            return e.message
+    return None
+
+# ---- remove the tag key from all the resources having it in all subscribed regions (resumable)
+def sweep(ltag_ns, ltag_key):
+    filename = os.path.join(os.path.expanduser(checkpoint_dir), "remove_tag_sweep_{:s}_{:s}.{:s}.checkpoint".format(profile, ltag_ns, ltag_key))
+    regions_done, ocids, done = read_checkpoint(filename)
+    if len(regions_done) > 0:
+        print ("Resuming sweep from checkpoint file {:s}: {:d} resources already processed".format(filename, len(done)))
+
+    IdentityClient = OCI_tag_engine.get_client(oci.identity.IdentityClient)
+    response = oci.pagination.list_call_get_all_results(IdentityClient.list_region_subscriptions, config["tenancy"])
+    regions = [ r.region_name for r in response.data if r.region_name not in regions_done ]
+
+    start = time.time()
+    failures = {}
+    unsupported = 0
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        f = open(filename, "a")
+        if f.tell() > 0: f.write("\n")    # in case the last line was truncated by an interruption
+    except OSError as e:
+        print ("ERROR 07: cannot write checkpoint file {:s}: {:s} !".format(filename, str(e)))
+        exit (7)
+    with f, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # search the regions not yet searched and save the resources found
+        futures = { executor.submit(search_region, region, ltag_ns, ltag_key): region for region in regions }
+        for future in as_completed(futures):
+            region_ocids = [ item.identifier for item in future.result() ]
+            checkpoint(f, { "region": futures[future], "ocids": region_ocids })
+            print ("{:s}: {:d} resources with tag key {:s}.{:s}".format(futures[future], len(region_ocids), ltag_ns, ltag_key))
+            ocids += region_ocids
+
+        # remove the tag key from the resources not yet processed
+        todo = [ ocid for ocid in dict.fromkeys(ocids) if ocid not in done ]
+        futures = {}
+        for ocid in todo:
+            if OCI_tag_engine.lookup(ocid) == None:
+                unsupported += 1
+                failures[ocid] = "resource type {:s} is not yet supported".format(OCI_tag_engine.get_obj_type(ocid))
+                checkpoint(f, { "done": ocid, "error": failures[ocid] })
+            else:
+                futures[executor.submit(remove_one, ocid, ltag_ns, ltag_key)] = ocid
+        for nb, future in enumerate(as_completed(futures), 1):
+            error = future.result()
+            if error == None:
+                checkpoint(f, { "done": futures[future] })
+            else:
+                failures[futures[future]] = error
+            if nb % progress_every == 0:
+                print ("{:d}/{:d} resources processed".format(nb, len(futures)))
+
+    elapsed = time.time() - start
+    for ocid, error in failures.items():
+        print ("FAILED: {:s}: {:s}".format(ocid, error))
+    print ("{:d} resources processed ({:d} already processed before), {:d} failures ({:d} unsupported resource types) in {:.1f} seconds".format(
+        len(todo), len(done), len(failures), unsupported, elapsed))
+    print ("{:d} update conflicts (resource modified between get and update) retried".format(OCI_tag_engine.conflicts))
+    if len(failures) == unsupported:
+        os.remove(filename)
+    else:
+        print ("Execute the same command again to retry the failed resources (checkpoint file {:s})".format(filename))
+    return len(failures) - unsupported
 
 # ------------ main
 
 # -- parse arguments
-if len(sys.argv) == 5:
+sweep_mode = False
+if len(sys.argv) == 5 and sys.argv[2] == "--sweep":
+    profile    = sys.argv[1]
+    sweep_mode = True
+    tag_ns     = sys.argv[3]
+    tag_key    = sys.argv[4]
+elif len(sys.argv) == 5:
     profile  = sys.argv[1]
     obj_id   = sys.argv[2] 
     tag_ns   = sys.argv[3]
@@ -397,30 +201,29 @@ except:
     print ("ERROR 02: profile '{}' not found in config file {} !".format(profile,configfile))
     exit (2)
 
-IdentityClient = oci.identity.IdentityClient(config)
-user = IdentityClient.get_user(config["user"]).data
-RootCompartmentID = user.compartment_id
+OCI_tag_engine.init(config)
 
-# -- Get the resource type from OCID
-obj_type = obj_id.split(".")[1].lower()
+# -- Check the tag namespace and key (cached tag definitions) before any call on the resources
+try:
+    OCI_tag_engine.validate_tag(tag_ns, tag_key)
+except OCI_tag_engine.TagError as e:
+    print ("ERROR {:02d}: {:s} !".format(e.code, e.message))
+    exit (e.code)
+
+# -- Sweep mode
+if sweep_mode:
+    nb_failures = sweep(tag_ns, tag_key)
+    exit (0 if nb_failures == 0 else 6)
 
-# compute
-if   obj_type == "instance":           remove_tag_from_compute_instance(obj_id, tag_ns, tag_key)
-elif obj_type == "image":              remove_tag_from_custom_image(obj_id, tag_ns, tag_key)
-elif obj_type == "bootvolume":         remove_tag_from_boot_volume(obj_id, tag_ns, tag_key)
-# block storage
-elif obj_type == "volume":             remove_tag_from_block_volume(obj_id, tag_ns, tag_key)
-# database
-elif obj_type == "dbsystem":           remove_tag_from_db_system(obj_id, tag_ns, tag_key)
-elif obj_type == "autonomousdatabase": remove_tag_from_autonomous_db(obj_id, tag_ns, tag_key)
-# object storage
-elif obj_type == "bucket":             remove_tag_from_bucket(obj_id, tag_ns, tag_key)
-# networking
-elif obj_type == "vcn":                remove_tag_from_vcn(obj_id, tag_ns, tag_key)
-elif obj_type == "subnet":             remove_tag_from_subnet(obj_id, tag_ns, tag_key)
-elif obj_type == "securitylist":       remove_tag_from_security_list(obj_id, tag_ns, tag_key)
-elif obj_type == "routetable":         remove_tag_from_route_table(obj_id, tag_ns, tag_key)
-else: print ("SORRY: resource type {:s} is not yet supported by this script !".format(obj_type)) 
+# -- Remove the tag key (the resource type is given by the OCID)
+try:
+    OCI_tag_engine.remove_tag(obj_id, tag_ns, tag_key)
+except OCI_tag_engine.TagError as e:
+    if e.code == 4:
+        print ("SORRY: {:s} by this script !".format(e.message))
+    else:
+        print ("ERROR {:02d}: {:s} !".format(e.code, e.message))
+        exit (e.code)
 
 # -- the end
 exit (0)
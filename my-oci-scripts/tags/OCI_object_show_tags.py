@@ -3,29 +3,38 @@
 # ----------------------------------------------------------------------------------------------------------
 # This script show defined tags for an OCI resource/object
 #
-# Supported resource types:
+# Supported resource types: see REGISTRY in OCI_tag_engine.py
 # - COMPUTE            : instance, custom image, boot volume
 # - BLOCK STORAGE      : block volume, block volume backup
-# - DATABASE           : dbsystem, autonomous database
 # - OBJECT STORAGE     : bucket
+# - DATABASE           : dbsystem, autonomous database
 # - NETWORKING         : vcn, subnet, route table, Internet gateway, DRG, network security group
 #                        security list, DHCP options, LPG, NAT gateway, service gateway
 # 
-# Note: OCI tenant and region given by an OCI CLI PROFILE
+# Note: OCI tenant given by an OCI CLI PROFILE, region given by the OCID of the resource
 # Author        : Christophe Pauliat
 # Platforms     : MacOS / Linux
 #
 # prerequisites : - Python 3 with OCI Python SDK installed
 #                 - OCI config file configured with profiles
+#                 - OCI_tag_engine.py in the same directory
 # Versions
 #    2020-04-28: Initial Version
+#    2020-05-12: use resource types registry and pooled clients from OCI_tag_engine.py
+#    2020-05-13: use the region given by the OCID instead of the region of the profile
+#    2020-05-15: add export mode (--export csv|jsonl)
+#    2020-05-16: add buckets
 #
 # TO DO: add support for more resource types
 # ----------------------------------------------------------------------------------------------------------
 
 # -- import
 import oci
+import re
 import sys
+import csv
+import json
+import OCI_tag_engine
 
 # ---------- Functions
 
@@ -35,7 +44,14 @@ configfile = "~/.oci/config"    # Define config file to be used.
 # ---- usage syntax
 def usage():
     print ("Usage: {} OCI_PROFILE object_ocid".format(sys.argv[0]))
+    print ("    or {} OCI_PROFILE --export csv|jsonl [-a] [-c compartment_ocid] [-q query] [--columns col1,col2,...]".format(sys.argv[0]))
     print ("")
+    print ("    --export : export the tags of all resources (search results) to standard output in CSV or JSONL format")
+    print ("    -a       : all subscribed regions instead of the region of the profile")
+    print ("    -c       : only the resources in this compartment (not in sub-compartments)")
+    print ("    -q       : only the resources found by this search query (default: \"query all resources\")")
+    print ("    --columns: tag columns for CSV (ex: osc.automatic_shutdown,freeform:owner). If not provided, the CSV columns")
+    print ("               are known only at the end, so CSV rows are written after the search (JSONL is always streamed)")
     print ("")
     print ("note: OCI_PROFILE must exist in {} file (see example below)".format(configfile))
     print ("")
@@ -47,271 +63,70 @@ def usage():
     print ("region      = eu-frankfurt-1")
     exit (1)
 
-# ---- specific functions to show tags for objects
-
-# -- compute
-def show_tags_from_compute_instance(inst_id):
-    global config
-
-    ComputeClient = oci.core.ComputeClient(config)
-
-    try:
-        response = ComputeClient.get_instance(inst_id)
-        instance = response.data
-        print (instance.defined_tags)
-    except:
-        print ("ERROR 03: instance with OCID '{}' not found !".format(inst_id))
-        exit (3)
-
-def show_tags_from_custom_image(image_id):
-    global config
-
-    ComputeClient = oci.core.ComputeClient(config)
-
-    try:
-        response = ComputeClient.get_image(image_id)
-        image = response.data
-        print (image.defined_tags)
-    except:
-        print ("ERROR 03: custom image with OCID '{}' not found !".format(image_id))
-        exit (3)
-
-def show_tags_from_boot_volume(bootvol_id):
-    global config
-
-    BlockstorageClient = oci.core.BlockstorageClient(config)
-
-    try:
-        response = BlockstorageClient.get_boot_volume(bootvol_id)
-        bootvol = response.data
-        print (bootvol.defined_tags)
-    except:
-        print ("ERROR 03: boot volume with OCID '{}' not found !".format(bootvol_id))
-        exit (3)
-
-# -- block storage
-def show_tags_from_block_volume(bkvol_id):
-    global config
-
-    BlockstorageClient = oci.core.BlockstorageClient(config)
-
-    try:
-        response = BlockstorageClient.get_volume(bkvol_id)
-        bkvol = response.data
-        print (bkvol.defined_tags)
-    except:
-        print ("ERROR 03: block volume with OCID '{}' not found !".format(bkvol_id))
-        exit (3)
-
-def show_tags_from_block_volume_backup(bkvolbkup_id):
-    global config
-
-    BlockstorageClient = oci.core.BlockstorageClient(config)
-
-    try:
-        response = BlockstorageClient.get_volume_backup(bkvolbkup_id)
-        bkvol_bkup = response.data
-        print (bkvol_bkup.defined_tags)
-    except:
-        print ("ERROR 03: block volume backup with OCID '{}' not found !".format(bkvolbkup_id))
-        exit (3)
-
-# -- database
-def show_tags_from_db_system(dbs_id):
-    global config
-
-    DatabaseClient = oci.database.DatabaseClient(config)
-
-    try:
-        response = DatabaseClient.get_db_system(dbs_id)
-        dbs = response.data
-        print (dbs.defined_tags)
-    except:
-        print ("ERROR 03: db system with OCID '{}' not found !".format(dbs_id))
-        exit (3)
-
-def show_tags_from_autonomous_db(adb_id):
-    global config
-
-    DatabaseClient = oci.database.DatabaseClient(config)
-
-    try:
-        response = DatabaseClient.get_autonomous_database(adb_id)
-        adb = response.data
-        print (adb.defined_tags)
-    except:
-        print ("ERROR 03: Autonomous DB with OCID '{}' not found !".format(adb_id))
-        exit (3)
-
-# -- object storage     # DOES NOT WORK
-def show_tags_from_bucket(bucket_id):
-    global config
-    bucket_name = "HOW-TO-GET-IT-FROM-BUCKET-ID-?"
-
-    ObjectStorageClient = oci.object_storage.ObjectStorageClient(config)
-
-    # Get namespace
-    response = ObjectStorageClient.get_namespace()
-    namespace = response.data
-
-    try:
-        response = ObjectStorageClient.get_bucket(namespace, bucket_name)
-        bucket = response.data
-        print (bucket.defined_tags)
-    except:
-        print ("ERROR 03: Bucket with OCID '{}' not found !".format(bucket_id))
-        exit (3)
-
-# -- networking
-def show_tags_from_vcn(vcn_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_vcn(vcn_id)
-        vcn = response.data
-        print (vcn.defined_tags)
-    except:
-        print ("ERROR 03: VCN with OCID '{}' not found !".format(vcn_id))
-        exit (3)
-
-def show_tags_from_subnet(subnet_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_subnet(subnet_id)
-        subnet = response.data
-        print (subnet.defined_tags)
-    except:
-        print ("ERROR 03: Subnet with OCID '{}' not found !".format(subnet_id))
-        exit (3)
-
-def show_tags_from_route_table(rt_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_route_table(rt_id)
-        rt = response.data
-        print (rt.defined_tags)
-    except:
-        print ("ERROR 03: Route table with OCID '{}' not found !".format(rt_id))
-        exit (3)
-
-def show_tags_from_internet_gateway(ig_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_internet_gateway(ig_id)
-        ig = response.data
-        print (ig.defined_tags)
-    except:
-        print ("ERROR 03: Internet gateway with OCID '{}' not found !".format(ig_id))
-        exit (3)
-
-def show_tags_from_dynamic_routing_gateway(drg_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_drg(drg_id)
-        drg = response.data
-        print (drg.defined_tags)
-    except:
-        print ("ERROR 03: Dynamic routing gateway with OCID '{}' not found !".format(drg_id))
-        exit (3)
-
-def show_tags_from_network_security_group(nsg_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_network_security_group(nsg_id)
-        nsg = response.data
-        print (nsg.defined_tags)
-    except:
-        print ("ERROR 03: Network security group with OCID '{}' not found !".format(nsg_id))
-        exit (3)
-
-def show_tags_from_security_list(seclist_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_security_list(seclist_id)
-        seclist = response.data
-        print (seclist.defined_tags)
-    except:
-        print ("ERROR 03: Security list with OCID '{}' not found !".format(seclist_id))
-        exit (3)
-
-def show_tags_from_dhcp_options(do_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_dhcp_options(do_id)
-        do = response.data
-        print (do.defined_tags)
-    except:
-        print ("ERROR 03: DHCP options with OCID '{}' not found !".format(do_id))
-        exit (3)
-
-def show_tags_from_local_peering_gateway(lpg_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_local_peering_gateway(lpg_id)
-        lpg = response.data
-        print (lpg.defined_tags)
-    except:
-        print ("ERROR 03: Local peering gateway with OCID '{}' not found !".format(lpg_id))
-        exit (3)
-
-def show_tags_from_nat_gateway(ng_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_nat_gateway(ng_id)
-        ng = response.data
-        print (ng.defined_tags)
-    except:
-        print ("ERROR 03: NAT gateway with OCID '{}' not found !".format(ng_id))
-        exit (3)
-
-def show_tags_from_service_gateway(sg_id):
-    global config
-
-    VirtualNetworkClient = oci.core.VirtualNetworkClient(config)
-
-    try:
-        response = VirtualNetworkClient.get_service_gateway(sg_id)
-        sg = response.data
-        print (sg.defined_tags)
-    except:
-        print ("ERROR 03: Service gateway with OCID '{}' not found !".format(sg_id))
-        exit (3)
+# ---- flatten the tags of a resource found by search: dictionary column -> value
+def flatten(item, region):
+    row = { "region": region, "resource_type": item.resource_type, "compartment": cpt_names.get(item.compartment_id, "root"),
+            "display_name": item.display_name, "ocid": item.identifier }
+    for ns, keys in (item.defined_tags or {}).items():
+        for key, value in keys.items():
+            row[ns+"."+key] = value
+    for key, value in (item.freeform_tags or {}).items():
+        row["freeform:"+key] = value
+    return row
+
+# ---- export the tags of the resources found by a search query in the regions, to stdout
+def export_tags(query, regions, fmt, columns):
+    base_columns = [ "region", "resource_type", "compartment", "display_name", "ocid" ]
+    buffered = []
+    tag_columns = set()
+    if fmt == "csv" and columns != None:
+        writer = csv.DictWriter(sys.stdout, fieldnames=base_columns+columns, extrasaction="ignore")
+        writer.writeheader()
+    for region in regions:
+        for item in OCI_tag_engine.search_iter(query, region):
+            row = flatten(item, region)
+            if fmt == "jsonl":
+                sys.stdout.write(json.dumps(row)+"\n")
+            elif columns != None:
+                writer.writerow(row)
+            else:
+                buffered.append(row)
+                tag_columns.update(row.keys())
+    if fmt == "csv" and columns == None:
+        writer = csv.DictWriter(sys.stdout, fieldnames=base_columns+sorted(tag_columns - set(base_columns)))
+        writer.writeheader()
+        writer.writerows(buffered)
 
 # ------------ main
 
 # -- parse arguments
+export_fmt = None
 if len(sys.argv) == 3:
     profile = sys.argv[1]
     obj_id  = sys.argv[2] 
+elif len(sys.argv) >= 4 and sys.argv[2] == "--export":
+    profile     = sys.argv[1]
+    export_fmt  = sys.argv[3]
+    all_regions = False
+    cpt_id      = None
+    query       = "query all resources"
+    columns     = None
+    args = sys.argv[4:]
+    while len(args) > 0:
+        arg = args.pop(0)
+        if   arg == "-a": all_regions = True
+        elif arg == "-c"        and len(args) > 0: cpt_id  = args.pop(0)
+        elif arg == "-q"        and len(args) > 0: query   = args.pop(0)
+        elif arg == "--columns" and len(args) > 0: columns = args.pop(0).split(",")
+        else: usage()
+    if export_fmt not in [ "csv", "jsonl" ]: usage()
+    if cpt_id != None:
+        parts = re.split(r"\s+where\s+", query, 1, flags=re.IGNORECASE)
+        if len(parts) == 1:
+            query += " where compartmentId = '{:s}'".format(cpt_id)
+        else:
+            # parentheses: && has precedence over || in the condition of the query
+            query = "{:s} where ({:s}) && compartmentId = '{:s}'".format(parts[0], parts[1], cpt_id)
 else:
     usage()
 
@@ -323,38 +138,31 @@ except:
     print ("ERROR 02: profile '{}' not found in config file {} !".format(profile,configfile))
     exit (2)
 
-IdentityClient = oci.identity.IdentityClient(config)
-user = IdentityClient.get_user(config["user"]).data
-RootCompartmentID = user.compartment_id
-
-# -- Get the resource type from OCID
-obj_type = obj_id.split(".")[1].lower()
-
-# compute
-if   obj_type == "instance":             show_tags_from_compute_instance(obj_id)
-elif obj_type == "image":                show_tags_from_custom_image(obj_id)
-elif obj_type == "bootvolume":           show_tags_from_boot_volume(obj_id)
-# block storage
-elif obj_type == "volume":               show_tags_from_block_volume(obj_id)
-elif obj_type == "volumebackup":         show_tags_from_block_volume_backup(obj_id)
-# database
-elif obj_type == "dbsystem":             show_tags_from_db_system(obj_id)
-elif obj_type == "autonomousdatabase":   show_tags_from_autonomous_db(obj_id)
-# object storage
-elif obj_type == "bucket":               show_tags_from_bucket(obj_id)
-# networking
-elif obj_type == "vcn":                  show_tags_from_vcn(obj_id)
-elif obj_type == "subnet":               show_tags_from_subnet(obj_id)
-elif obj_type == "routetable":           show_tags_from_route_table(obj_id)
-elif obj_type == "internetgateway":      show_tags_from_internet_gateway(obj_id)
-elif obj_type == "drg":                  show_tags_from_dynamic_routing_gateway(obj_id)
-elif obj_type == "networksecuritygroup": show_tags_from_network_security_group(obj_id)
-elif obj_type == "securitylist":         show_tags_from_security_list(obj_id)
-elif obj_type == "dhcpoptions":          show_tags_from_dhcp_options(obj_id)
-elif obj_type == "localpeeringgateway":  show_tags_from_local_peering_gateway(obj_id)
-elif obj_type == "natgateway":           show_tags_from_nat_gateway(obj_id)
-elif obj_type == "servicegateway":       show_tags_from_service_gateway(obj_id)
-else: print ("SORRY: resource type {:s} is not yet supported by this script !".format(obj_type)) 
+OCI_tag_engine.init(config)
+
+# -- Export mode
+if export_fmt != None:
+    IdentityClient = oci.identity.IdentityClient(config)
+    RootCompartmentID = IdentityClient.get_user(config["user"]).data.compartment_id
+    response = oci.pagination.list_call_get_all_results(IdentityClient.list_compartments, RootCompartmentID, compartment_id_in_subtree=True)
+    cpt_names = { c.id: c.name for c in response.data }
+    if all_regions:
+        response = oci.pagination.list_call_get_all_results(IdentityClient.list_region_subscriptions, RootCompartmentID)
+        regions = [ r.region_name for r in response.data ]
+    else:
+        regions = [ config["region"] ]
+    export_tags(query, regions, export_fmt, columns)
+    exit (0)
+
+# -- Show the defined tags (the resource type is given by the OCID)
+try:
+    print (OCI_tag_engine.get_defined_tags(obj_id))
+except OCI_tag_engine.TagError as e:
+    if e.code == 4:
+        print ("SORRY: {:s} by this script !".format(e.message))
+    else:
+        print ("ERROR {:02d}: {:s} !".format(e.code, e.message))
+        exit (e.code)
 
 # -- the end
 exit (0)
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# This script looks for OCI resources with specific tag keys and stop (or start) them if the
+#     tag value for the tag key matches the current time.
+# It replaces the per-service stop/start scripts with a single pass: one search per region covers all
+#     supported resource types, and actions are dispatched concurrently.
+#
+# Supported resource types (one plugin per type, see PLUGINS below):
+# - COMPUTE  : compute instances, instance pools
+# - DATABASE : autonomous databases, VM database systems (DB nodes are stopped/started)
+#
+# You can use it to automatically stop some resources during non working hours
+#     and start them again at the beginning of working hours to save cloud credits
+# This script needs to be executed every hour during working days by an external scheduler
+#     (cron table on Linux for example)
+# You can add the 2 tag keys to the default tags for root compartment so that every new resource
+#     get those 2 tag keys with default value ("off" or a specific UTC time)
+# Tag values are schedule expressions (days, time zones, minutes, catch-up window), for example
+#     "08:00_UTC" or "mon-fri 07:30 Europe/Paris +2h" (see OCI_tag_schedule.py for the syntax)
+#
+# This script looks in all compartments in a OCI tenant in a region (or all subscribed regions) using OCI Python SDK
+# Note: OCI tenant and region given by an OCI CLI PROFILE
+#
+# Author        : Christophe Pauliat
+# Platforms     : MacOS / Linux
+#
+# prerequisites : - Python 3 with OCI Python SDK installed
+#                 - OCI config file configured with profiles
+#                 - OCI_tag_schedule.py in the same directory
+# Versions
+#    2020-05-04: Initial Version (merge of instances, autonomous DBs and VM DB systems scripts + instance pools)
+#    2020-05-06: use schedule expressions in tag values (see OCI_tag_schedule.py) instead of exact HH:00_UTC match
+#    2020-05-07: add --plan/--apply to compute an action plan (JSON file) ahead of time and apply it later
+#    2020-05-08: add a journal of dispatched actions and a lock per profile (no double dispatch by overlapping runs)
+#    2020-05-20: add --types, --only and --match (used by the shims replacing the old per-service scripts in old/)
+#    2020-05-31: one lock and journal per profile for full runs and shims (filter of the run in the journal entries)
+# ---------------------------------------------------------------------------------------------------------------------------------
+
+# -- import
+import oci
+import sys
+import os
+import json
+import time
+import fcntl
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import OCI_tag_schedule
+
+# ---------- Tag names, key and value to look for
+# Resources tagged using this will be stopped/started.
+# Update these to match your tags.
+tag_ns        = "osc"
+tag_key_stop  = "automatic_shutdown"
+tag_key_start = "automatic_startup"
+
+# ---------- variables
+configfile  = "~/.oci/config"    # Define config file to be used.
+max_workers = 16                 # Max number of concurrent API calls (regions and actions)
+print_lock  = threading.Lock()
+clients     = threading.local()  # OCI clients are cached per thread and per region
+journal_dir = "~/.oci"           # Directory for the journal of dispatched actions and the lock file (one per profile)
+journal_days= 7                  # Journal entries older than this are removed at startup
+journal_lock= threading.Lock()
+lock_wait   = 300                # Max seconds waiting for the lock of the profile (old scripts shims started at the same time)
+
+# ---------- Functions
+
+# ---- usage syntax
+def usage():
+    print ("Usage: {} [-a] [--time YYYY-MM-DDTHH:MM] [--plan PLAN_FILE] [--types TYPES] [--only stop|start] [--match NS.KEY=VALUE]".format(sys.argv[0]))
+    print ("       [--confirm_stop] [--confirm_start] OCI_PROFILE")
+    print ("       {} --apply PLAN_FILE OCI_PROFILE".format(sys.argv[0]))
+    print ("")
+    print ("Notes:")
+    print ("    If -a is provided, the script processes all active regions instead of singe region provided in profile")
+    print ("    If --confirm_stop  is not provided, the resources to stop are listed but not actually stopped")
+    print ("    If --confirm_start is not provided, the resources to start are listed but not actually started")
+    print ("    If --time is provided, the schedules are evaluated at this UTC time instead of current time")
+    print ("    If --plan is provided, the actions are written to a JSON plan file but not executed")
+    print ("    If --apply is provided, the actions of the plan file are executed (stop and start) without any search")
+    print ("    If --types is provided, only these resource types are processed (comma separated list of {:s})".format(", ".join(PLUGINS.keys())))
+    print ("    If --only is provided, only the stop (or start) actions are executed")
+    print ("    If --match is provided (needs --only), the resources with this tag value are stopped (or started) now, without schedule")
+    print ("        (historical tagging, for example --match osc.stop_non_working_hours=on --only stop)")
+    print ("    Dispatched actions are recorded in {}/stop_start_tagged_OCI_PROFILE.journal and are not dispatched again".format(journal_dir))
+    print ("    for the same scheduled time. Only one instance of the script runs at a time for a given profile (the others wait).")
+    print ("    Example: compute the plan before 08:00 UTC, then apply it at 08:00 UTC")
+    print ("        {} -a --time 2020-05-07T08:00 --plan /tmp/plan.json OCI_PROFILE".format(sys.argv[0]))
+    print ("        {} --apply /tmp/plan.json OCI_PROFILE".format(sys.argv[0]))
+    print ("")
+    print ("note: OCI_PROFILE must exist in {} file (see example below)".format(configfile))
+    print ("")
+    print ("[EMEAOSCf]")
+    print ("tenancy     = ocid1.tenancy.oc1..aaaaaaaaw7e6nkszrry6d5hxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx")
+    print ("user        = ocid1.user.oc1..aaaaaaaayblfepjieoxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx")
+    print ("fingerprint = 19:1d:7b:3a:17:xx:xx:xx:xx:xx:xx:xx:xx:xx:xx:xx")
+    print ("key_file    = /Users/cpauliat/.oci/api_key.pem")
+    print ("region      = eu-frankfurt-1")
+    exit (1)
+
+# ---- Thread safe print of a line prefixed with time, region and compartment
+def log(lregion, cpt_name, message):
+    with print_lock:
+        print ("{:s}, {:s}, {:s}: {:s}".format(datetime.utcnow().strftime("%T"), lregion, cpt_name, message))
+
+# ---- Get an OCI client for a region (one client per thread and per region)
+def get_client(client_class, lregion):
+    global config
+
+    if not hasattr(clients, "cache"):
+        clients.cache = {}
+    key = (client_class, lregion)
+    if key not in clients.cache:
+        lconfig = dict(config)
+        lconfig["region"] = lregion
+        clients.cache[key] = client_class(lconfig)
+    return clients.cache[key]
+
+# ---- Get the name of compartment from its id
+def get_cpt_name_from_id(cpt_id):
+    return compartment_names.get(cpt_id, "root")
+
+# ---- Get the stop and start tag values of a resource found by search
+def get_tag_values(item):
+    try:
+        tags = item.defined_tags[tag_ns]
+    except (KeyError, TypeError):
+        return "none", "none"
+    return tags.get(tag_key_stop, "none"), tags.get(tag_key_start, "none")
+
+# ---------- Plugins: one class per resource type
+# Each plugin gives the resource type used in OCI search queries, converts a search result into
+# one or more targets (id, name, lifecycle state) and knows how to stop and start a target.
+
+class ResourcePlugin(ABC):
+    search_type   = None        # resource type in OCI search query
+    label         = None        # resource type displayed in output
+    running_state = "RUNNING"   # lifecycle state of targets that can be stopped
+    stopped_state = "STOPPED"   # lifecycle state of targets that can be started
+
+    def targets(self, item, lregion):
+        return [ (item.identifier, item.display_name, item.lifecycle_state) ]
+
+    @abstractmethod
+    def stop(self, target_id, lregion):
+        pass
+
+    @abstractmethod
+    def start(self, target_id, lregion):
+        pass
+
+class InstancePlugin(ResourcePlugin):
+    search_type = "instance"
+    label       = "instance"
+
+    def stop(self, target_id, lregion):
+        get_client(oci.core.ComputeClient, lregion).instance_action(target_id, "SOFTSTOP")
+
+    def start(self, target_id, lregion):
+        get_client(oci.core.ComputeClient, lregion).instance_action(target_id, "START")
+
+class AutonomousDbPlugin(ResourcePlugin):
+    search_type   = "autonomousdatabase"
+    label         = "autonomous db"
+    running_state = "AVAILABLE"
+
+    def stop(self, target_id, lregion):
+        get_client(oci.database.DatabaseClient, lregion).stop_autonomous_database(target_id)
+
+    def start(self, target_id, lregion):
+        get_client(oci.database.DatabaseClient, lregion).start_autonomous_database(target_id)
+
+class DbSystemPlugin(ResourcePlugin):
+    search_type   = "dbsystem"
+    label         = "DB node of DB system"
+    running_state = "AVAILABLE"
+
+    # the DB system stays AVAILABLE when its DB nodes are stopped, so the targets are the DB nodes
+    def targets(self, item, lregion):
+        DatabaseClient = get_client(oci.database.DatabaseClient, lregion)
+        response = oci.pagination.list_call_get_all_results(DatabaseClient.list_db_nodes, compartment_id=item.compartment_id, db_system_id=item.identifier)
+        return [ (dbnode.id, item.display_name, dbnode.lifecycle_state) for dbnode in response.data ]
+
+    def stop(self, target_id, lregion):
+        get_client(oci.database.DatabaseClient, lregion).db_node_action(target_id, "STOP")
+
+    def start(self, target_id, lregion):
+        get_client(oci.database.DatabaseClient, lregion).db_node_action(target_id, "START")
+
+class InstancePoolPlugin(ResourcePlugin):
+    search_type = "instancepool"
+    label       = "instance pool"
+
+    def stop(self, target_id, lregion):
+        get_client(oci.core.ComputeManagementClient, lregion).softstop_instance_pool(target_id)
+
+    def start(self, target_id, lregion):
+        get_client(oci.core.ComputeManagementClient, lregion).start_instance_pool(target_id)
+
+PLUGINS = { p.search_type: p for p in [ InstancePlugin(), AutonomousDbPlugin(), DbSystemPlugin(), InstancePoolPlugin() ] }
+
+# ---------- Discovery and dispatch core
+
+# ---- Build a single search query for all resource types having the stop or start tag key
+# ---- (tag values are schedule expressions evaluated locally, see OCI_tag_schedule.py)
+# ---- (see https://docs.cloud.oracle.com/en-us/iaas/Content/Search/Concepts/querysyntax.htm)
+def build_query():
+    if match_value != None:
+        return "query {:s} resources where (definedTags.namespace = '{:s}' && definedTags.key = '{:s}' && definedTags.value = '{:s}')".format(
+            ", ".join(types), tag_ns, tag_key_stop, match_value)
+    tag_cond = "(definedTags.namespace = '{:s}' && definedTags.key = '{:s}')"
+    return "query {:s} resources where ({:s} || {:s})".format(
+        ", ".join(types),
+        tag_cond.format(tag_ns, tag_key_stop),
+        tag_cond.format(tag_ns, tag_key_start))
+
+# ---- Find what to do for one resource found by search, given the evaluated schedules (tag value -> occurrence)
+# ---- returns a list of actions (dictionaries)
+def get_actions(item, due, lregion):
+    plugin = PLUGINS.get(item.resource_type.lower())
+    if plugin == None or plugin.search_type not in types: return []
+    tag_value_stop, tag_value_start = get_tag_values(item)
+    actions = []
+    for target_id, name, state in plugin.targets(item, lregion):
+        if state == plugin.stopped_state and due[tag_value_start] != None:
+            action, tag_key, tag_value = "START", tag_key_start, tag_value_start
+        elif state == plugin.running_state and due[tag_value_stop] != None:
+            action, tag_key, tag_value = "STOP", tag_key_stop, tag_value_stop
+        else:
+            continue
+        if only != None and action != only.upper(): continue
+        scheduled = due[tag_value].strftime("%Y-%m-%dT%H:%MZ")
+        actions.append({ "action": action, "type": plugin.search_type, "target_id": target_id, "name": name,
+                         "resource_id": item.identifier, "region": lregion,
+                         "compartment_id": item.compartment_id, "compartment": get_cpt_name_from_id(item.compartment_id),
+                         "scheduled": scheduled, "state": state,
+                         "reason": "{:s}.{:s} = '{:s}' due at {:s}, state {:s}".format(tag_ns, tag_key, tag_value, scheduled, state) })
+    return actions
+
+# ---- Execute (or only display) a stop or start action
+def dispatch(a):
+    plugin   = PLUGINS[a["type"]]
+    lregion  = a["region"]
+    cpt_name = a["compartment"]
+    key      = journal_key(a)
+    if key in journal:
+        log (lregion, cpt_name, "{:s} {:s} {:s} ({:s}) already dispatched for {:s} --> skipped".format(a["action"], plugin.label, a["name"], a["target_id"], a["scheduled"]))
+        return
+    try:
+        if a["action"] == "STOP":
+            if confirm_stop:
+                log (lregion, cpt_name, "STOPPING {:s} {:s} ({:s})".format(plugin.label, a["name"], a["target_id"]))
+                plugin.stop(a["target_id"], lregion)
+                journal_add(key)
+            else:
+                log (lregion, cpt_name, "{:s} {:s} ({:s}) SHOULD BE STOPPED --> re-run script with --confirm_stop to actually stop resources".format(plugin.label, a["name"], a["target_id"]))
+        else:
+            if confirm_start:
+                log (lregion, cpt_name, "STARTING {:s} {:s} ({:s})".format(plugin.label, a["name"], a["target_id"]))
+                plugin.start(a["target_id"], lregion)
+                journal_add(key)
+            else:
+                log (lregion, cpt_name, "{:s} {:s} ({:s}) SHOULD BE STARTED --> re-run script with --confirm_start to actually start resources".format(plugin.label, a["name"], a["target_id"]))
+    except oci.exceptions.ServiceError as e:
+        log (lregion, cpt_name, "ERROR: {:s} failed for {:s} {:s} ({:s}): {:s}".format(a["action"], plugin.label, a["name"], a["target_id"], e.message))
+
+# ---------- Journal of dispatched actions and lock
+# The journal is an append-only file with one line per dispatched action: scheduled time, action, target OCID
+# and the filter of the run (--types, --only, --match).
+# It is loaded in a set of keys (scheduled time, action, target OCID) at startup, so an action already dispatched
+# for the same scheduled time (overlapping or re-executed runs, full runs and shims of the old scripts) is skipped
+# without any API call.
+
+# ---- Name of the lock and journal files: one per profile (full runs and shims of the old per-service scripts)
+def journal_name():
+    return os.path.join(os.path.expanduser(journal_dir), "stop_start_tagged_{:s}".format(profile))
+
+# ---- Key of an action in the journal
+def journal_key(a):
+    return "{:s} {:s} {:s}".format(a["scheduled"], a["action"], a["target_id"])
+
+# ---- Filter of this run, written after the key in the journal
+def journal_filter():
+    filter = "types=" + ",".join(sorted(types)) if sorted(types) != sorted(PLUGINS.keys()) else "types=all"
+    if only != None:  filter += ",only=" + only
+    if match != None: filter += ",match=" + match
+    return filter
+
+# ---- Take the lock for this profile (only one instance of this script per profile, the others wait up to lock_wait seconds)
+def lock_profile():
+    global lock_file
+
+    lock_filename = journal_name() + ".lock"
+    lock_file = open(lock_filename, "w")
+    for attempt in range(lock_wait + 1):
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except OSError:
+            if attempt == 0: print ("Waiting for lock file {} (another instance of this script is running for this profile)".format(lock_filename))
+            if attempt < lock_wait: time.sleep(1)
+    print ("ERROR 99: lock file {} detected, meaning another instance of this script is already running for this profile.".format(lock_filename))
+    exit (99)
+
+# ---- Load the journal (and remove old entries)
+def journal_load():
+    global journal, journal_file
+
+    journal_filename = journal_name() + ".journal"
+    limit = (now_utc - timedelta(days=journal_days)).strftime("%Y-%m-%dT%H:%MZ")
+    try:
+        with open(journal_filename, "r") as f:
+            lines = [ line.rstrip("\n") for line in f ]
+    except FileNotFoundError:
+        lines = []
+    kept = [ line for line in lines if line[:17] >= limit ]
+    if len(kept) < len(lines):
+        with open(journal_filename, "w") as f:
+            f.writelines(line+"\n" for line in kept)
+    journal = set(" ".join(line.split(" ")[:3]) for line in kept)
+    journal_file = open(journal_filename, "a")
+
+# ---- Add a dispatched action to the journal
+def journal_add(key):
+    with journal_lock:
+        journal.add(key)
+        journal_file.write(key+" "+journal_filter()+"\n")
+        journal_file.flush()
+
+# ---- Search all resources with stop/start tags in a region, evaluate their schedules in bulk
+# ---- and return the list of actions to execute (discovery only, nothing is stopped or started here)
+def process_region(lregion, executor):
+    SearchClient = get_client(oci.resource_search.ResourceSearchClient, lregion)
+    items = oci.pagination.list_call_get_all_results(SearchClient.search_resources,
+                oci.resource_search.models.StructuredSearchDetails(type="Structured", query=query)).data
+
+    # evaluate each distinct tag value once for this tick (with --match, the matched tag value is due now)
+    errors = {}
+    if match_value != None:
+        due = { value: now_utc.replace(second=0, microsecond=0) if value.lower() == match_value.lower() else None
+                for item in items for value in get_tag_values(item) }
+    else:
+        due = OCI_tag_schedule.evaluate([ value for item in items for value in get_tag_values(item) ], now_utc, errors)
+    for item in items:
+        for value in get_tag_values(item):
+            if value in errors:
+                log (lregion, get_cpt_name_from_id(item.compartment_id), "WARNING: invalid schedule '{:s}' for {:s} ({:s}): {:s}".format(value, item.display_name, item.identifier, errors[value]))
+
+    # get the targets (DB nodes for DB systems) only for resources having a stop or start due
+    futures = [ executor.submit(get_actions, item, due, lregion) for item in items if any(due[v] != None for v in get_tag_values(item)) ]
+    return [ action for future in futures for action in future.result() ]
+
+# ---- Discover the actions to execute in all regions concurrently
+def discover(regions):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with ThreadPoolExecutor(max_workers=len(regions)) as region_executor:
+            futures = [ region_executor.submit(process_region, region, executor) for region in regions ]
+            return [ action for future in futures for action in future.result() ]
+
+# ---- Execute (or display) all the actions concurrently
+def dispatch_all(actions):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [ executor.submit(dispatch, a) for a in actions ]:
+            future.result()
+
+# ---- Write the action plan (JSON file)
+def write_plan(filename, actions):
+    plan = { "created": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"), "time": now_utc.strftime("%Y-%m-%dT%H:%MZ"),
+             "profile": profile, "regions": regions, "actions": actions }
+    try:
+        with open(filename, "w") as f:
+            json.dump(plan, f, indent=2)
+    except OSError as e:
+        print ("ERROR 03: cannot write plan file {} : {}".format(filename, e.strerror))
+        exit (3)
+    for a in actions:
+        log (a["region"], a["compartment"], "PLAN: {:s} {:s} {:s} ({:s}): {:s}".format(a["action"], PLUGINS[a["type"]].label, a["name"], a["target_id"], a["reason"]))
+    print ("{:d} action(s) written to plan file {:s} --> execute them with --apply {:s}".format(len(actions), filename, filename))
+
+# ---- Read an action plan written by --plan
+def read_plan(filename):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print ("ERROR 04: cannot read plan file {} : {}".format(filename, e))
+        exit (4)
+
+# ------------ main
+
+# -- parse arguments
+all_regions   = False
+confirm_stop  = False
+confirm_start = False
+plan_file     = None
+apply_file    = None
+at_time       = None
+types         = list(PLUGINS.keys())
+only          = None
+match         = None
+match_value   = None
+
+args = sys.argv[1:]
+if len(args) < 1: usage()
+profile = args.pop()
+while len(args) > 0:
+    arg = args.pop(0)
+    if   arg == "-a":              all_regions   = True
+    elif arg == "--confirm_stop":  confirm_stop  = True
+    elif arg == "--confirm_start": confirm_start = True
+    elif arg == "--plan"  and len(args) > 0: plan_file  = args.pop(0)
+    elif arg == "--apply" and len(args) > 0: apply_file = args.pop(0)
+    elif arg == "--time"  and len(args) > 0: at_time    = args.pop(0)
+    elif arg == "--types" and len(args) > 0: types      = args.pop(0).lower().split(",")
+    elif arg == "--only"  and len(args) > 0: only       = args.pop(0).lower()
+    elif arg == "--match" and len(args) > 0: match      = args.pop(0)
+    else: usage()
+if apply_file != None and (plan_file != None or at_time != None or all_regions): usage()
+if any(t not in PLUGINS for t in types) or only not in (None, "stop", "start"): usage()
+if match != None:
+    if only == None or "=" not in match or "." not in match.split("=")[0]: usage()
+    tag_ns, tag_key_stop = match.split("=", 1)[0].split(".", 1)
+    tag_key_start = tag_key_stop
+    match_value   = match.split("=", 1)[1]
+
+# -- get UTC time (compared to the schedules given by tag values)
+if at_time != None:
+    try:
+        now_utc = datetime.strptime(at_time, "%Y-%m-%dT%H:%M").replace(tzinfo=timezone.utc)
+    except ValueError:
+        usage()
+else:
+    now_utc = datetime.now(timezone.utc)
+
+# -- starting
+pid=os.getpid()
+print ("{:s}: BEGIN SCRIPT PID={:d}".format(datetime.utcnow().strftime("%Y/%m/%d %T"),pid))
+
+# -- load profile from config file
+try:
+    config = oci.config.from_file(configfile,profile)
+except:
+    print ("ERROR 02: profile '{}' not found in config file {} !".format(profile,configfile))
+    exit (2)
+
+# -- Only one instance of this script per profile, then load the journal of dispatched actions
+lock_profile()
+journal_load()
+
+# -- Apply a plan computed before: no discovery, the stop/start actions are executed concurrently
+if apply_file != None:
+    plan = read_plan(apply_file)
+    print ("Applying plan {:s} created {:s} for time {:s} ({:d} action(s))".format(apply_file, plan["created"], plan["time"], len(plan["actions"])))
+    confirm_stop  = True
+    confirm_start = True
+    dispatch_all(plan["actions"])
+    print ("{:s}: END SCRIPT PID={:d}".format(datetime.utcnow().strftime("%Y/%m/%d %T"),pid))
+    exit (0)
+
+IdentityClient = oci.identity.IdentityClient(config)
+user = IdentityClient.get_user(config["user"]).data
+RootCompartmentID = user.compartment_id
+
+# -- get list of subscribed regions
+if all_regions:
+    response = oci.pagination.list_call_get_all_results(IdentityClient.list_region_subscriptions, RootCompartmentID)
+    regions = [ region.region_name for region in response.data ]
+else:
+    regions = [ config["region"] ]
+
+# -- get compartments list (once for all regions and all resource types)
+response = oci.pagination.list_call_get_all_results(IdentityClient.list_compartments, RootCompartmentID,compartment_id_in_subtree=True)
+compartment_names = { c.id: c.name for c in response.data }
+
+# -- Search all resource types in all regions concurrently
+query = build_query()
+actions = discover(regions)
+
+# -- Write the action plan, or execute (or display) the actions
+if plan_file != None:
+    write_plan(plan_file, actions)
+else:
+    dispatch_all(actions)
+
+# -- the end
+print ("{:s}: END SCRIPT PID={:d}".format(datetime.utcnow().strftime("%Y/%m/%d %T"),pid))
+exit (0)
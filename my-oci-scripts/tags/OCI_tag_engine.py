@@ -0,0 +1,421 @@
+# ---------------------------------------------------------------------------------------------------------------------------------
+# Shared code for the tag tools (OCI_object_show_tags.py, OCI_object_add_tag.py, OCI_object_remove_tag.py)
+#
+# - REGISTRY maps the resource type found in an OCID (2nd field, ex: ocid1.instance.oc1...) to the OCI client class,
+#   the get and update methods and the update details model for this resource type.
+#   Adding support for a resource type is one entry in this table.
+# - OCI clients are created once per thread and per region, then reused (get_client).
+# - The region of a resource is given by its OCID (ex: ocid1.instance.oc1.eu-frankfurt-1.xxx or ocid1.instance.oc1.iad.xxx)
+#   so each OCID is routed to a client for the right region, whatever the region in the OCI profile.
+# - search_iter/search run paginated OCI search queries in a region.
+# - Object storage APIs need the namespace and the name of a bucket, not its OCID: bucket OCIDs are resolved with an
+#   index OCID -> (namespace, compartment, name) built once per region from a search query (or, for buckets not yet
+#   indexed by search, from list_buckets in all compartments concurrently), and saved in bucket_index_file so next
+#   executions do not need the warm-up. An entry made stale by a bucket rename is refreshed on the first 404.
+# - Tag namespaces, tag keys and allowed values (enum validators) are cached (namespaces listed once, keys of a namespace
+#   listed and validator of a key read on first use) so tag writes are validated locally before any call on the resources
+#   (validate_tag). If the tag namespaces cannot be listed (no permission), the validation is skipped.
+# - get_defined_tags, add_tag and remove_tag work for any resource type in REGISTRY and raise TagError on failure.
+# - Tag updates are optimistic read-modify-write: the update carries the ETag of the get (if-match) and the
+#   read-modify-write is retried when the resource was modified in between (HTTP 412). conflicts counts the retries.
+#
+# Note: this file is not a script, it is imported by the tag tools (it must be in the same directory)
+#
+# Author        : Christophe Pauliat
+# Platforms     : MacOS / Linux
+#
+# prerequisites : - Python 3 with OCI Python SDK installed
+# Versions
+#    2020-05-12: Initial Version
+#    2020-05-13: route each OCID to the region found in the OCID
+#    2020-05-14: use ETags (if-match) for tag updates and retry on conflict
+#    2020-05-16: add buckets (bucket OCID resolved with a cached index)
+#    2020-05-18: validate tag namespace, key and value with cached tag definitions before writes
+# ---------------------------------------------------------------------------------------------------------------------------------
+
+# -- import
+import oci
+import os
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------- variables
+config  = None                  # OCI config (set by init)
+clients = threading.local()     # OCI clients cached per thread and per region
+search_page_size = 1000         # Number of resources per page of search results
+search_batch   = 50             # Max number of OCIDs in a search query used to find resources from their OCIDs
+max_conflict_retries = 5        # Max number of read-modify-write retries after a conflict (HTTP 412)
+conflicts      = 0              # Number of conflicts (HTTP 412) retried since start
+conflicts_lock = threading.Lock()
+max_workers    = 16             # Max number of concurrent API calls when listing buckets in all compartments
+bucket_index_file = "~/.oci/bucket_index.json"  # Bucket index saved between executions
+bucket_index   = None           # Bucket OCID -> BucketRef (loaded from bucket_index_file on first use)
+bucket_regions = {}             # Region -> "search" or "list": how the bucket index was already filled for this region
+bucket_lock    = threading.RLock()
+namespaces     = {}             # Region -> object storage namespace
+tag_namespaces = None           # Tag namespace name (lowercase) -> TagNamespaceSummary, or {} if they cannot be listed
+tag_keys       = {}             # Tag namespace name (lowercase) -> { tag key name (lowercase) -> TagSummary }
+tag_validators = {}             # (namespace, key) (lowercase) -> list of allowed values, or None if any value is allowed
+tag_lock       = threading.RLock()
+max_tag_value_length = 256
+
+# ---------- Classes
+
+# ---- error raised by the tag functions. code is the exit code used by the tag tools
+class TagError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code    = code
+        self.message = message
+
+# ---- one resource type: how to get and update a resource of this type
+class ResourceType:
+    def __init__(self, label, client_class, get_method, update_method, details_class):
+        self.label         = label
+        self.client_class  = client_class
+        self.get_method    = get_method
+        self.update_method = update_method
+        self.details_class = details_class
+
+    def get(self, client, obj_id):
+        return getattr(client, self.get_method)(obj_id)
+
+    def update(self, client, obj_id, defined_tags, etag=None):
+        kwargs = { "if_match": etag } if etag != None else {}
+        return getattr(client, self.update_method)(obj_id, self.details_class(defined_tags=defined_tags), **kwargs)
+
+# ---- buckets: the object storage APIs use the namespace and the name of the bucket (found with the bucket index)
+class BucketType(ResourceType):
+    def get(self, client, obj_id):
+        ref = resolve_bucket(obj_id)
+        try:
+            return client.get_bucket(ref.namespace, ref.name)
+        except oci.exceptions.ServiceError as e:
+            if e.status != 404: raise
+        ref = resolve_bucket(obj_id, refresh=True)      # bucket renamed since the index was built
+        return client.get_bucket(ref.namespace, ref.name)
+
+    def update(self, client, obj_id, defined_tags, etag=None):
+        ref = resolve_bucket(obj_id)
+        kwargs = { "if_match": etag } if etag != None else {}
+        return client.update_bucket(ref.namespace, ref.name, self.details_class(defined_tags=defined_tags), **kwargs)
+
+# ---- location of a bucket in the bucket index
+class BucketRef:
+    def __init__(self, namespace, compartment_id, name):
+        self.namespace      = namespace
+        self.compartment_id = compartment_id
+        self.name           = name
+
+# ---------- Registry: OCID resource type -> ResourceType
+REGISTRY = {
+    # compute
+    "instance":             ResourceType("compute instance",       oci.core.ComputeClient,         "get_instance",               "update_instance",               oci.core.models.UpdateInstanceDetails),
+    "image":                ResourceType("custom image",           oci.core.ComputeClient,         "get_image",                  "update_image",                  oci.core.models.UpdateImageDetails),
+    "bootvolume":           ResourceType("boot volume",            oci.core.BlockstorageClient,    "get_boot_volume",            "update_boot_volume",            oci.core.models.UpdateBootVolumeDetails),
+    # block storage
+    "volume":               ResourceType("block volume",           oci.core.BlockstorageClient,    "get_volume",                 "update_volume",                 oci.core.models.UpdateVolumeDetails),
+    "volumebackup":         ResourceType("block volume backup",    oci.core.BlockstorageClient,    "get_volume_backup",          "update_volume_backup",          oci.core.models.UpdateVolumeBackupDetails),
+    # object storage
+    "bucket":               BucketType("bucket",                   oci.object_storage.ObjectStorageClient, "get_bucket",   "update_bucket",                 oci.object_storage.models.UpdateBucketDetails),
+    # database
+    "dbsystem":             ResourceType("db system",              oci.database.DatabaseClient,    "get_db_system",              "update_db_system",              oci.database.models.UpdateDbSystemDetails),
+    "autonomousdatabase":   ResourceType("autonomous database",    oci.database.DatabaseClient,    "get_autonomous_database",    "update_autonomous_database",    oci.database.models.UpdateAutonomousDatabaseDetails),
+    # networking
+    "vcn":                  ResourceType("VCN",                    oci.core.VirtualNetworkClient,  "get_vcn",                    "update_vcn",                    oci.core.models.UpdateVcnDetails),
+    "subnet":               ResourceType("subnet",                 oci.core.VirtualNetworkClient,  "get_subnet",                 "update_subnet",                 oci.core.models.UpdateSubnetDetails),
+    "routetable":           ResourceType("route table",            oci.core.VirtualNetworkClient,  "get_route_table",            "update_route_table",            oci.core.models.UpdateRouteTableDetails),
+    "internetgateway":      ResourceType("internet gateway",       oci.core.VirtualNetworkClient,  "get_internet_gateway",       "update_internet_gateway",       oci.core.models.UpdateInternetGatewayDetails),
+    "drg":                  ResourceType("dynamic routing gateway",oci.core.VirtualNetworkClient,  "get_drg",                    "update_drg",                    oci.core.models.UpdateDrgDetails),
+    "networksecuritygroup": ResourceType("network security group", oci.core.VirtualNetworkClient,  "get_network_security_group", "update_network_security_group", oci.core.models.UpdateNetworkSecurityGroupDetails),
+    "securitylist":         ResourceType("security list",          oci.core.VirtualNetworkClient,  "get_security_list",          "update_security_list",          oci.core.models.UpdateSecurityListDetails),
+    "dhcpoptions":          ResourceType("DHCP options",           oci.core.VirtualNetworkClient,  "get_dhcp_options",           "update_dhcp_options",           oci.core.models.UpdateDhcpDetails),
+    "localpeeringgateway":  ResourceType("local peering gateway",  oci.core.VirtualNetworkClient,  "get_local_peering_gateway",  "update_local_peering_gateway",  oci.core.models.UpdateLocalPeeringGatewayDetails),
+    "natgateway":           ResourceType("NAT gateway",            oci.core.VirtualNetworkClient,  "get_nat_gateway",            "update_nat_gateway",            oci.core.models.UpdateNatGatewayDetails),
+    "servicegateway":       ResourceType("service gateway",        oci.core.VirtualNetworkClient,  "get_service_gateway",        "update_service_gateway",        oci.core.models.UpdateServiceGatewayDetails),
+}
+
+# ---------- Functions
+
+# ---- set the OCI config used to create the clients
+def init(lconfig):
+    global config
+    config = lconfig
+
+# ---- get an OCI client for a region (created once per thread and per region)
+def get_client(client_class, region=None):
+    if region == None: region = config["region"]
+    if not hasattr(clients, "cache"):
+        clients.cache = {}
+    key = (client_class, region)
+    if key not in clients.cache:
+        lconfig = dict(config)
+        lconfig["region"] = region
+        clients.cache[key] = client_class(lconfig)
+    return clients.cache[key]
+
+# ---- run a search query in a region and yield the resources found, page after page
+# ---- (search results include the defined and freeform tags of the resources)
+def search_iter(query, region=None):
+    SearchClient = get_client(oci.resource_search.ResourceSearchClient, region)
+    details = oci.resource_search.models.StructuredSearchDetails(type="Structured", query=query)
+    return oci.pagination.list_call_get_all_results_generator(SearchClient.search_resources, "record", details, limit=search_page_size)
+
+# ---- run a search query in a region and return the list of resources found
+def search(query, region=None):
+    return list(search_iter(query, region))
+
+# ---- get the object storage namespace (one call per region)
+def get_namespace(region=None):
+    if region == None: region = config["region"]
+    with bucket_lock:
+        if region not in namespaces:
+            namespaces[region] = get_client(oci.object_storage.ObjectStorageClient, region).get_namespace().data
+        return namespaces[region]
+
+# ---- load the bucket index saved by a previous execution (for the tenancy of the profile)
+def load_bucket_index():
+    global bucket_index
+    if bucket_index != None: return
+    bucket_index = {}
+    try:
+        with open(os.path.expanduser(bucket_index_file), "r") as f:
+            saved = json.load(f).get(config["tenancy"], {})
+        bucket_index = { ocid: BucketRef(*ref) for ocid, ref in saved.items() }
+    except (OSError, ValueError, TypeError):
+        pass
+
+# ---- save the bucket index (errors ignored: the index is only a cache)
+def save_bucket_index():
+    filename = os.path.expanduser(bucket_index_file)
+    try:
+        with open(filename, "r") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = {}
+    saved[config["tenancy"]] = { ocid: [ ref.namespace, ref.compartment_id, ref.name ] for ocid, ref in bucket_index.items() }
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename+".tmp", "w") as f:
+            json.dump(saved, f)
+        os.replace(filename+".tmp", filename)
+    except OSError:
+        pass
+
+# ---- add buckets found by a search query to the bucket index (search results give OCID, compartment and name)
+def index_buckets(items, region=None):
+    with bucket_lock:
+        load_bucket_index()
+        for item in items:
+            if item.resource_type == "Bucket":
+                bucket_index[item.identifier] = BucketRef(get_namespace(region or get_region(item.identifier)), item.compartment_id, item.display_name)
+
+# ---- get the buckets of a compartment in a region with their OCIDs (list_buckets does not give the OCID: one get per new bucket)
+def list_compartment_buckets(region, namespace, compartment_id, known):
+    ObjectStorageClient = get_client(oci.object_storage.ObjectStorageClient, region)
+    buckets = oci.pagination.list_call_get_all_results(ObjectStorageClient.list_buckets, namespace, compartment_id).data
+    return [ ObjectStorageClient.get_bucket(namespace, b.name).data for b in buckets if (compartment_id, b.name) not in known ]
+
+# ---- add all the buckets of all compartments in a region to the bucket index (compartments listed concurrently)
+def index_buckets_in_all_compartments(region):
+    IdentityClient = get_client(oci.identity.IdentityClient)
+    response = oci.pagination.list_call_get_all_results(IdentityClient.list_compartments, config["tenancy"], compartment_id_in_subtree=True)
+    cpt_ids = [ config["tenancy"] ] + [ c.id for c in response.data if c.lifecycle_state == "ACTIVE" ]
+    namespace = get_namespace(region)
+    known = set((ref.compartment_id, ref.name) for ref in bucket_index.values() if ref.namespace == namespace)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for buckets in executor.map(lambda cpt_id: list_compartment_buckets(region, namespace, cpt_id, known), cpt_ids):
+            for bucket in buckets:
+                bucket_index[bucket.id] = BucketRef(namespace, bucket.compartment_id, bucket.name)
+
+# ---- get the namespace, compartment and name of a bucket from its OCID, raise TagError if not found
+# ---- the index is filled for the region of the bucket on the first miss (search query, then list_buckets if still missing)
+def resolve_bucket(obj_id, refresh=False):
+    region = get_region(obj_id)
+    with bucket_lock:
+        load_bucket_index()
+        if refresh:
+            bucket_index.pop(obj_id, None)
+            bucket_regions.pop(region, None)
+        if obj_id not in bucket_index and region not in bucket_regions:
+            index_buckets(search_iter("query bucket resources", region), region)
+            bucket_regions[region] = "search"
+            save_bucket_index()
+        if obj_id not in bucket_index and bucket_regions[region] != "list":
+            index_buckets_in_all_compartments(region)
+            bucket_regions[region] = "list"
+            save_bucket_index()
+        ref = bucket_index.get(obj_id)
+    if ref == None:
+        raise TagError(3, "bucket with OCID '{:s}' not found".format(obj_id))
+    return ref
+
+# ---- find resources (type, compartment, tags...) from their OCIDs with search queries in the region of each OCID
+# ---- (search_batch OCIDs per query, all regions and batches concurrently). Returns a dictionary OCID -> resource
+def search_ocids(ocids, executor):
+    futures = []
+    for region, region_ocids in partition_by_region(ocids).items():
+        for i in range(0, len(region_ocids), search_batch):
+            query = "query all resources where ({:s})".format(" || ".join("identifier = '{:s}'".format(o) for o in region_ocids[i:i+search_batch]))
+            futures.append(executor.submit(search, query, region))
+    return { item.identifier: item for future in futures for item in future.result() }
+
+# ---- get the resource type from an OCID (ex: ocid1.instance.oc1.eu-frankfurt-1.xxxx -> instance)
+def get_obj_type(obj_id):
+    try:
+        return obj_id.split(".")[1].lower()
+    except IndexError:
+        return ""
+
+# ---- get the region of a resource from its OCID (4th field: region name, region short name or empty)
+# ---- the region of the OCI profile is used if there is no region in the OCID
+def get_region(obj_id):
+    fields = obj_id.split(".")
+    region = fields[3].lower() if len(fields) >= 5 else ""
+    if region == "": return config["region"]
+    return oci.regions.REGIONS_SHORT_NAMES.get(region, region)
+
+# ---- partition a list of OCIDs by region: returns a dictionary region -> list of OCIDs
+def partition_by_region(obj_ids):
+    partitions = {}
+    for obj_id in obj_ids:
+        partitions.setdefault(get_region(obj_id), []).append(obj_id)
+    return partitions
+
+# ---- get the ResourceType of an OCID, or None if not supported
+def lookup(obj_id):
+    return REGISTRY.get(get_obj_type(obj_id))
+
+# ---- get the ResourceType of an OCID, raise TagError if not supported
+def get_resource_type(obj_id):
+    rtype = lookup(obj_id)
+    if rtype == None:
+        raise TagError(4, "resource type {:s} is not yet supported".format(get_obj_type(obj_id)))
+    return rtype
+
+# ---- get a resource (full response, to get the ETag in headers)
+def get_resource_response(obj_id):
+    rtype  = get_resource_type(obj_id)
+    client = get_client(rtype.client_class, get_region(obj_id))
+    try:
+        return rtype.get(client, obj_id)
+    except oci.exceptions.ServiceError:
+        raise TagError(3, "{:s} with OCID '{:s}' not found".format(rtype.label, obj_id))
+
+# ---- get a resource
+def get_resource(obj_id):
+    return get_resource_response(obj_id).data
+
+# ---- get the defined tags of a resource
+def get_defined_tags(obj_id):
+    return get_resource(obj_id).defined_tags
+
+# ---- get the tag namespaces of the tenancy (listed once)
+def get_tag_namespaces():
+    global tag_namespaces
+    with tag_lock:
+        if tag_namespaces == None:
+            IdentityClient = get_client(oci.identity.IdentityClient)
+            try:
+                response = oci.pagination.list_call_get_all_results(IdentityClient.list_tag_namespaces, config["tenancy"], include_subcompartments=True)
+                tag_namespaces = { ns.name.lower(): ns for ns in response.data }
+            except oci.exceptions.ServiceError:
+                tag_namespaces = {}
+        return tag_namespaces
+
+# ---- get the tag keys of a tag namespace (listed on first use), None if they cannot be listed
+def get_tag_keys(tag_ns):
+    with tag_lock:
+        if tag_ns.lower() not in tag_keys:
+            IdentityClient = get_client(oci.identity.IdentityClient)
+            try:
+                response = oci.pagination.list_call_get_all_results(IdentityClient.list_tags, get_tag_namespaces()[tag_ns.lower()].id)
+                tag_keys[tag_ns.lower()] = { tag.name.lower(): tag for tag in response.data }
+            except oci.exceptions.ServiceError:
+                tag_keys[tag_ns.lower()] = None
+        return tag_keys[tag_ns.lower()]
+
+# ---- get the allowed values of a tag key (validator read on first use)
+# ---- None if any value is allowed or if the tag key cannot be read
+def get_allowed_values(tag_ns, tag_key):
+    key = (tag_ns.lower(), tag_key.lower())
+    with tag_lock:
+        if key not in tag_validators:
+            IdentityClient = get_client(oci.identity.IdentityClient)
+            try:
+                validator = IdentityClient.get_tag(get_tag_namespaces()[key[0]].id, get_tag_keys(tag_ns)[key[1]].name).data.validator
+                tag_validators[key] = validator.values if validator != None and validator.validator_type == "ENUM" else None
+            except oci.exceptions.ServiceError:
+                tag_validators[key] = None
+        return tag_validators[key]
+
+# ---- check that a tag namespace and key exist and are not retired, and that the value is allowed (if provided)
+# ---- raise TagError(8) if not. Nothing is checked if the tag namespaces cannot be listed, and nothing more
+# ---- than the tag namespace if its tag keys cannot be listed (the update itself fails if the tag is invalid)
+def validate_tag(tag_ns, tag_key, tag_value=None):
+    if len(get_tag_namespaces()) == 0: return
+    ns = get_tag_namespaces().get(tag_ns.lower())
+    if ns == None:
+        raise TagError(8, "tag namespace {:s} does not exist".format(tag_ns))
+    keys = get_tag_keys(tag_ns)
+    if keys == None: return
+    key = keys.get(tag_key.lower())
+    if key == None:
+        raise TagError(8, "tag key {:s}.{:s} does not exist".format(tag_ns, tag_key))
+    if tag_value == None: return
+    if ns.is_retired:
+        raise TagError(8, "tag namespace {:s} is retired".format(tag_ns))
+    if key.is_retired:
+        raise TagError(8, "tag key {:s}.{:s} is retired".format(tag_ns, tag_key))
+    if len(tag_value) > max_tag_value_length:
+        raise TagError(8, "tag value is longer than {:d} characters".format(max_tag_value_length))
+    allowed = get_allowed_values(tag_ns, tag_key)
+    if allowed != None and tag_value not in allowed:
+        raise TagError(8, "value '{:s}' is not allowed for tag key {:s}.{:s} (allowed values: {:s})".format(tag_value, tag_ns, tag_key, ", ".join(allowed)))
+
+# ---- count a conflict (thread safe)
+def count_conflict():
+    global conflicts
+    with conflicts_lock:
+        conflicts += 1
+
+# ---- read-modify-write of the defined tags of a resource
+# ---- modify(tags) changes the defined tags dictionary in place (it may raise TagError)
+# ---- the update is done with the ETag of the get and retried if the resource changed in between (HTTP 412)
+def update_defined_tags(obj_id, modify, error_code, error_message):
+    rtype  = get_resource_type(obj_id)
+    client = get_client(rtype.client_class, get_region(obj_id))
+    for attempt in range(max_conflict_retries + 1):
+        response = get_resource_response(obj_id)
+        tags = response.data.defined_tags
+        modify(tags)
+        try:
+            rtype.update(client, obj_id, tags, response.headers.get("etag"))
+            return
+        except oci.exceptions.ServiceError as e:
+            if e.status == 412 and attempt < max_conflict_retries:
+                count_conflict()
+                time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+                continue
+            raise TagError(error_code, "{:s}: {:s}".format(error_message, e.message))
+
+# ---- add a defined tag key and value to a resource
+def add_tag(obj_id, tag_ns, tag_key, tag_value):
+    validate_tag(tag_ns, tag_key, tag_value)
+    def modify(tags):
+        tags.setdefault(tag_ns, {})[tag_key] = tag_value
+    update_defined_tags(obj_id, modify, 5, "cannot add this tag key with this tag value")
+
+# ---- remove a defined tag key from a resource
+def remove_tag(obj_id, tag_ns, tag_key):
+    rtype = get_resource_type(obj_id)
+    validate_tag(tag_ns, tag_key)
+    def modify(tags):
+        try:
+            del tags[tag_ns][tag_key]
+        except KeyError:
+            raise TagError(5, "this tag key does not exist for this {:s}".format(rtype.label))
+    update_defined_tags(obj_id, modify, 6, "cannot remove this tag from this {:s}".format(rtype.label))
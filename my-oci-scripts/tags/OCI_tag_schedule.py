@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# Schedule expressions for the stop/start tag values (automatic_shutdown / automatic_startup tag keys)
+#
+# This module is imported by OCI_resources_stop_start_tagged.py. It can also be executed to check tag values:
+#     OCI_tag_schedule.py "mon-fri 07:30 Europe/Paris" "sat,sun 10:00_UTC +2h"
+#
+# Tag value syntax (tokens in any order, several entries separated by ';'):
+#     [days] times [zone] [+window]
+#     days   : mon,tue,...,sun, ranges (mon-fri) or * (default: every day)
+#     times  : HH:MM or HH:MM-HH:MM (every hour from first to last time), separated by ','
+#     zone   : UTC (default), UTC+HH:MM, UTC-HH:MM or IANA time zone (Europe/Paris). Can be appended to time with _
+#     window : catch-up window (+90m, +2h, default +1h): a run started late still fires the actions missed in the window
+# Examples:
+#     08:00_UTC                              (historical syntax: every day at 08:00 UTC)
+#     mon-fri 07:30 Europe/Paris
+#     mon,wed,fri 06:00-09:00 UTC+02:00 +30m
+#     mon-fri 19:00 Europe/Paris; sat 12:00 Europe/Paris
+# The values "off", "none" and empty values never fire.
+#
+# Tag values are parsed once into Schedule objects (cached by tag value) and a tick evaluates each distinct
+# tag value only once, whatever the number of resources sharing it.
+#
+# Author        : Christophe Pauliat
+# Platforms     : MacOS / Linux
+#
+# prerequisites : - Python 3 (Python 3.9 or later for IANA time zones)
+# Versions
+#    2020-05-06: Initial Version
+# ---------------------------------------------------------------------------------------------------------------------------------
+
+# -- import
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
+
+# ---------- variables
+DAYS           = [ "mon", "tue", "wed", "thu", "fri", "sat", "sun" ]
+DEFAULT_WINDOW = timedelta(hours=1)
+NEVER_VALUES   = ( "", "off", "none" )
+
+re_time   = re.compile(r"^(\d{1,2}):(\d{2})$")
+re_offset = re.compile(r"^(?:UTC|GMT)([+-])(\d{1,2}):?(\d{2})?$")
+re_window = re.compile(r"^\+(\d+)([mh])$")
+
+# ---------- Classes
+
+# ---- One entry of a schedule: days of week, minutes in the day, time zone and catch-up window
+class ScheduleEntry:
+    def __init__(self, days, minutes, tz, window):
+        self.days    = days         # set of weekdays (0 = monday)
+        self.minutes = minutes      # sorted list of minutes in the day (0..1439)
+        self.tz      = tz
+        self.window  = window
+
+    # most recent occurrence (UTC datetime) in ]now - window, now], or None
+    def last_occurrence(self, now_utc):
+        local_now   = now_utc.astimezone(self.tz)
+        local_start = (now_utc - self.window).astimezone(self.tz)
+        day = local_now.date()
+        while day >= local_start.date():
+            if day.weekday() in self.days:
+                for minute in reversed(self.minutes):
+                    t = datetime(day.year, day.month, day.day, minute // 60, minute % 60, tzinfo=self.tz).astimezone(timezone.utc)
+                    if t <= now_utc:
+                        return t if t > now_utc - self.window else None
+            day -= timedelta(days=1)
+        return None
+
+# ---- A compiled tag value (list of entries)
+class Schedule:
+    def __init__(self, text, entries):
+        self.text    = text
+        self.entries = entries
+
+    # most recent occurrence (UTC datetime) of any entry in its catch-up window, or None
+    def last_occurrence(self, now_utc):
+        occurrences = [ t for t in (e.last_occurrence(now_utc) for e in self.entries) if t != None ]
+        return max(occurrences) if occurrences else None
+
+    def __repr__(self):
+        return "Schedule({!r})".format(self.text)
+
+# ---------- Functions
+
+# ---- parse the days token (mon-fri, sat,sun, *)
+def parse_days(token):
+    days = set()
+    for part in token.lower().split(","):
+        if part == "*":
+            days.update(range(7))
+        elif "-" in part:
+            first, last = part.split("-", 1)
+            if first not in DAYS or last not in DAYS: raise ValueError("invalid days '{}'".format(part))
+            i = DAYS.index(first)
+            while True:
+                days.add(i)
+                if i == DAYS.index(last): break
+                i = (i + 1) % 7
+        elif part in DAYS:
+            days.add(DAYS.index(part))
+        else:
+            raise ValueError("invalid day '{}'".format(part))
+    return days
+
+# ---- parse one time HH:MM into minutes in the day
+def parse_time(text):
+    m = re_time.match(text)
+    if not m or int(m.group(1)) > 23 or int(m.group(2)) > 59: raise ValueError("invalid time '{}'".format(text))
+    return int(m.group(1)) * 60 + int(m.group(2))
+
+# ---- parse the times token (08:00, 08:00,18:30, 08:00-12:00)
+def parse_times(token):
+    minutes = set()
+    for part in token.split(","):
+        if "-" in part:
+            first, last = [ parse_time(t) for t in part.split("-", 1) ]
+            if last < first: raise ValueError("invalid time range '{}'".format(part))
+            minutes.update(range(first, last + 1, 60))
+        else:
+            minutes.add(parse_time(part))
+    return sorted(minutes)
+
+# ---- parse the time zone token
+def parse_zone(token):
+    if token.upper() in ("UTC", "GMT", "Z"): return timezone.utc
+    m = re_offset.match(token.upper())
+    if m:
+        offset = timedelta(hours=int(m.group(2)), minutes=int(m.group(3) or 0))
+        return timezone(offset if m.group(1) == "+" else -offset)
+    if ZoneInfo == None: raise ValueError("time zone '{}' needs Python 3.9 or later (use UTC+HH:MM)".format(token))
+    try:
+        return ZoneInfo(token)
+    except Exception:
+        raise ValueError("unknown time zone '{}'".format(token))
+
+# ---- parse one schedule entry
+def parse_entry(text):
+    days, minutes, tz, window = set(range(7)), None, timezone.utc, DEFAULT_WINDOW
+    for token in text.split():
+        if token[0].isdigit() and "_" in token:            # historical syntax 08:00_UTC
+            token, zone = token.split("_", 1)
+            tz = parse_zone(zone)
+        if token[0] == "+":
+            m = re_window.match(token)
+            if not m: raise ValueError("invalid catch-up window '{}'".format(token))
+            window = timedelta(minutes=int(m.group(1))) if m.group(2) == "m" else timedelta(hours=int(m.group(1)))
+        elif token[0].isdigit():
+            minutes = parse_times(token)
+        elif token == "*" or token.lower()[:3] in DAYS:
+            days = parse_days(token)
+        else:
+            tz = parse_zone(token)
+    if minutes == None: raise ValueError("no time in '{}'".format(text))
+    return ScheduleEntry(days, minutes, tz, window)
+
+# ---- compile a tag value into a Schedule (cached by tag value). Raises ValueError if the tag value is invalid
+@lru_cache(maxsize=None)
+def compile_schedule(text):
+    text = text.strip()
+    if text.lower() in NEVER_VALUES: return Schedule(text, [])
+    return Schedule(text, [ parse_entry(e) for e in text.split(";") if e.strip() != "" ])
+
+# ---- evaluate many tag values for one tick
+# ---- returns a dict tag value -> occurrence (UTC datetime) to act on, or None.
+# ---- invalid tag values are returned as None and added to the errors dict (tag value -> error message) if provided
+def evaluate(tag_values, now_utc, errors=None):
+    results = {}
+    for value in set(tag_values):
+        try:
+            results[value] = compile_schedule(value).last_occurrence(now_utc)
+        except ValueError as e:
+            results[value] = None
+            if errors != None: errors[value] = str(e)
+    return results
+
+# ------------ main
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print ("Usage: {} tag_value [tag_value ...]".format(sys.argv[0]))
+        exit (1)
+
+    now = datetime.now(timezone.utc)
+    errors = {}
+    results = evaluate(sys.argv[1:], now, errors)
+    for value in sys.argv[1:]:
+        if value in errors:
+            print ("{:s}: ERROR: {:s}".format(value, errors[value]))
+        elif results[value] != None:
+            print ("{:s}: due now (occurrence {:s})".format(value, results[value].strftime("%Y/%m/%d %H:%M UTC")))
+        else:
+            print ("{:s}: not due".format(value))
+    exit (0)
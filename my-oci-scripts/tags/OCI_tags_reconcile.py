@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# This script reconciles the defined tags of OCI resources with a desired state file
+#
+# The current tags of all the resources in the file are read with search queries (batches of OCIDs, all regions
+#     concurrently), the differences are computed in memory and only the resources whose tags differ are updated
+#     (concurrent get/update calls with ETags). A run with no difference costs only the search queries.
+#
+# Desired state file (CSV or YAML, by file extension):
+# - CSV : one line per resource, column "ocid" and one column per tag key "namespace.key" (same format as
+#         OCI_object_show_tags.py --export csv, other columns are ignored). An empty cell means the tag key
+#         must not be present.
+#         ocid,osc.automatic_shutdown,osc.automatic_startup
+#         ocid1.instance.oc1.eu-frankfurt-1.xxx,mon-fri 19:00 Europe/Paris,
+# - YAML: OCID -> namespace -> key -> value (null or ~ means the tag key must not be present)
+#         ocid1.instance.oc1.eu-frankfurt-1.xxx:
+#           osc:
+#             automatic_shutdown: mon-fri 19:00 Europe/Paris
+#             automatic_startup: ~
+# Tag keys not in the file are not modified. Only defined tags are reconciled.
+# Tag namespaces, keys and values are validated (cached tag definitions) before any update.
+#
+# Note: the current tags are read from the search index, which can be a few seconds late after a tag change:
+#       each update is done on the tags read by the get call, so it is always applied to the latest tags.
+#
+# Note: OCI tenant given by an OCI CLI PROFILE, region given by the OCID of each resource
+# Author        : Christophe Pauliat
+# Platforms     : MacOS / Linux
+#
+# prerequisites : - Python 3 with OCI Python SDK installed
+#                 - OCI config file configured with profiles
+#                 - OCI_tag_engine.py in the same directory
+#                 - PyYAML for YAML files
+# Versions
+#    2020-05-19: Initial Version
+#    2020-05-31: YAML values read as written (no conversion of 19:00, on/off, 08:00 by YAML 1.1)
+# ---------------------------------------------------------------------------------------------------------------------------------
+
+# -- import
+import oci
+import sys
+import csv
+import time
+import OCI_tag_engine
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# ---------- Functions
+
+# ---- variables
+configfile  = "~/.oci/config"   # Define config file to be used.
+max_workers = 16                # Max number of concurrent API calls
+
+# ---- usage syntax
+def usage():
+    print ("Usage: {} OCI_PROFILE DESIRED_STATE_FILE [--dry-run]".format(sys.argv[0]))
+    print ("")
+    print ("    DESIRED_STATE_FILE: CSV file (.csv) or YAML file (.yaml or .yml) with the desired defined tags of the resources")
+    print ("    --dry-run         : only display the differences, no update")
+    print ("")
+    print ("note: OCI_PROFILE must exist in {} file (see example below)".format(configfile))
+    print ("")
+    print ("[EMEAOSCf]")
+    print ("tenancy     = ocid1.tenancy.oc1..aaaaaaaaw7e6nkszrry6d5hxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx")
+    print ("user        = ocid1.user.oc1..aaaaaaaayblfepjieoxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx")
+    print ("fingerprint = 19:1d:7b:3a:17:xx:xx:xx:xx:xx:xx:xx:xx:xx:xx:xx")
+    print ("key_file    = /Users/cpauliat/.oci/api_key.pem")
+    print ("region      = eu-frankfurt-1")
+    exit (1)
+
+# ---- read the desired state from a CSV file: dictionary OCID -> { namespace -> { key -> value or None } }
+def read_csv(f):
+    desired = {}
+    reader = csv.DictReader(f)
+    if reader.fieldnames == None or "ocid" not in reader.fieldnames:
+        raise ValueError("column 'ocid' not found")
+    tag_columns = [ c for c in reader.fieldnames if "." in c and not c.startswith("freeform:") ]
+    for row in reader:
+        if (row["ocid"] or "").strip() == "": continue
+        tags = desired.setdefault(row["ocid"].strip(), {})
+        for column in tag_columns:
+            ns, key = column.split(".", 1)
+            tags.setdefault(ns, {})[key] = row[column] if row[column] not in (None, "") else None
+    return desired
+
+# ---- read the desired state from a YAML file: dictionary OCID -> { namespace -> { key -> value or None } }
+def read_yaml(f):
+    if yaml == None:
+        raise ValueError("PyYAML is needed for YAML files (pip3 install pyyaml)")
+    # plain scalars are kept as written (YAML 1.1 reads 19:00 as 1140 and off as False), except null and ~
+    class TagValuesLoader(yaml.SafeLoader):
+        pass
+    TagValuesLoader.yaml_implicit_resolvers = { c: [ (tag, regexp) for tag, regexp in resolvers if tag == "tag:yaml.org,2002:null" ]
+                                                for c, resolvers in yaml.SafeLoader.yaml_implicit_resolvers.items() }
+    try:
+        data = yaml.load(f, Loader=TagValuesLoader) or {}
+    except yaml.YAMLError as e:
+        raise ValueError(str(e))
+    if not isinstance(data, dict) or not all(isinstance(t, dict) and all(isinstance(k, dict) for k in t.values()) for t in data.values()):
+        raise ValueError("expected OCID -> namespace -> key -> value")
+    for ocid, tags in data.items():
+        for ns, keys in tags.items():
+            for key, value in keys.items():
+                if value != None and not isinstance(value, str):
+                    raise ValueError("value of {}.{} for {} is not a string".format(ns, key, ocid))
+    return data
+
+# ---- read the desired state file
+def read_desired_state(filename):
+    try:
+        with open(filename, "r", newline="") as f:
+            if filename.lower().endswith((".yaml", ".yml")):
+                return read_yaml(f)
+            return read_csv(f)
+    except OSError as e:
+        print ("ERROR 03: cannot read file {:s}: {:s} !".format(filename, str(e)))
+        exit (3)
+    except ValueError as e:
+        print ("ERROR 04: invalid desired state file {:s}: {:s} !".format(filename, str(e)))
+        exit (4)
+
+# ---- check all the tag namespaces, keys and values of the desired state before any update
+def validate(desired):
+    checked = set()
+    for tags in desired.values():
+        for ns, keys in tags.items():
+            for key, value in keys.items():
+                if (ns, key, value) not in checked:
+                    OCI_tag_engine.validate_tag(ns, key, value)
+                    checked.add((ns, key, value))
+
+# ---- changes needed for a resource: list of (namespace, key, value) (value None: remove the tag key)
+def diff(current_tags, desired_tags):
+    current_tags = current_tags or {}
+    changes = []
+    for ns, keys in desired_tags.items():
+        for key, value in keys.items():
+            current = current_tags.get(ns, {}).get(key)
+            if current != value:
+                changes.append((ns, key, value))
+    return changes
+
+# ---- display the changes of a resource
+def format_changes(changes):
+    return " ".join("-{:s}.{:s}".format(ns, key) if value == None else "+{:s}.{:s}={:s}".format(ns, key, value) for ns, key, value in changes)
+
+# ---- apply the desired tags of a resource (get/update with ETag: the diff is computed again on the latest tags)
+# ---- returns None if OK, or the error message
+def apply(obj_id, desired_tags):
+    def modify(tags):
+        for ns, key, value in diff(tags, desired_tags):
+            if value == None:
+                del tags[ns][key]
+            else:
+                tags.setdefault(ns, {})[key] = value
+    try:
+        OCI_tag_engine.update_defined_tags(obj_id, modify, 5, "cannot update the tags")
+    except OCI_tag_engine.TagError as e:
+        return e.message
+    return None
+
+# ------------ main
+
+# -- parse arguments
+dry_run = False
+if len(sys.argv) == 4 and sys.argv[3] == "--dry-run":
+    dry_run = True
+elif len(sys.argv) != 3:
+    usage()
+profile  = sys.argv[1]
+filename = sys.argv[2]
+
+# -- load profile from config file
+try:
+    config = oci.config.from_file(configfile,profile)
+
+except:
+    print ("ERROR 02: profile '{}' not found in config file {} !".format(profile,configfile))
+    exit (2)
+
+OCI_tag_engine.init(config)
+
+# -- read and check the desired state
+desired = read_desired_state(filename)
+try:
+    validate(desired)
+except OCI_tag_engine.TagError as e:
+    print ("ERROR {:02d}: {:s} !".format(e.code, e.message))
+    exit (e.code)
+
+# -- read the current tags with search queries and compute the differences
+start = time.time()
+failures = {}
+with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    items = OCI_tag_engine.search_ocids(list(desired), executor)
+    OCI_tag_engine.index_buckets(items.values())
+    changes = {}
+    for ocid, desired_tags in desired.items():
+        if ocid not in items:
+            failures[ocid] = "resource not found"
+        elif OCI_tag_engine.lookup(ocid) == None:
+            failures[ocid] = "resource type {:s} is not yet supported".format(OCI_tag_engine.get_obj_type(ocid))
+        else:
+            resource_changes = diff(items[ocid].defined_tags, desired_tags)
+            if len(resource_changes) > 0:
+                changes[ocid] = resource_changes
+                print ("{:s}: {:s}".format(ocid, format_changes(resource_changes)))
+
+    # -- update the resources with differences
+    if not dry_run:
+        futures = { ocid: executor.submit(apply, ocid, desired[ocid]) for ocid in changes }
+        for ocid, future in futures.items():
+            error = future.result()
+            if error != None:
+                failures[ocid] = error
+
+# -- summary
+elapsed = time.time() - start
+for ocid, error in failures.items():
+    print ("FAILED: {:s}: {:s}".format(ocid, error))
+print ("{:d} resources in desired state, {:d} with differences{:s}, {:d} failures in {:.1f} seconds".format(
+    len(desired), len(changes), " (dry run: not updated)" if dry_run else " updated", len(failures), elapsed))
+
+# -- the end
+exit (0 if len(failures) == 0 else 5)
@@ -20,12 +20,16 @@
 #                 - OCI config file configured with profiles
 # Versions
 #    2020-04-23: Initial Version
+#    2020-05-05: rewrite of the script using OCI search (much faster), get DB nodes of matching DB systems
+#                only (concurrently) and support DB systems with several DB nodes (RAC)
 # ---------------------------------------------------------------------------------------------------------------------------------
 
 # -- import
 import oci
 import sys
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # ---------- Tag names, key and value to look for
@@ -36,7 +40,9 @@ tag_key_stop  = "automatic_shutdown"
 tag_key_start = "automatic_startup"
 
 # ---------- variables
-configfile = "~/.oci/config"    # Define config file to be used.
+configfile  = "~/.oci/config"    # Define config file to be used.
+max_workers = 8                  # Max number of concurrent list_db_nodes calls
+thread_data = threading.local()
 
 # ---------- Functions
 
@@ -59,62 +65,70 @@ def usage():
     print ("region      = eu-frankfurt-1")
     exit (1)
 
-# ---- Check VM database systems in a compartment
-def process_compartment(lcpt):
+# ---- Get the name of compartment from its id
+def get_cpt_name_from_id(cpt_id):
+    global compartments
+    for c in compartments:
+        if (c.id == cpt_id):
+            return c.name
+    return "root"
+
+# ---- Get all the DB nodes of a DB system (several DB nodes for RAC DB systems)
+# ---- called from worker threads, so each thread uses its own database client
+def get_db_nodes(dbs):
     global config
-    global current_utc_time
-    global DatabaseClient
-
-    # exit function if compartent is deleted
-    if lcpt.lifecycle_state == "DELETED": return
-
-    # region 
-    region = config["region"]
-
-    # find VM database systems in this compartment
-    response = oci.pagination.list_call_get_all_results(DatabaseClient.list_db_systems,compartment_id=lcpt.id)
- 
-    # for each instance, check if it needs to be stopped or started 
-    if len(response.data) > 0:
-        for dbs in response.data:
-            if dbs.lifecycle_state != "TERMINED":
-                # get the tags
-                try:
-                    tag_value_stop  = dbs.defined_tags[tag_ns][tag_key_stop]
-                    tag_value_start = dbs.defined_tags[tag_ns][tag_key_start]
-                except:
-                    tag_value_stop  = "none"
-                    tag_value_start = "none"
-                
-                # get the DB node 
-                response = DatabaseClient.list_db_nodes(compartment_id=lcpt.id, db_system_id=dbs.id)
-                dbnode = response.data[0]
-
-                # Is it time to start this autonomous db ?
-                if dbnode.lifecycle_state == "STOPPED" and tag_value_start == current_utc_time:
-                    print ("{:s}, {:s}, {:s}: ".format(datetime.utcnow().strftime("%T"), region, lcpt.name),end='')
-                    if confirm_start:
-                        print ("STARTING DB node for {:s} ({:s})".format(dbs.display_name, dbs.id))
-                        DatabaseClient.db_node_action(dbnode.id, "START")
-                    else:
-                        print ("DB node for DB system {:s} ({:s}) SHOULD BE STARTED --> re-run script with --confirm_start to actually start databases".format(dbs.display_name, dbs.id))
-
-                # Is it time to stop this autonomous db ?
-                elif dbnode.lifecycle_state == "AVAILABLE" and tag_value_stop == current_utc_time:
-                    print ("{:s}, {:s}, {:s}: ".format(datetime.utcnow().strftime("%T"), region, lcpt.name),end='')
-                    if confirm_stop:
-                        print ("STOPPING DB node for {:s} ({:s})".format(dbs.display_name, dbs.id))
-                        DatabaseClient.db_node_action(dbnode.id, "STOP")
-                    else:
-                        print ("DB node for DB system {:s} ({:s}) SHOULD BE STOPPED --> re-run script with --confirm_start to actually stop databases".format(dbs.display_name, dbs.id))
-
-  
-# ------------ main
-global config
-global ads
-global IdentityClient
-global RootCompartmentID
 
+    if getattr(thread_data, "region", None) != config["region"]:
+        thread_data.region = config["region"]
+        thread_data.DatabaseClient = oci.database.DatabaseClient(config)
+    DatabaseClient = thread_data.DatabaseClient
+    response = oci.pagination.list_call_get_all_results(DatabaseClient.list_db_nodes, compartment_id=dbs.compartment_id, db_system_id=dbs.identifier)
+    return response.data
+
+# ---- Search VM database systems to be stopped or started in a region, then display or stop/start their DB nodes
+# ---- depending on --confirm_stop and --confirm_start presence
+def search_and_process_resources_in_region(lquery, lregion):
+    global config
+
+    config["region"] = lregion
+    DatabaseClient = oci.database.DatabaseClient(config)
+    SearchClient = oci.resource_search.ResourceSearchClient(config)
+    items = oci.pagination.list_call_get_all_results(SearchClient.search_resources, oci.resource_search.models.StructuredSearchDetails(type="Structured", query=lquery)).data
+    if len(items) == 0: return
+
+    # get the DB nodes of the matching DB systems only, concurrently
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        db_nodes_list = list(executor.map(get_db_nodes, items))
+
+    for dbs, dbnodes in zip(items, db_nodes_list):
+        cpt_name = get_cpt_name_from_id(dbs.compartment_id)
+        try:
+            tag_value_stop  = dbs.defined_tags[tag_ns].get(tag_key_stop, "none")
+            tag_value_start = dbs.defined_tags[tag_ns].get(tag_key_start, "none")
+        except:
+            tag_value_stop  = "none"
+            tag_value_start = "none"
+
+        for dbnode in dbnodes:
+            # Is it time to start this DB node ?
+            if dbnode.lifecycle_state == "STOPPED" and tag_value_start == current_utc_time:
+                print ("{:s}, {:s}, {:s}: ".format(datetime.utcnow().strftime("%T"), lregion, cpt_name),end='')
+                if confirm_start:
+                    print ("STARTING DB node {:s} for {:s} ({:s})".format(dbnode.id, dbs.display_name, dbs.identifier))
+                    DatabaseClient.db_node_action(dbnode.id, "START")
+                else:
+                    print ("DB node {:s} for DB system {:s} ({:s}) SHOULD BE STARTED --> re-run script with --confirm_start to actually start databases".format(dbnode.id, dbs.display_name, dbs.identifier))
+
+            # Is it time to stop this DB node ?
+            elif dbnode.lifecycle_state == "AVAILABLE" and tag_value_stop == current_utc_time:
+                print ("{:s}, {:s}, {:s}: ".format(datetime.utcnow().strftime("%T"), lregion, cpt_name),end='')
+                if confirm_stop:
+                    print ("STOPPING DB node {:s} for {:s} ({:s})".format(dbnode.id, dbs.display_name, dbs.identifier))
+                    DatabaseClient.db_node_action(dbnode.id, "STOP")
+                else:
+                    print ("DB node {:s} for DB system {:s} ({:s}) SHOULD BE STOPPED --> re-run script with --confirm_stop to actually stop databases".format(dbnode.id, dbs.display_name, dbs.identifier))
+
+# ------------ main
 # -- parse arguments
 all_regions   = False
 confirm_stop  = False
@@ -175,25 +189,29 @@ IdentityClient = oci.identity.IdentityClient(config)
 user = IdentityClient.get_user(config["user"]).data
 RootCompartmentID = user.compartment_id
 
-# -- get list of compartments
-response = oci.pagination.list_call_get_all_results(IdentityClient.list_compartments, RootCompartmentID,compartment_id_in_subtree=True)
-compartments = response.data
-
 # -- get list of subscribed regions
 response = oci.pagination.list_call_get_all_results(IdentityClient.list_region_subscriptions, RootCompartmentID)
 regions = response.data
+config_region = config['region']
 
-# -- do the job
-if not(all_regions):
-    DatabaseClient = oci.database.DatabaseClient(config)
-    for cpt in compartments:
-        process_compartment(cpt)
-else:
+# -- get compartments list
+response = oci.pagination.list_call_get_all_results(IdentityClient.list_compartments, RootCompartmentID,compartment_id_in_subtree=True)
+compartments = response.data
+
+# -- Search VM database systems to be stopped or started with a single search query
+# -- (the lifecycle state of the DB system does not change when DB nodes are stopped, so it is checked on DB nodes)
+# -- (see https://docs.cloud.oracle.com/en-us/iaas/Content/Search/Concepts/querysyntax.htm)
+tag_cond = "(definedTags.namespace = '{:s}' && definedTags.key = '{:s}' && definedTags.value = '{:s}')"
+query = "query dbsystem resources where (lifeCycleState != 'TERMINATED' && ({:s} || {:s}))".format(
+    tag_cond.format(tag_ns, tag_key_stop,  current_utc_time),
+    tag_cond.format(tag_ns, tag_key_start, current_utc_time))
+
+# For each region, get the list of VM database systems to be stopped or started, then process their DB nodes
+if all_regions:
     for region in regions:
-        config["region"]=region.region_name
-        DatabaseClient = oci.database.DatabaseClient(config)
-        for cpt in compartments:
-            process_compartment(cpt)
+        search_and_process_resources_in_region(query, region.region_name)
+else:
+    search_and_process_resources_in_region(query, config_region)
 
 # -- the end
 print ("{:s}: END SCRIPT PID={:d}".format(datetime.utcnow().strftime("%Y/%m/%d %T"),pid))
@@ -9,93 +9,27 @@
 #
 # prerequisites : - Python 3 with OCI Python SDK installed
 #                 - OCI config file configured with profiles
+#                 - ../OCI_object_remove_tag.py and ../OCI_tag_engine.py
 # Versions
 #    2020-04-22: Initial Version
 #    2020-04-25: display error message using sys.exc_info in case of error
+#    2020-05-20: now a shim calling ../OCI_object_remove_tag.py (shared tag engine, pooled clients, --file/--search bulk modes)
 # ----------------------------------------------------------------------------------------
 
 # -- import
-import oci
+import os
 import sys
+import runpy
 
-# ---------- Functions
-
-# ---- variables
-configfile = "~/.oci/config"    # Define config file to be used.
-
-# ---- usage syntax
-def usage():
-    print ("Usage: {} OCI_PROFILE autonomous_db_ocid tag_namespace tag_key".format(sys.argv[0]))
-    print ("")
-    print ("")
-    print ("note: OCI_PROFILE must exist in {} file (see example below)".format(configfile))
-    print ("")
-    print ("[EMEAOSCf]")
-    print ("tenancy     = ocid1.tenancy.oc1..aaaaaaaaw7e6nkszrry6d5hxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx")
-    print ("user        = ocid1.user.oc1..aaaaaaaayblfepjieoxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx")
-    print ("fingerprint = 19:1d:7b:3a:17:xx:xx:xx:xx:xx:xx:xx:xx:xx:xx:xx")
-    print ("key_file    = /Users/cpauliat/.oci/api_key.pem")
-    print ("region      = eu-frankfurt-1")
-    exit (1)
+# ---------- variables
+script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "OCI_object_remove_tag.py")
 
 # ------------ main
-global config
-
-# -- parse arguments
-if len(sys.argv) == 5:
-    profile  = sys.argv[1]
-    adb_id   = sys.argv[2] 
-    tag_ns   = sys.argv[3]
-    tag_key  = sys.argv[4]
-else:
-    usage()
-
-# -- load profile from config file
-try:
-    config = oci.config.from_file(configfile,profile)
-
-except:
-    print ("ERROR 02: profile '{}' not found in config file {} !".format(profile,configfile))
-    exit (2)
-
-IdentityClient = oci.identity.IdentityClient(config)
-user = IdentityClient.get_user(config["user"]).data
-RootCompartmentID = user.compartment_id
-
-# -- Get Defined-tags for the autonomous DB
-DatabaseClient = oci.database.DatabaseClient(config)
 
-try:
-    response = DatabaseClient.get_autonomous_database(adb_id)
-    adb = response.data
-except:
-    print ("ERROR 03: Autonomous DB with OCID '{}' not found !".format(adb_id))
+# -- Same arguments as the generic script: only autonomous database OCIDs are accepted (bulk modes are passed as is)
+if len(sys.argv) > 2 and not sys.argv[2].startswith("--") and sys.argv[2].split(".")[1:2] != [ "autonomousdatabase" ]:
+    print ("ERROR 03: autonomous database with OCID '{}' not found !".format(sys.argv[2]))
     exit (3)
 
-# -- If the ADB status is TERMINATED or TERMINATING, stop here
-if adb.lifecycle_state == "TERMINATED" or adb.lifecycle_state == "TERMINATING":
-    print ("ERROR 04: Autonomous DB status is TERMINATED or TERMINATING, so cannot update tags !")
-    exit (4)
-
-# -- Remove tag key from tag namespace
-tags = adb.defined_tags
-try:
-    del tags[tag_ns][tag_key]
-except:
-    print ("ERROR 05: this tag key does not exist for this autonomous database !")
-    exit (5)
-
-# -- Update autonomous DB
-try:
-    DatabaseClient.update_autonomous_database(adb_id, oci.database.models.UpdateAutonomousDatabaseDetails(defined_tags=tags))
-except:
-    print ("ERROR 06: cannot remove this tag from this autonomous DB !")
-    print (sys.exc_info()[1].message)
-    exit (6)
-
-# -- the end
-exit (0)
-
-
-
-#ATTENTION
\ No newline at end of file
+sys.path.insert(0, os.path.dirname(script))
+runpy.run_path(script, run_name="__main__")
@@ -5,18 +5,20 @@
 # You can use it to automatically stop some autonomous database during non working hours
 #     and start them again at the beginning of working hours 
 # This script can be executed by an external scheduler (cron table on Linux for example)
-# This script looks in all compartments in a OCI tenant in a region using OCI CLI
+# This script looks in all compartments in a OCI tenant in a region using OCI Python SDK
 # Note: OCI tenant and region given by an OCI CLI PROFILE
 #
 # Author        : Christophe Pauliat
 # Platforms     : MacOS / Linux
-# prerequisites : OCI CLI installed, OCI config file configured with profiles and jq JSON parser
+# prerequisites : Python 3 with OCI Python SDK installed, OCI config file configured with profiles
 #
 # Versions
 #    2019-10-11: Initial Version
 #    2019-10-14: Add quiet mode option
 #    2020-03-20: change location of temporary files to /tmp + check oci exists
 #    2020-03-23: use TAG_NS and TAG_KEY in process_compartment function instead of hardcoded values
+#    2020-05-20: now a shim calling ../OCI_resources_stop_start_tagged.py with the same arguments (OCI Python SDK,
+#                one search per region instead of OCI CLI calls per compartment and per resource)
 # --------------------------------------------------------------------------------------------------------------
 
 # ---------- Tag names, key and value to look for
@@ -48,88 +50,13 @@ EOF
   exit 1
 }
 
-process_compartment()
-{
-  local lcompid=$1
-  local lcompname=$2
-  local lregion=$3
-
-  CHANGED_FLAG=${TMP_FILE}_changed 
-  rm -f $CHANGED_FLAG
-
-  oci --profile $PROFILE db autonomous-database list -c $lcompid --region $lregion --output table --query "data [*].{ADB_name:\"display-name\", ADB_id:id, Status:\"lifecycle-state\"}" > $TMP_FILE
-  if [ $QUIET_MODE == false ]; then cat $TMP_FILE; fi
-
-  # if no ADB found in this compartment (TMP_FILE empty), exit the function
-  if [ ! -s $TMP_FILE ]; then rm -f $TMP_FILE; return; fi 
-
-  cat $TMP_FILE | sed '1,3d;$d' | awk -F' ' '{ print $2 }' | while read adb_id
-  do
-    adb_status=`oci --profile $PROFILE db autonomous-database get --region $lregion --autonomous-database-id $adb_id | jq -r '.[]."lifecycle-state"' 2>/dev/null`
-    if ( [ "$adb_status" == "STOPPED" ] && [ "$ACTION" == "start" ] ) || ( [ "$adb_status" == "AVAILABLE" ] && [ "$ACTION" == "stop" ] )
-    then 
-      adb_name=`oci --profile $PROFILE db autonomous-database get --region $lregion --autonomous-database-id $adb_id | jq -r '.[]."display-name"' 2>/dev/null`
-      #ltag_value=`oci --profile $PROFILE db autonomous-database get --region $lregion --autonomous-database-id $adb_id | jq -r '.[]."defined-tags"."osc"."stop_non_working_hours"' 2>/dev/null`
-      ltag_value=`oci --profile $PROFILE db autonomous-database get --region $lregion --autonomous-database-id $adb_id | jq -r '.[]."defined-tags".'\"$TAG_NS\"'.'\"$TAG_KEY\"'' 2>/dev/null`
-      if [ "$ltag_value" == "$TAG_VALUE" ]
-      then 
-        if [ $QUIET_MODE == true ]; then printf "region $lregion, cpt $lcompname: "; else printf " --> "; fi             
-        if [ $CONFIRM == true ]
-        then
-          case $ACTION in
-            "start") echo "STARTING Autonomous DB $adb_name ($adb_id)"
-                     oci --profile $PROFILE db autonomous-database start --region $lregion --autonomous-database-id $adb_id >/dev/null 2>&1
-                     ;;
-            "stop")  echo "STOPPING Autonomous DB $adb_name ($adb_id)"
-                     oci --profile $PROFILE db autonomous-database stop --region $lregion --autonomous-database-id $adb_id >/dev/null 2>&1
-                     ;;
-          esac
-          touch $CHANGED_FLAG
-        else
-          case $ACTION in
-            "start")  echo "Autonomous DB $adb_name ($adb_id) SHOULD BE STARTED --> re-run script with --confirm to actually start Autonomous DBs"  ;;
-            "stop")   echo "Autonomous DB $adb_name ($adb_id) SHOULD BE STOPPED --> re-run script with --confirm to actually stop Autonomous DBs"  ;;
-          esac
-        fi
-      fi
-    fi
-  done
-
-  if [ -f $CHANGED_FLAG ]
-  then
-    rm -f $CHANGED_FLAG
-    if [ $QUIET_MODE == false ]; then 
-      oci --profile $PROFILE db autonomous-database list -c $lcompid --region $lregion --output table --query "data [*].{ADB_name:\"display-name\", ADB_id:id, Status:\"lifecycle-state\"}" 
-    fi
-  fi
-  
-  rm -f $TMP_FILE
-}
-
-# -- Get the current region from the profile
-get_region_from_profile()
-{
-  egrep "^\[|^region" ${OCI_CONFIG_FILE} | fgrep -A 1 "[${PROFILE}]" |grep "^region" > $TMP_FILE 2>&1
-  if [ $? -ne 0 ]; then echo "ERROR: region not found in OCI config file $OCI_CONFIG_FILE for profile $PROFILE !"; cleanup; exit 5; fi
-  awk -F'=' '{ print $2 }' $TMP_FILE | sed 's# ##g'
-}
-
-# -- Get the list of all active regions
-get_all_active_regions()
-{
-  oci --profile $PROFILE iam region-subscription list --query "data [].{Region:\"region-name\"}" |jq -r '.[].Region'
-}
+SCRIPT="$(dirname "$0")/../OCI_resources_stop_start_tagged.py"
 
-# -------- main
+ALL_REGIONS=""
+CONFIRM=""
 
-OCI_CONFIG_FILE=~/.oci/config
-
-ALL_REGIONS=false
-CONFIRM=false
-QUIET_MODE=false
-
-if [ "$1" == "-q" ]; then QUIET_MODE=true; shift; fi
-if [ "$1" == "-a" ]; then ALL_REGIONS=true; shift; fi
+if [ "$1" == "-q" ]; then shift; fi        # quiet mode: the output of the new script is already minimal
+if [ "$1" == "-a" ]; then ALL_REGIONS="-a"; shift; fi
 
 case $# in 
   2) PROFILE=$1
@@ -138,72 +65,13 @@ case $# in
   3) PROFILE=$1
      ACTION=$2
      if [ "$3" != "--confirm" ]; then usage; fi
-     CONFIRM=true
+     CONFIRM="--confirm_$ACTION"
      ;;
   *) usage 
      ;;
 esac
 
-if [ "$PROFILE" == "-h" ] || [ "PROFILE" == "--help" ]; then usage; fi
+if [ "$PROFILE" == "-h" ] || [ "$PROFILE" == "--help" ]; then usage; fi
 if [ "$ACTION" != "start" ] && [ "$ACTION" != "stop" ]; then usage; fi
 
-TMP_FILE=/tmp/tmp_$$
-
-echo "BEGIN SCRIPT: `date` : $ACTION"
-
-# -- Check if oci is installed
-which oci > /dev/null 2>&1
-if [ $? -ne 0 ]; then echo "ERROR: oci not found !"; exit 2; fi
-
-# -- Check if jq is installed
-which jq > /dev/null 2>&1
-if [ $? -ne 0 ]; then echo "ERROR: jq not found !"; exit 2; fi
-
-# -- Check if the PROFILE exists
-grep "\[$PROFILE\]" $OCI_CONFIG_FILE > /dev/null 2>&1
-if [ $? -ne 0 ]; then echo "ERROR: PROFILE $PROFILE does not exist in file $OCI_CONFIG_FILE !"; exit 3; fi
-
-# -- get tenancy OCID from OCI PROFILE
-TENANCYOCID=`egrep "^\[|ocid1.tenancy" $OCI_CONFIG_FILE|sed -n -e "/\[$PROFILE\]/,/tenancy/p"|tail -1| awk -F'=' '{ print $2 }' | sed 's/ //g'`
-
-# -- set the list of regions
-if [ $ALL_REGIONS == false ]
-then
-  REGIONS_LIST=`get_region_from_profile`
-else
-  REGIONS_LIST=`get_all_active_regions`
-fi
- 
-# -- process required regions list
-for region in $REGIONS_LIST
-do
-  if [ $QUIET_MODE == false ]
-  then
-    echo -e "==================== REGION ${region}"
-  fi
-
-  # -- list Autonomous DBs in the root compartment
-  if [ $QUIET_MODE == false ]
-  then
-    echo
-    echo "Compartment root, OCID=$TENANCYOCID"
-  fi
-  process_compartment $TENANCYOCID root $region
-
-  # -- list Autonomous DBs compartment by compartment (excluding root compartment but including all subcompartments). Only ACTIVE compartments
-  oci --profile $PROFILE iam compartment list -c $TENANCYOCID --compartment-id-in-subtree true --all --query "data [?\"lifecycle-state\" == 'ACTIVE']" 2>/dev/null| egrep "^ *\"name|^ *\"id"|awk -F'"' '{ print $4 }' | while read compid
-  do
-    read compname
-    if [ $QUIET_MODE == false ]
-    then
-      echo
-      echo "Compartment $compname, OCID=$compid"
-    fi
-    process_compartment $compid $compname $region
-  done
-done
-
-echo "END SCRIPT: `date` : $ACTION"
-
-rm -f $TMP_FILE
-exit 0
\ No newline at end of file
+exec python3 "$SCRIPT" $ALL_REGIONS --types autonomousdatabase --only $ACTION --match "$TAG_NS.$TAG_KEY=$TAG_VALUE" $CONFIRM "$PROFILE"
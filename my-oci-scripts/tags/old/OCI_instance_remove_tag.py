@@ -9,89 +9,27 @@
 #
 # prerequisites : - Python 3 with OCI Python SDK installed
 #                 - OCI config file configured with profiles
+#                 - ../OCI_object_remove_tag.py and ../OCI_tag_engine.py
 # Versions
 #    2020-04-16: Initial Version
 #    2020-04-25: display error message using sys.exc_info in case of error
+#    2020-05-20: now a shim calling ../OCI_object_remove_tag.py (shared tag engine, pooled clients, --file/--search bulk modes)
 # ----------------------------------------------------------------------------------------
 
 # -- import
-import oci
+import os
 import sys
+import runpy
 
-# ---------- Functions
-
-# ---- variables
-configfile = "~/.oci/config"    # Define config file to be used.
-
-# ---- usage syntax
-def usage():
-    print ("Usage: {} OCI_PROFILE instance_ocid tag_namespace tag_key".format(sys.argv[0]))
-    print ("")
-    print ("")
-    print ("note: OCI_PROFILE must exist in {} file (see example below)".format(configfile))
-    print ("")
-    print ("[EMEAOSCf]")
-    print ("tenancy     = ocid1.tenancy.oc1..aaaaaaaaw7e6nkszrry6d5hxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx")
-    print ("user        = ocid1.user.oc1..aaaaaaaayblfepjieoxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx")
-    print ("fingerprint = 19:1d:7b:3a:17:xx:xx:xx:xx:xx:xx:xx:xx:xx:xx:xx")
-    print ("key_file    = /Users/cpauliat/.oci/api_key.pem")
-    print ("region      = eu-frankfurt-1")
-    exit (1)
+# ---------- variables
+script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "OCI_object_remove_tag.py")
 
 # ------------ main
-global config
-
-# -- parse arguments
-if len(sys.argv) == 5:
-    profile  = sys.argv[1]
-    inst_id  = sys.argv[2] 
-    tag_ns   = sys.argv[3]
-    tag_key  = sys.argv[4]
-else:
-    usage()
-
-# -- load profile from config file
-try:
-    config = oci.config.from_file(configfile,profile)
-
-except:
-    print ("ERROR 02: profile '{}' not found in config file {} !".format(profile,configfile))
-    exit (2)
 
-IdentityClient = oci.identity.IdentityClient(config)
-user = IdentityClient.get_user(config["user"]).data
-RootCompartmentID = user.compartment_id
-
-# -- Get Defined-tags for the compute instance
-ComputeClient = oci.core.ComputeClient(config)
-
-try:
-    response = ComputeClient.get_instance(inst_id)
-    instance = response.data
-except:
-    print ("ERROR 03: instance with OCID '{}' not found !".format(inst_id))
+# -- Same arguments as the generic script: only instance OCIDs are accepted (bulk modes are passed as is)
+if len(sys.argv) > 2 and not sys.argv[2].startswith("--") and sys.argv[2].split(".")[1:2] != [ "instance" ]:
+    print ("ERROR 03: instance with OCID '{}' not found !".format(sys.argv[2]))
     exit (3)
 
-# -- If the instance is TERMINATED, stop here
-if instance.lifecycle_state == "TERMINATED":
-    print ("ERROR 04: instance status is TERMINATED, so cannot update tags !")
-    exit (4)
-
-# -- Remove tag key from tag namespace
-tags = instance.defined_tags
-try:
-    del tags[tag_ns][tag_key]
-except:
-    print ("ERROR 05: this tag key does not exist for this compute instance !")
-    exit (5)
-
-# -- Update compute instance
-try:
-    ComputeClient.update_instance(inst_id, oci.core.models.UpdateInstanceDetails(defined_tags=tags))
-except:
-    print ("ERROR 06: cannot remove this tag from this compute instance !")
-    print (sys.exc_info()[1].message)
-    exit (6)
-
-# -- the end
-exit (0)
+sys.path.insert(0, os.path.dirname(script))
+runpy.run_path(script, run_name="__main__")
@@ -10,12 +10,12 @@
 # You can add the 2 tag keys to the default tags for root compartment so that every new compute 
 #     instance get those 2 tag keys with default value ("off" or a specific UTC time)
 #
-# This script looks in all compartments in a OCI tenant in a region using OCI CLI
+# This script looks in all compartments in a OCI tenant in a region using OCI Python SDK
 # Note: OCI tenant and region given by an OCI CLI PROFILE
 #
 # Author        : Christophe Pauliat
 # Platforms     : MacOS / Linux
-# prerequisites : OCI CLI installed, OCI config file configured with profiles and jq JSON parser
+# prerequisites : Python 3 with OCI Python SDK installed, OCI config file configured with profiles
 #
 # Versions
 #    2019-10-10: Initial Version
@@ -27,14 +27,15 @@
 #                This script now needs to be run every hour using crontab or another scheduler
 #    2020-04-22: use single instance of script for both stop and start actions to minimize number of API calls
 #                and optimize/simplify script
+#    2020-05-20: now a shim calling ../OCI_resources_stop_start_tagged.py with the same arguments (OCI Python SDK,
+#                one search per region instead of OCI CLI calls per compartment and per resource)
 # --------------------------------------------------------------------------------------------------------------
 
 # ---------- Tag names, key and value to look for
-# Instances tagged using this will be stopped/started.
-# Update these to match your tags.
-TAG_NS="osc"
-TAG_KEY_STOP="automatic_shutdown"
-TAG_KEY_START="automatic_startup"
+# The tag names used are defined at the beginning of ../OCI_resources_stop_start_tagged.py
+# TAG_NS="osc"
+# TAG_KEY_STOP="automatic_shutdown"
+# TAG_KEY_START="automatic_startup"
 
 # ---------- Functions
 usage()
@@ -58,148 +59,11 @@ EOF
   exit 1
 }
 
-process_compartment()
-{
-  local lcompid=$1
-  local lcompname=$2
-  local lregion=$3
- 
-  # find compute instances in this compartment
-  oci --profile $PROFILE compute instance list -c $lcompid --region $lregion | jq -r '.data[].id' > $TMP_FILE
-  
-  # if no instance found in this compartment (TMP_FILE empty), exit the function
-  if [ ! -s $TMP_FILE ]; then rm -f $TMP_FILE; return; fi 
-
-  # otherwise, we look at each compute instance
-  for inst_id in `cat $TMP_FILE`
-  do
-    echo "   DEBUG: inst=$inst_id"
-    oci --profile $PROFILE compute instance get --region $lregion --instance-id $inst_id > ${TMP_FILE}_INST 2>/dev/null
-    inst_status=`cat ${TMP_FILE}_INST| jq -r '.[]."lifecycle-state"' 2>/dev/null`
-    inst_name=`cat ${TMP_FILE}_INST  | jq -r '.[]."display-name"' 2>/dev/null`
-    ltag_value_stop=`cat  ${TMP_FILE}_INST| jq -r '.[]."defined-tags".'\"$TAG_NS\"'.'\"$TAG_KEY_STOP\"''  2>/dev/null`
-    ltag_value_start=`cat ${TMP_FILE}_INST| jq -r '.[]."defined-tags".'\"$TAG_NS\"'.'\"$TAG_KEY_START\"'' 2>/dev/null`
-
-    # Is it time to start this instance ?
-    if [ "$inst_status" == "STOPPED" ] && [ "$ltag_value_start" == "$CURRENT_UTC_TIME" ]; then
-        printf "`date '+%Y/%m/%d %H:%M'`, region $lregion, cpt $lcompname: "
-        if [ $CONFIRM_START == true ]; then
-            echo "STARTING instance $inst_name ($inst_id)"
-            oci --profile $PROFILE compute instance action --region $lregion --instance-id $inst_id --action START >/dev/null 2>&1
-        else
-            echo "Instance $inst_name ($inst_id) SHOULD BE STARTED --> re-run script with --confirm_start to actually start instances" 
-        fi
-
-    # Is it time to stop this instance ?
-    elif [ "$inst_status" == "RUNNING" ] && [ "$ltag_value_stop" == "$CURRENT_UTC_TIME" ]; then
-        printf "`date '+%Y/%m/%d %H:%M'`, region $lregion, cpt $lcompname: "
-        if [ $CONFIRM_STOP == true ]; then
-            echo "STOPPING instance $inst_name ($inst_id)"
-            oci --profile $PROFILE compute instance action --region $lregion --instance-id $inst_id --action SOFTSTOP >/dev/null 2>&1
-        else
-            echo "Instance $inst_name ($inst_id) SHOULD BE STOPPED --> re-run script with --confirm_stop to actually stop instances"
-        fi
-    fi
-    rm -f ${TMP_FILE}_INST
-  done
-  rm -f $TMP_FILE
-}
-
-# -- Exit script with return code
-my_exit()
-{
-  CR=$1   # return code
-  echo "`date '+%Y/%m/%d %H:%M'`: END SCRIPT PID=$PID"
-  exit $CR
-}
-
-# -- Get the current region from the profile
-get_region_from_profile()
-{
-  egrep "^\[|^region" ${OCI_CONFIG_FILE} | fgrep -A 1 "[${PROFILE}]" |grep "^region" > $TMP_FILE 2>&1
-  if [ $? -ne 0 ]; then echo "ERROR: region not found in OCI config file $OCI_CONFIG_FILE for profile $PROFILE !"; cleanup; my_exit 5; fi
-  awk -F'=' '{ print $2 }' $TMP_FILE | sed 's# ##g'
-}
-
-# -- Get the list of all active regions
-get_all_active_regions()
-{
-  oci --profile $PROFILE iam region-subscription list --query "data [].{Region:\"region-name\"}" |jq -r '.[].Region'
-}
-
-# -------- main
-
-# -- variables
-OCI_CONFIG_FILE=~/.oci/config
-ALL_REGIONS=false
-CONFIRM_STOP=false
-CONFIRM_START=false
-TMP_FILE=/tmp/tmp_$$
-PID=$$
-LOCK_FILE=/tmp/`basename $0`.lock
-
-# -- args parsing
-if [ "$1" == "-a" ]; then ALL_REGIONS=true; shift; fi
-if [ "$1" == "--confirm_stop" ]; then CONFIRM_STOP=true; shift; fi
-if [ "$1" == "--confirm_start" ]; then CONFIRM_START=true; shift; fi
-
-if [ $# -ne 1 ]; then usage; fi
-PROFILE=$1
-
-if [ "$PROFILE" == "-h" ] || [ "PROFILE" == "--help" ]; then usage; fi
-
-# -- starting
-echo "`date '+%Y/%m/%d %H:%M'`: BEGIN SCRIPT PID=$PID"
-
-# -- Get current time in UTC timezone in format "HH:00 UTC"
-# -- This will be compared to tag values
-CURRENT_UTC_TIME=`TZ=UTC date '+%H:00_UTC'`
-
-# -- Check if oci is installed
-which oci > /dev/null 2>&1
-if [ $? -ne 0 ]; then echo "ERROR: oci not found !"; my_exit 2; fi
-
-# -- Check if jq is installed
-which jq > /dev/null 2>&1
-if [ $? -ne 0 ]; then echo "ERROR: jq not found !"; my_exit 3; fi
-
-# -- Check if the PROFILE exists
-grep "\[$PROFILE\]" $OCI_CONFIG_FILE > /dev/null 2>&1
-if [ $? -ne 0 ]; then echo "ERROR: PROFILE $PROFILE does not exist in file $OCI_CONFIG_FILE !"; my_exit 4; fi
-
-# -- If this script is already running, exit with an error message
-if [ -f $LOCK_FILE ]; then
-    echo "ERROR: lock file detected, meaning another instance of this script is already running."
-    my_exit 99 false
-else
-    touch $LOCK_FILE
-fi
-
-# -- get tenancy OCID from OCI PROFILE
-TENANCYOCID=`egrep "^\[|ocid1.tenancy" $OCI_CONFIG_FILE|sed -n -e "/\[$PROFILE\]/,/tenancy/p"|tail -1| awk -F'=' '{ print $2 }' | sed 's/ //g'`
-
-# -- set the list of regions
-if [ $ALL_REGIONS == true ]; then
-    REGIONS_LIST=`get_all_active_regions`
-else
-    REGIONS_LIST=`get_region_from_profile`
-fi
-
-# -- process required regions list
-for region in $REGIONS_LIST
-do
-  # -- list instances in the root compartment
-  process_compartment $TENANCYOCID root $region
+SCRIPT="$(dirname "$0")/../OCI_resources_stop_start_tagged.py"
 
-  # -- list instances compartment by compartment (excluding root compartment but including all subcompartments). Only ACTIVE compartments
-  oci --profile $PROFILE iam compartment list -c $TENANCYOCID --compartment-id-in-subtree true --all --query "data [?\"lifecycle-state\" == 'ACTIVE']" 2>/dev/null| egrep "^ *\"name|^ *\"id"|awk -F'"' '{ print $4 }' | while read compid
-  do
-    read compname
-    process_compartment $compid $compname $region
-  done
-done
+# -- same arguments as the new script: only the resource type is added
+case "$1" in
+  -h|--help|"") usage ;;
+esac
 
-# -- the end
-rm -f $TMP_FILE
-rm -f $LOCK_FILE
-my_exit 0
\ No newline at end of file
+exec python3 "$SCRIPT" --types instance "$@"
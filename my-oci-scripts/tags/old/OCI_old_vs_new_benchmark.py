@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# --------------------------------------------------------------------------------------------------------------------------
+# This script compares the number of OCI API calls made by an old script and by the script replacing it
+#
+# Both scripts are executed in this process with the same OCI Python SDK, and every HTTP request sent by any OCI client
+# is counted (BaseClient.call_api), per method and resource path, as well as the number of OCI clients created.
+# With --each, the old script is executed once per OCID of a file ({} in its arguments is replaced by the OCID),
+# like a cron job calling a per-resource script in a loop, and the new script is executed once (bulk mode).
+#
+# Examples:
+#   (get the old version of a script replaced by a shim from git history)
+#   git show $(git log -1 --format=%h -- OCI_instance_add_tag.py)^:./OCI_instance_add_tag.py > /tmp/OCI_instance_add_tag_old.py
+#   OCI_old_vs_new_benchmark.py --each ocids.txt /tmp/OCI_instance_add_tag_old.py PROFILE {} osc env prod \
+#       -- ../OCI_object_add_tag.py PROFILE --file ocids.txt osc env prod
+#   OCI_old_vs_new_benchmark.py /tmp/OCI_instances_list_tagged_old.py -a PROFILE osc env -- ../OCI_instances_list_tagged.py -a PROFILE osc env
+#
+# Note: only Python scripts can be compared (the old shell scripts start one OCI CLI process per API call)
+# Author        : Christophe Pauliat
+# Platforms     : MacOS / Linux
+#
+# prerequisites : - Python 3 with OCI Python SDK installed
+#                 - OCI config file configured with profiles
+# Versions
+#    2020-05-20: Initial Version
+# --------------------------------------------------------------------------------------------------------------------------
+
+# -- import
+import oci
+import os
+import sys
+import time
+import runpy
+import contextlib
+from collections import Counter
+
+# ---------- variables
+calls   = Counter()                     # "METHOD /resource/path" -> number of HTTP requests
+clients = 0                             # number of OCI clients created
+verbose = False                         # display the output of the scripts
+
+# ---------- Functions
+
+# ---- usage syntax
+def usage():
+    print ("Usage: {} [-v] [--each OCIDS_FILE] OLD_SCRIPT [OLD_ARGS ...] -- NEW_SCRIPT [NEW_ARGS ...]".format(sys.argv[0]))
+    print ("")
+    print ("    -v     : display the output of the scripts")
+    print ("    --each : execute the old script once per OCID in OCIDS_FILE ({} in OLD_ARGS is replaced by the OCID)")
+    print ("")
+    exit (1)
+
+# ---- count the HTTP requests and the clients created by all OCI clients
+def install_counters():
+    call_api = oci.base_client.BaseClient.call_api
+    init     = oci.base_client.BaseClient.__init__
+
+    def counting_call_api(self, resource_path, method, *args, **kwargs):
+        calls["{:s} {:s}".format(method, resource_path)] += 1
+        return call_api(self, resource_path, method, *args, **kwargs)
+
+    def counting_init(self, *args, **kwargs):
+        global clients
+        clients += 1
+        init(self, *args, **kwargs)
+
+    oci.base_client.BaseClient.call_api = counting_call_api
+    oci.base_client.BaseClient.__init__ = counting_init
+
+# ---- execute a script in this process with arguments, returns its exit code
+def run_script(script, args):
+    sys.argv = [ script ] + args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 0
+    except Exception as e:
+        print ("WARNING: {:s} {:s} stopped with exception {:s}".format(script, " ".join(args), repr(e)))
+        return -1
+    finally:
+        sys.path.pop(0)
+    return 0
+
+# ---- execute a script (once, or once per OCID), returns the API calls counts, number of clients, exit codes and duration
+def measure(script, args, ocids=None):
+    global clients
+    calls.clear()
+    clients = 0
+    start = time.time()
+    if ocids == None:
+        codes = [ run_script(script, args) ]
+    else:
+        codes = [ run_script(script, [ arg.replace("{}", ocid) for arg in args ]) for ocid in ocids ]
+    return Counter(calls), clients, codes, time.time() - start
+
+# ---- display the comparison
+def report(old, new):
+    old_calls, old_clients, old_codes, old_time = old
+    new_calls, new_clients, new_codes, new_time = new
+    print ("{:<70s} {:>8s} {:>8s}".format("API call", "old", "new"))
+    for key in sorted(set(old_calls) | set(new_calls)):
+        print ("{:<70s} {:>8d} {:>8d}".format(key, old_calls[key], new_calls[key]))
+    print ("{:<70s} {:>8d} {:>8d}".format("TOTAL API calls", sum(old_calls.values()), sum(new_calls.values())))
+    print ("{:<70s} {:>8d} {:>8d}".format("OCI clients created", old_clients, new_clients))
+    print ("{:<70s} {:>8d} {:>8d}".format("executions", len(old_codes), len(new_codes)))
+    print ("{:<70s} {:>8d} {:>8d}".format("executions with exit code != 0", sum(1 for c in old_codes if c != 0), sum(1 for c in new_codes if c != 0)))
+    print ("{:<70s} {:>8.1f} {:>8.1f}".format("duration (seconds)", old_time, new_time))
+
+# ------------ main
+
+# -- parse arguments
+args = sys.argv[1:]
+each_file = None
+while len(args) > 0 and args[0] in [ "-v", "--each" ]:
+    if args[0] == "-v":
+        verbose = True
+        args.pop(0)
+    elif len(args) > 1:
+        each_file = args[1]
+        args = args[2:]
+    else:
+        usage()
+if "--" not in args: usage()
+old_args = args[:args.index("--")]
+new_args = args[args.index("--")+1:]
+if len(old_args) < 1 or len(new_args) < 1: usage()
+
+# -- read the OCIDs
+ocids = None
+if each_file != None:
+    try:
+        with open(each_file, "r") as f:
+            ocids = [ line.strip() for line in f if line.strip() != "" and not line.startswith("#") ]
+    except OSError:
+        print ("ERROR 02: cannot read file {} !".format(each_file))
+        exit (2)
+
+# -- execute the old script, then the new script, and compare
+install_counters()
+old = measure(old_args[0], old_args[1:], ocids)
+new = measure(new_args[0], new_args[1:])
+report(old, new)
+
+# -- the end
+exit (0)